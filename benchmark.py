@@ -0,0 +1,370 @@
+"""
+    End-to-end benchmark of the data preparation on a small synthetic library, with regression gating.
+
+    Generates HDR10 PQ, HLG and SDR test clips (testsrc2 with temporal noise) in a temporary folder and runs the stages
+    one after the other, on one core each, with the functions the scripts use:
+        classify  remove_non_HDR.is_video_hdr        files/s
+        catalog   filter_HDR.get_metadata            files/s
+        clips     get_clips.extract_clips            encoded fps, source MB/s
+        ladder    bitladder.compress_vid             encoded fps (all rungs)
+        frames    extract_frames.extract_clip_frames saved frames/s, MB/s written
+        decode    read_hdr_10bit.iter_yuv_batches    decoded frames/s, raw MB/s
+        read      frame_store.open_frame().load()    frames/s, MB/s
+    and reports the peak memory of each stage: Python allocations (tracemalloc) and the largest ffmpeg/ffprobe child
+    (from the proc_trace records).
+
+    The ladder is bitladder.csv scaled to the fixture size (dimensions by width/3840, bitrates by the pixel count), so
+    every rung is encoded as in production, just on fewer pixels. Clips are 10s, as in get_clips_MultiProcess.py.
+
+    The results are compared to a stored baseline: a throughput more than --tolerance below it, or a peak memory more
+    than --tolerance (and 16 MB) above it, is a regression and the command exits with 1. Baselines are per machine;
+    record one with --save_baseline (best of --repeat runs is kept for both).
+
+    Usage:
+        python benchmark.py --save_baseline                     # record ./benchmark_baseline.json
+        python benchmark.py --tolerance 0.15 --output run.json  # compare to it
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+import tracemalloc
+from glob import glob
+from contextlib import contextmanager
+import pandas as pd
+
+import proc_trace
+import remove_non_HDR
+import filter_HDR
+import get_clips_MultiProcess as get_clips
+import bitladder
+import extract_frames
+from pipeline import DataPipeline
+from read_hdr_10bit import iter_yuv_batches
+from frame_store import open_frame, LAYOUTS
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+# Synthetic sources: name -> (is HDR, encoder options)
+MASTER_DISPLAY = "G(13250,34500)B(7500,3000)R(34000,16000)WP(15635,16450)L(10000000,50)"
+FIXTURES = {
+    'pq': (True, ['-pix_fmt', 'yuv420p10le', '-c:v', 'libx265', '-preset', 'ultrafast',
+                  '-x265-params', f'log-level=error:colorprim=bt2020:transfer=smpte2084:colormatrix=bt2020nc:master-display={MASTER_DISPLAY}:max-cll=1000,400',
+                  '-color_primaries', 'bt2020', '-color_trc', 'smpte2084', '-colorspace', 'bt2020nc', '-color_range', 'tv']),
+    'hlg': (True, ['-pix_fmt', 'yuv420p10le', '-c:v', 'libx265', '-preset', 'ultrafast',
+                   '-x265-params', 'log-level=error:colorprim=bt2020:transfer=arib-std-b67:colormatrix=bt2020nc',
+                   '-color_primaries', 'bt2020', '-color_trc', 'arib-std-b67', '-colorspace', 'bt2020nc', '-color_range', 'tv']),
+    'sdr': (False, ['-pix_fmt', 'yuv420p', '-c:v', 'libx264', '-preset', 'ultrafast',
+                    '-color_primaries', 'bt709', '-color_trc', 'bt709', '-colorspace', 'bt709', '-color_range', 'tv']),
+}
+
+STAGES = ['classify', 'catalog', 'clips', 'ladder', 'frames', 'decode', 'read']
+HIGHER_IS_BETTER = ['files_per_s', 'encoded_fps', 'frames_per_s', 'mb_per_s']
+LOWER_IS_BETTER = ['py_peak_mb', 'child_peak_mb']
+# memory changes below this are noise (allocator, page cache), whatever the relative change
+MEMORY_SLACK_MB = 16
+
+"""
+    Sources are named <kind>_<duration>.mp4, the duration suffix that clip_start_times expects.
+"""
+def make_fixtures(folder, width, height, fps, duration):
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for kind, (_, options) in FIXTURES.items():
+        path = os.path.join(folder, f"bench_{kind}_{duration}.mp4")
+        cmd = [proc_trace.FFMPEG, '-y', '-v', 'error', '-f', 'lavfi',
+               '-i', f"testsrc2=size={width}x{height}:rate={fps}:duration={duration}",
+               '-vf', 'noise=alls=8:allf=t', '-an', *options, path]
+        proc_trace.run(cmd, stage='fixtures', file=path, check=True)
+        paths.append(path)
+    return paths
+
+def scaled_ladder(bit_ladder_csv, width, height):
+    # even dimensions for 4:2:0
+    scale, area = width / 3840, (width * height) / (3840 * 2160)
+    return {name: [bitrate * area, 2 * max(1, round(w * scale / 2)), 2 * max(1, round(h * scale / 2))]
+            for name, (bitrate, w, h) in bitladder.load_ladder(bit_ladder_csv).items()}
+
+def folder_bytes(paths):
+    return sum(os.path.getsize(p) for p in paths)
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+class StageMeter:
+    """
+    Times one stage, tags its child processes with the stage name and tracks the Python peak memory of the stage.
+    Fill files / frames / nbytes inside the block; metrics() turns them into rates.
+    """
+    def __init__(self, stage):
+        self.stage = stage
+        self.files = 0
+        self.frames = 0
+        self.encoded = 0
+        self.nbytes = 0
+
+    def __enter__(self):
+        self._tag = proc_trace.tag(stage=self.stage)
+        self._tag.__enter__()
+        tracemalloc.reset_peak()
+        self.start = time.perf_counter()
+        self.start_cpu = os.times()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self.start
+        end_cpu = os.times()
+        # CPU time of the ffmpeg/ffprobe children that finished in the stage (used by cost_estimate.py)
+        self.child_cpu = (end_cpu.children_user - self.start_cpu.children_user) + (end_cpu.children_system - self.start_cpu.children_system)
+        self.py_peak = tracemalloc.get_traced_memory()[1]
+        self._tag.__exit__(*exc)
+
+    def metrics(self):
+        rate = lambda count: count / self.seconds if count else None
+        return {
+            'seconds': self.seconds,
+            'files_per_s': rate(self.files),
+            'encoded_fps': rate(self.encoded),
+            'frames_per_s': rate(self.frames),
+            'mb_per_s': rate(self.nbytes / 2**20),
+            'py_peak_mb': self.py_peak / 2**20,
+            'child_cpu_s': self.child_cpu,
+        }
+
+"""
+    One pass of every stage over the fixtures. Returns {stage: metrics}.
+"""
+def run_stages(fixtures, work_dir, args, ladder):
+    clips_dir, ladder_dir, frames_dir = [os.path.join(work_dir, d) for d in ['clips', 'ladder', 'frames']]
+    for folder in [clips_dir, ladder_dir, frames_dir]:
+        shutil.rmtree(folder, ignore_errors=True)
+        os.makedirs(folder)
+    meters = []
+
+    with StageMeter('classify') as m:
+        hdr = [v for v in fixtures if remove_non_HDR.is_video_hdr(v)]
+        m.files = len(fixtures)
+    meters.append(m)
+    expected = [v for v in fixtures if FIXTURES[os.path.basename(v).split('_')[1]][0]]
+    if hdr != expected:
+        raise RuntimeError(f"classification changed: HDR={hdr}, expected {expected}")
+
+    with StageMeter('catalog') as m:
+        df = pd.DataFrame(columns=DataPipeline.CATALOG_COLUMNS)
+        for count, video in enumerate(hdr):
+            df = filter_HDR.add_metadata(df, video, filter_HDR.get_metadata(video), count)
+        df = filter_HDR.add_derived_columns(df)
+        m.files = len(hdr)
+    meters.append(m)
+
+    # same per-pixel bitrate as the 50 Mbps 4K clips
+    bitrate = max(1, int(50000 * args.width * args.height / (3840 * 2160)))
+    start_times = [1 + get_clips.CLIP_SECONDS * i for i in range(args.clips_per_source)]
+    with StageMeter('clips') as m:
+        for _, row in df.iterrows():
+            get_clips.extract_clips(row['video_path'], start_times, row['color_transfer'], clips_dir, bitrate=bitrate)
+        clips = sorted(glob(os.path.join(clips_dir, "*.mp4")))
+        m.files = len(df)
+        m.encoded = len(clips) * get_clips.CLIP_SECONDS * args.fps
+        m.nbytes = folder_bytes(df['video_path'])
+    meters.append(m)
+    if len(clips) != len(df) * len(start_times):
+        raise RuntimeError(f"{len(clips)} clips written, expected {len(df) * len(start_times)}")
+
+    with StageMeter('ladder') as m:
+        rungs = []
+        for clip in clips:
+            rungs += bitladder.compress_vid(clip, ladder_dir, ladder)
+        m.files = len(clips)
+        m.encoded = len(rungs) * get_clips.CLIP_SECONDS * args.fps
+        m.nbytes = folder_bytes(clips)
+    meters.append(m)
+    missing = [r for r in rungs if not os.path.exists(r)]
+    if missing:
+        raise RuntimeError(f"ladder rungs not written: {missing}")
+
+    with StageMeter('frames') as m:
+        for rung in rungs:
+            saved, _ = extract_frames.extract_clip_frames(rung, frames_dir, args.num_frames, args.layout, threads=1)
+            m.frames += len(saved)
+        frames = sorted(glob(os.path.join(frames_dir, "*.npy")))
+        m.files = len(rungs)
+        m.nbytes = folder_bytes(frames)
+    meters.append(m)
+
+    with StageMeter('decode') as m:
+        for clip in clips:
+            for y, u, v in iter_yuv_batches(clip, batch_size=8, threads=1):
+                m.frames += y.shape[0]
+                m.nbytes += y.nbytes + u.nbytes + v.nbytes
+        m.files = len(clips)
+    meters.append(m)
+
+    with StageMeter('read') as m:
+        for path in frames:
+            frame = open_frame(path).load()
+            m.nbytes += frame.nbytes
+        m.files = m.frames = len(frames)
+    meters.append(m)
+
+    return {m.stage: m.metrics() for m in meters}
+
+def child_peaks(trace_path):
+    if not os.path.exists(trace_path):
+        return {}
+    df = proc_trace.load_trace([trace_path])
+    return (df.groupby('stage')['maxrss_kb'].max() / 1024).to_dict()
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+"""
+    Best of the repeated runs: highest throughput, lowest time and memory per metric.
+"""
+def best_of(runs):
+    best = {}
+    for stage in STAGES:
+        metrics = [run[stage] for run in runs if stage in run]
+        best[stage] = {}
+        for key in metrics[0]:
+            values = [m[key] for m in metrics if m[key] is not None]
+            if not values:
+                best[stage][key] = None
+            elif key in HIGHER_IS_BETTER:
+                best[stage][key] = max(values)
+            else:
+                best[stage][key] = min(values)
+    return best
+
+def compare(results, baseline, tolerance):
+    """
+    Per-stage comparison table and the list of regressions beyond tolerance.
+    """
+    rows, regressions = [], []
+    for stage, metrics in results['stages'].items():
+        reference = baseline['stages'].get(stage, {})
+        for key in HIGHER_IS_BETTER + LOWER_IS_BETTER:
+            value, base = metrics.get(key), reference.get(key)
+            if value is None or not base:
+                continue
+            change = value / base - 1
+            if key in HIGHER_IS_BETTER:
+                regressed = change < -tolerance
+            else:
+                regressed = change > tolerance and value - base > MEMORY_SLACK_MB
+            rows.append({'stage': stage, 'metric': key, 'baseline': base, 'current': value,
+                         'change': f"{change:+.1%}", 'status': 'REGRESSION' if regressed else 'ok'})
+            if regressed:
+                regressions.append(f"{stage} {key}: {base:.2f} -> {value:.2f} ({change:+.1%})")
+    return pd.DataFrame(rows), regressions
+
+@contextmanager
+def redirect_stderr(log_path):
+    # ffmpeg/x265 logs of the stages go to a file (inherited fd 2), so the report stays readable
+    sys.stderr.flush()
+    saved = os.dup(2)
+    with open(log_path, 'ab') as log:
+        os.dup2(log.fileno(), 2)
+    try:
+        yield
+    finally:
+        sys.stderr.flush()
+        os.dup2(saved, 2)
+        os.close(saved)
+
+def ffmpeg_version():
+    result = proc_trace.run([proc_trace.FFMPEG, '-version'], stage='fixtures', capture_output=True, text=True)
+    return result.stdout.splitlines()[0] if result.stdout else 'unknown'
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+def main(args):
+    duration = get_clips.CLIP_SECONDS * args.clips_per_source + 2
+    config = {'width': args.width, 'height': args.height, 'fps': args.fps, 'clips_per_source': args.clips_per_source,
+              'num_frames': args.num_frames, 'layout': args.layout}
+    ladder = scaled_ladder(args.bit_ladder_csv, args.width, args.height)
+    if min(min(w, h) for _, w, h in ladder.values()) < 32:
+        print("Fixtures too small: x265 needs every ladder rung to be at least 32 pixels (use --width 320 or more)")
+        return 2
+    work_dir = tempfile.mkdtemp(prefix="hidro_bench_", dir=args.tmp_dir)
+    trace_path = os.path.join(work_dir, "trace.jsonl")
+    proc_trace.set_trace_file(trace_path)
+    print(f"Work folder: {work_dir}")
+    print(f"ffmpeg: {proc_trace.FFMPEG}, ffprobe: {proc_trace.FFPROBE}")
+    print(f"Ladder: {ladder}")
+
+    try:
+        fixtures = make_fixtures(os.path.join(work_dir, 'sources'), args.width, args.height, args.fps, duration)
+        runs = []
+        tracemalloc.start()
+        for i in range(args.repeat):
+            with redirect_stderr(os.path.join(work_dir, "stderr.log")):
+                runs.append(run_stages(fixtures, work_dir, args, ladder))
+            print(f"Run {i + 1}/{args.repeat}: " + ", ".join(f"{s} {runs[-1][s]['seconds']:.1f}s" for s in STAGES))
+        tracemalloc.stop()
+        stages = best_of(runs)
+        for stage, peak in child_peaks(trace_path).items():
+            if stage in stages:
+                stages[stage]['child_peak_mb'] = peak
+    finally:
+        proc_trace.set_trace_file(None)
+        if args.keep:
+            print(f"Kept {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    results = {'config': config, 'ladder': ladder, 'host': socket.gethostname(), 'cpus': os.cpu_count(),
+               'ffmpeg': ffmpeg_version(), 'date': time.strftime("%Y-%m-%d %H:%M:%S"), 'stages': stages}
+    with pd.option_context('display.width', 200, 'display.max_columns', 20, 'display.float_format', '{:.2f}'.format):
+        print(pd.DataFrame(stages).T[['seconds', 'child_cpu_s'] + HIGHER_IS_BETTER + LOWER_IS_BETTER])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --save_baseline to record one")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline['config'] != config or baseline['ladder'] != ladder:
+        print(f"Baseline was recorded with other fixtures ({baseline['config']}), not comparable")
+        return 2
+    if baseline['ffmpeg'] != results['ffmpeg']:
+        print(f"NOTE: baseline used another ffmpeg ({baseline['ffmpeg']})")
+
+    table, regressions = compare(results, baseline, args.tolerance)
+    with pd.option_context('display.width', 200, 'display.max_rows', 100, 'display.float_format', '{:.2f}'.format):
+        print(table.to_string(index=False))
+    if regressions:
+        print(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%}:")
+        for r in regressions:
+            print("  " + r)
+        return 1
+    print(f"No regression beyond {args.tolerance:.0%}")
+    return 0
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bit_ladder_csv', type=str, default="bitladder.csv", help='Ladder to scale to the fixture size')
+    parser.add_argument('--width', type=int, default=640, help='Fixture width')
+    parser.add_argument('--height', type=int, default=360, help='Fixture height')
+    parser.add_argument('--fps', type=int, default=25, help='Fixture frame rate')
+    parser.add_argument('--clips_per_source', type=int, default=1, help='10s clips cut from each HDR fixture')
+    parser.add_argument('--num_frames', type=int, default=2, help='Frames extracted from each rung')
+    parser.add_argument('--layout', type=str, default="rgb", choices=LAYOUTS, help='Storage layout of the saved frames')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per stage (best is kept)')
+    parser.add_argument('--baseline', type=str, default="benchmark_baseline.json", help='Baseline results')
+    parser.add_argument('--save_baseline', action='store_true', help='Store these results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative regression')
+    parser.add_argument('--output', type=str, default=None, help='Also write the results to this JSON file')
+    parser.add_argument('--tmp_dir', type=str, default=None, help='Where to create the work folder (default: system temp)')
+    parser.add_argument('--keep', action='store_true', help='Keep the work folder (fixtures, outputs, trace.jsonl, stderr.log)')
+    args = parser.parse_args()
+
+    sys.exit(main(args))
@@ -26,6 +26,11 @@ import numpy as np
 import json
 import subprocess
 import argparse
+import proc_trace
+import staging
+import source_cache
+import chunked_encode
+from hdr_stats import video_stats
 
 #--------------------------------------------------------------*****--------------------------------------------------------------#
 # Default master display values for HDR10 
@@ -47,25 +52,25 @@ def default_display_dict():
 def parse_probe_out(filename):
 
     # Get the fps 
-    fps_cmnd = ['ffprobe', '-v', 'error', '-select_streams', 'v', '-of',
+    fps_cmnd = [proc_trace.FFPROBE, '-v', 'error', '-select_streams', 'v', '-of',
                 'default=noprint_wrappers=1:nokey=1', '-show_entries', 'stream=r_frame_rate', filename]
 
-    p = subprocess.Popen(fps_cmnd, stdout=subprocess.PIPE,
-                         stderr=subprocess.PIPE)
-    fps_out, err = p.communicate()
+    p = proc_trace.run(fps_cmnd, stage='ladder', file=filename, stdout=subprocess.PIPE,
+                       stderr=subprocess.PIPE)
+    fps_out, err = p.stdout, p.stderr
     fps_out = fps_out.decode()
     fps = eval(fps_out.split('\r')[0])
 
     # skip
 
     # Get the metadata
-    cmnd = ['ffprobe', '-hide_banner', '-probesize', '100', '-select_streams', 'v',
+    cmnd = [proc_trace.FFPROBE, '-hide_banner', '-probesize', '100', '-select_streams', 'v',
             '-print_format', 'json', '-read_intervals', '%+#300', '-show_frames', '-loglevel', 'warning',
             '-show_entries', 'frame=color_space,color_primaries,color_transfer,side_data_list,pix_fmt', filename]
     # ffprobe command to read the first frameformat (since HDR10, it's sufficient to read the first frame)
     # information about color_space,color_primaries,color_transfer,side_data_list,pix_fmt are extracted to the variable out
-    p = subprocess.Popen(cmnd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    out, err = p.communicate()
+    p = proc_trace.run(cmnd, stage='ladder', file=filename, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = p.stdout, p.stderr
 
     # Get dictionary of metadata 
     out = out.decode()
@@ -77,12 +82,12 @@ def parse_probe_out(filename):
             original_vid =  '/home/shreshth/HDD/SantaFe/Dataset/10k_word_10_20_mins/'+'_'.join(filename.split('/')[-1].split('_')[:-1])+'.webm'
             print(f"Obtaining the side_data_list from original video {original_vid}")
             # get the side_data_list from the original video in one command 
-            orig_cmd = ['ffprobe',
+            orig_cmd = [proc_trace.FFPROBE,
                         '-i', original_vid,
                         '-show_streams', '-show_format', 
                         '-print_format', 'json']
-            p = subprocess.Popen(orig_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            out, err = p.communicate()
+            p = proc_trace.run(orig_cmd, stage='ladder', file=original_vid, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            out, err = p.stdout, p.stderr
             out = out.decode()
             info = json.loads(out)['streams'][0]
             side_info = info['side_data_list'][-1]
@@ -111,52 +116,80 @@ def parse_probe_out(filename):
 
 #--------------------------------------------------------------*****--------------------------------------------------------------#
 # Compression function. Fixed bitrate and scaling resolution, 
-def compress_vid(filename, save_add, ladder, level=5.1):
+# max_cll: "MaxCLL,MaxFALL" for the content light level SEI (see hdr_stats.py), 0,0 if unknown
+# stager: optional staging.OutputStager, to encode on local scratch and copy the rungs to save_add in the background
+# chunk_seconds: encode in GOP-aligned chunks run in parallel (chunked_encode.py), 0 for a single encode
+def compress_vid(filename, save_add, ladder, level=5.1, max_cll="0,0", stager=None, chunk_seconds=0, chunk_workers=4):
 
     # Get the metadata and add input data in the metadata
     side_info, fps = parse_probe_out(filename)
-
+    outnames = [os.path.join(save_add, name + "#" + filename.split("/")[-1]) for name in ladder]
+
+    # the rungs add up to about the bitrate of the reference, so reserve its size on scratch
+    with staging.staged(stager, outnames, reserve=os.path.getsize(filename)) as targets:
+        if chunk_seconds:
+            rates = [(int(bitrate*1000), int(bitrate*2*1000)) for bitrate, _, _ in ladder.values()]
+            chunked_encode.encode_chunked(filename, targets,
+                                          lambda input_args, outputs: ladder_command(input_args, outputs, ladder, side_info, fps, level, max_cll),
+                                          0, chunked_encode.probe_duration(filename, 'ladder'), fps, chunk_seconds, chunk_workers, rates, stage='ladder')
+        else:
+            encode_ladder(filename, targets, ladder, side_info, fps, level, max_cll)
+    return outnames
+
+# Encoder options of one rung, values = [bitrate (Mbps), w, h]; the caller maps the (scaled) input before them.
+# Shared with the fused clip-and-ladder mode of get_clips_MultiProcess.py
+def rung_args(outname, values, side_info, fps, level=5.1, max_cll="0,0"):
+    # getting the values from the ladder dict
+    bitrate, width, height = values
+
+    side_info = dict(side_info)
+    side_info['bitrate'] = int(bitrate*1000) #in kbps
+    side_info['bufsize'] = int(bitrate*2*1000) #in kbps
+    side_info['level'] = level
+    side_info['keyint'] = int(2*fps)
+
+    # either set the bitrate, max, and min-bitrate seperatel or in -x265-params with vbv-maxrate, vbv-bufsize
+    return [
+        '-c:v', 'libx265', '-profile:v', 'main10',
+        '-b:v', f'{side_info["bitrate"]}k',
+        '-map_metadata', '0',
+        '-x265-params', f'hdr-opt=1:repeat-headers=1:keyint={side_info["keyint"]}:colorprim=bt2020:transfer=smpte2084:colormatrix=bt2020nc:master-display=G({side_info["green_x"]},{side_info["green_y"]})B({side_info["blue_x"]},{side_info["blue_y"]})R({side_info["red_x"]},{side_info["red_y"]})WP({side_info["white_point_x"]},{side_info["white_point_y"]})L({side_info["max_luminance"]},{side_info["min_luminance"]}):max-cll={max_cll}:strict-cbr=1:level={side_info["level"]}:vbv-maxrate={side_info["bitrate"]}:vbv-bufsize={side_info["bufsize"]}:',
+        '-preset', 'slow', '-pix_fmt', 'yuv420p10le',
+        outname
+    ]
+
+def ladder_command(input_args, outnames, ladder, side_info, fps, level=5.1, max_cll="0,0"):
     # Prepare the ffmpeg command for multiple outputs 
-    cmd = ['./ffmpeg' , '-i', filename]
-
-    for name, values in ladder.items():
-        # getting the values from the ladder dict
-        bitrate, width, height = values
-        outname = os.path.join(save_add, name + "#" + filename.split("/")[-1])
-
-        side_info['outname'] = outname 
-        side_info['bitrate'] = int(bitrate*1000) #in kbps
-        side_info['bufsize'] = int(bitrate*2*1000) #in kbps
-        side_info['level'] = level
-        side_info['keyint'] = int(2*fps)
-        side_info['w'] = width
-        side_info['h'] = height
-
-        # extending the cmd, either set the bitrate, max, and min-bitrate seperatel or in -x265-params with vbv-maxrate, vbv-bufsize
-        cmd.extend([
-            '-vf', f'scale={width}:{height}', '-an', '-map', '0', '-c:v', 'libx265', '-profile:v', 'main10',
-            '-b:v', f'{side_info["bitrate"]}k',
-            '-map_metadata', '0',
-            '-x265-params', f'hdr-opt=1:repeat-headers=1:keyint={side_info["keyint"]}:colorprim=bt2020:transfer=smpte2084:colormatrix=bt2020nc:master-display=G({side_info["green_x"]},{side_info["green_y"]})B({side_info["blue_x"]},{side_info["blue_y"]})R({side_info["red_x"]},{side_info["red_y"]})WP({side_info["white_point_x"]},{side_info["white_point_y"]})L({side_info["max_luminance"]},{side_info["min_luminance"]}):max-cll=0,0:strict-cbr=1:level={side_info["level"]}:vbv-maxrate={side_info["bitrate"]}:vbv-bufsize={side_info["bufsize"]}:',
-            '-preset', 'slow', '-pix_fmt', 'yuv420p10le', 
-            outname
-        ])
+    cmd = [proc_trace.FFMPEG, *input_args]
+
+    for outname, values in zip(outnames, ladder.values()):
+        width, height = values[1], values[2]
+        cmd.extend(['-vf', f'scale={width}:{height}', '-an', '-map', '0', *rung_args(outname, values, side_info, fps, level, max_cll)])
+    return cmd
+
+def encode_ladder(filename, outnames, ladder, side_info, fps, level=5.1, max_cll="0,0"):
+    cmd = ladder_command(['-i', filename], outnames, ladder, side_info, fps, level, max_cll)
 
     try:
-        subprocess.run(cmd)
+        proc_trace.run(cmd, stage='ladder', file=filename)
     except subprocess.CalledProcessError as e:
         print(e.returncode)
         print(e.output)
     
 #--------------------------------------------------------------*****--------------------------------------------------------------#
-def main(bit_ladder_csv, video_folder, save_add):
-    # Reading the bitladder csv. First row is 60Mbps ref conversion which we can skip, since we already have 50Mbps videos. 
+# Reading the bitladder csv. First row is 60Mbps ref conversion which we can skip, since we already have 50Mbps videos. 
+# Get the ladder as dict : {name: [bitrate1, w, h]}
+def load_ladder(bit_ladder_csv):
     bitladder = pd.read_csv(bit_ladder_csv).drop(0)
-    # Get the ladder as dict : {name: [bitrate1, w, h]}
-    print(bitladder.head())
     ladder = {}
     for i, row in bitladder.iterrows():
         ladder[row['name']] = [row['bitrate'],row['w'], row['h']]
+    return ladder
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+def main(bit_ladder_csv, video_folder, save_add, compute_cll=False, stager=None, cache=None, chunk_seconds=0, chunk_workers=4):
+    ladder = load_ladder(bit_ladder_csv)
+    print(ladder)
 
     # Read all reference videos from folder 
     vids = glob.glob(video_folder + "*.mp4")
@@ -169,13 +202,27 @@ def main(bit_ladder_csv, video_folder, save_add):
     # Existing videos in the save address
     existing = [i.split("#")[-1] for i in os.listdir(save_add)]
 
+    # Prefetch the references still to compress to local disk (source_cache.py)
+    if cache is not None:
+        cache.schedule([vid for vid in vids if vid.split('/')[-1] not in existing])
+
     # Compress only if the video is not already compressed. Check with id of the video and not the name.
     for vid in vids:
         if vid.split('/')[-1] not in existing:
-            # Compress the video 
-            compress_vid(vid, save_add, ladder)
+            with source_cache.using(cache, vid) as local_vid:
+                # Content light levels of the reference (one streaming pass over the decoded clip)
+                max_cll = video_stats(local_vid).max_cll_param() if compute_cll else "0,0"
+                # Compress the video 
+                try:
+                    compress_vid(local_vid, save_add, ladder, max_cll=max_cll, stager=stager, chunk_seconds=chunk_seconds, chunk_workers=chunk_workers)
+                except RuntimeError as e:
+                    print(e)
         else:
             print(f"{vid} already compressed")
+    if stager is not None:
+        stager.close()
+    if cache is not None:
+        cache.close()
 
 #--------------------------------------------------------------*****--------------------------------------------------------------#
 if __name__ == "__main__":
@@ -183,7 +230,11 @@ if __name__ == "__main__":
     parser.add_argument('--bit_ladder_csv', type=str, required=True, help='Path to bit ladder csv')
     parser.add_argument('--video_folder', type=str, default="./HDR_Clips/", help='Path to folder of videos')
     parser.add_argument('--save_add', type=str, default="./HDR_Clips_BitLadder/", help='Path to save the compressed videos')
+    parser.add_argument('--compute_cll', action='store_true', help='Measure MaxCLL/MaxFALL of each reference and signal them in the encodes')
+    staging.add_staging_args(parser)
+    source_cache.add_cache_args(parser)
+    chunked_encode.add_chunk_args(parser)
     args = parser.parse_args()
 
     bit_ladder_csv = "bitladder.csv" 
-    main(args.bit_ladder_csv, args.video_folder, args.save_add)
+    main(args.bit_ladder_csv, args.video_folder, args.save_add, args.compute_cll, staging.from_args(args), source_cache.from_args(args), args.chunk_seconds, args.chunk_workers)
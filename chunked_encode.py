@@ -0,0 +1,172 @@
+"""
+    GOP-aligned chunked encoding of one clip: the time range is split into chunks of whole GOPs (keyint = 2 x fps, as
+    in the encoders of get_clips_MultiProcess.py and bitladder.py), every chunk is encoded by its own ffmpeg process
+    with the same x265 options (rate control, VBV, HDR10 metadata), and the chunks of each output are joined with the
+    concat demuxer and -c copy. The join points are keyframes the single encode would have had anyway, so a clip
+    takes about 1/chunks of the wall time of a single encode, using more of the node when few encodes are left.
+
+    After the concat the joins are verified (verify_joins):
+        * timestamps: frame count, increasing dts, no pts gap or overlap in display order
+        * a keyframe at every join
+        * HDR10 SEI (mastering display) on the frame at every join
+        * VBV: the decoder buffer is simulated over the whole output at the CBR rate; each chunk starts its own model
+          from vbv-init, so an underflow shows up here rather than in the chunks
+    Broken timestamps or missing keyframes raise a RuntimeError (the output is removed); SEI and VBV findings are
+    printed.
+
+    Use through encode_chunked(input_file, outputs, build_command, ...), build_command(input_args, outputs) returning
+    the ffmpeg command of one chunk (get_clips_MultiProcess.py and bitladder.py, --chunk_seconds).
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import subprocess
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+import proc_trace
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+def probe_duration(video_path, stage='chunks'):
+    cmd = [proc_trace.FFPROBE, "-v", "error", "-select_streams", "v:0", "-show_entries", "stream=duration:format=duration",
+           "-of", "json", video_path]
+    result = proc_trace.run(cmd, stage=stage, file=video_path, capture_output=True, text=True)
+    info = json.loads(result.stdout)
+    return float(info['streams'][0].get('duration') or info.get('format', {}).get('duration') or 0)
+
+def chunk_plan(start, duration, fps, chunk_seconds):
+    """
+    (start, frames) of each chunk: whole GOPs of int(2*fps) frames, about chunk_seconds long, the last one takes the rest.
+    """
+    keyint = int(2 * fps)
+    total = int(round(duration * fps))
+    per_chunk = max(1, int(round(chunk_seconds * fps / keyint))) * keyint
+    return [(start + first / fps, min(per_chunk, total - first)) for first in range(0, total, per_chunk)]
+
+def chunk_input_args(input_file, start, frames, fps):
+    # accurate input seek; reading (frames - 1/2) frame durations gives exactly frames frames
+    return ["-ss", f"{start:.6f}", "-t", f"{(frames - 0.5) / fps:.6f}", "-i", input_file]
+
+def concat(chunk_files, output_file, stage='chunks'):
+    listing = output_file + ".concat.txt"
+    with open(listing, "w") as f:
+        for chunk in chunk_files:
+            f.write(f"file '{os.path.abspath(chunk)}'\n")
+    cmd = [proc_trace.FFMPEG, "-v", "error", "-y", "-f", "concat", "-safe", "0", "-i", listing,
+           "-map", "0", "-c", "copy", output_file]
+    try:
+        result = proc_trace.run(cmd, stage=stage, file=output_file, stderr=subprocess.PIPE)
+    finally:
+        os.remove(listing)
+    if result.returncode:
+        raise RuntimeError(f"Concatenating the chunks of {output_file} failed: {result.stderr.decode().strip()}")
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+def _packets(video_path, stage):
+    cmd = [proc_trace.FFPROBE, "-v", "error", "-select_streams", "v:0",
+           "-show_entries", "packet=pts_time,dts_time,size,flags", "-of", "csv=p=0", video_path]
+    result = proc_trace.run(cmd, stage=stage, file=video_path, capture_output=True, text=True)
+    rows = [line.strip().split(',') for line in result.stdout.splitlines() if line.strip()]
+    pts = np.array([float(r[0]) for r in rows])
+    dts = np.array([float(r[1]) if r[1] not in ['', 'N/A'] else np.nan for r in rows])
+    size = np.array([int(r[2]) for r in rows])
+    key = np.array(['K' in r[3] for r in rows], dtype=bool)
+    return pts, dts, size, key
+
+def _hdr_sei(video_path, times, stage):
+    # mastering display metadata of the first frame decoded at each time
+    intervals = ",".join(f"{t:.6f}%+#1" for t in times)
+    cmd = [proc_trace.FFPROBE, "-v", "error", "-select_streams", "v:0", "-read_intervals", intervals,
+           "-show_frames", "-of", "json", video_path]
+    result = proc_trace.run(cmd, stage=stage, file=video_path, capture_output=True, text=True)
+    frames = json.loads(result.stdout or "{}").get('frames', [])
+    return [any('max_luminance' in sd for sd in frame.get('side_data_list', [])) for frame in frames]
+
+def simulate_vbv(size_bytes, fps, bitrate_kbps, bufsize_kbits, init=0.9):
+    """
+    Decoder buffer fullness (bits) before each frame is removed, for a CBR channel (frames in decode order).
+    """
+    fill = bufsize_kbits * 1000 * init
+    per_frame = bitrate_kbps * 1000 / fps
+    levels = np.empty(len(size_bytes))
+    for i, size in enumerate(size_bytes):
+        levels[i] = fill
+        fill = min(fill - size * 8 + per_frame, bufsize_kbits * 1000)
+    return levels
+
+def verify_joins(video_path, plan, fps, bitrate_kbps=None, bufsize_kbits=None, stage='chunks'):
+    """
+    Check the output of a chunked encode at the chunk joins. Returns a dict of findings.
+    """
+    pts, dts, size, key = _packets(video_path, stage)
+    expected = sum(frames for _, frames in plan)
+    order = np.sort(pts)
+    steps = np.diff(order)
+    joins = np.cumsum([frames for _, frames in plan])[:-1]  # first frame of each later chunk, in display order
+    report = {
+        'frames': len(pts),
+        'expected_frames': expected,
+        'dts_not_increasing': int(np.sum(np.diff(dts[~np.isnan(dts)]) <= 0)),
+        'pts_gaps': int(np.sum(np.abs(steps - 1 / fps) > 0.5 / fps)),
+        'joins': len(joins),
+        'joins_without_keyframe': 0,
+        'joins_without_hdr_sei': 0,
+        'vbv_underflows': 0,
+        'vbv_min_fill': None,
+    }
+    if len(joins) and len(order) > joins[-1]:
+        join_pts = order[joins]
+        keyframe_pts = set(np.round(pts[key], 6))
+        report['joins_without_keyframe'] = int(sum(round(t, 6) not in keyframe_pts for t in join_pts))
+        sei = _hdr_sei(video_path, join_pts, stage)
+        report['joins_without_hdr_sei'] = len(join_pts) - int(sum(sei))
+    if bitrate_kbps and bufsize_kbits:
+        levels = simulate_vbv(size, fps, bitrate_kbps, bufsize_kbits) - size * 8
+        report['vbv_underflows'] = int(np.sum(levels < 0))
+        report['vbv_min_fill'] = float(levels.min() / (bufsize_kbits * 1000)) if len(levels) else None
+    return report
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+"""
+    Encode [start, start+duration] of input_file into outputs in GOP-aligned chunks run in parallel, then join them.
+
+    build_command(input_args, outputs): ffmpeg command of one chunk, reading with input_args and writing outputs (in
+    the order of the final outputs). rates: optional (bitrate kbps, bufsize kbits) per output, for the VBV check.
+"""
+def encode_chunked(input_file, outputs, build_command, start, duration, fps, chunk_seconds=2.0, workers=4, rates=None, stage='chunks'):
+    plan = chunk_plan(start, duration, fps, chunk_seconds)
+    folder = tempfile.mkdtemp(prefix=".chunks_", dir=os.path.dirname(os.path.abspath(outputs[0])))
+    chunk_files = [[os.path.join(folder, f"{i:04d}_{os.path.basename(out)}") for i in range(len(plan))] for out in outputs]
+    try:
+        def encode(i):
+            chunk_start, frames = plan[i]
+            cmd = build_command(chunk_input_args(input_file, chunk_start, frames, fps), [files[i] for files in chunk_files])
+            result = proc_trace.run(cmd, stage=stage, file=input_file)
+            if result.returncode:
+                raise RuntimeError(f"Chunk {i} of {input_file} failed with exit code {result.returncode}")
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(encode, range(len(plan))))
+
+        reports = []
+        for k, (output, files) in enumerate(zip(outputs, chunk_files)):
+            concat(files, output, stage)
+            rate = rates[k] if rates else (None, None)
+            report = verify_joins(output, plan, fps, *rate, stage=stage)
+            if report['frames'] != report['expected_frames'] or report['dts_not_increasing'] or report['pts_gaps'] \
+                    or report['joins_without_keyframe']:
+                os.remove(output)
+                raise RuntimeError(f"Chunk joins of {output} are broken: {report}")
+            if report['joins_without_hdr_sei'] or report['vbv_underflows']:
+                print(f"Warning: {output}: {report['joins_without_hdr_sei']} joins without HDR10 SEI, "
+                      f"{report['vbv_underflows']} VBV underflows (min fill {report['vbv_min_fill']})")
+            reports.append(report)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    return reports
+
+def add_chunk_args(parser):
+    parser.add_argument('--chunk_seconds', type=float, default=0, help='Encode each output in GOP-aligned chunks of about this length in parallel (0: single encode)')
+    parser.add_argument('--chunk_workers', type=int, default=4, help='Chunks encoded at the same time per output')
+    return parser
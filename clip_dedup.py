@@ -0,0 +1,206 @@
+"""
+    Near-duplicate clip windows (repeated intros/outros, static slates, re-uploads) dropped before encoding.
+
+    For every catalogued video the clip windows are drawn as get_clips_MultiProcess.py does (clip_start_times), then
+    each window gets a few perceptual hashes: ffmpeg decodes only its keyframes (-skip_frame nokey), downscaled to 32x32
+    luma, and each keyframe becomes a 64-bit DCT hash (the sign of the 8x8 lowest frequencies against their median).
+    Hashing runs in parallel over the videos.
+
+    Windows are then accepted in catalog order against a Hamming-distance index of all accepted hashes (XOR and a
+    byte popcount table over the whole index in one NumPy expression): a window is a duplicate when at least half of
+    its hashes are within --threshold bits of an accepted one. Windows without a decodable keyframe are kept.
+
+    The result is a clip plan (video_path, start, hashes, duplicate_of, keep), used by
+        python get_clips_MultiProcess.py --clip_plan clip_plan.csv
+    to encode only the kept windows. The encode time avoided (clip, ladder and frame decode) is estimated with the
+    cost model of cost_estimate.py (--calibration, see there).
+
+    Usage:
+        python clip_dedup.py --catalog HDR_meta_data_filtered_bfpHDRLIVE_4K_50fps.csv --workers 64 --save_plan clip_plan.csv
+"""
+
+import sys
+import argparse
+import subprocess
+import numpy as np
+import pandas as pd
+from multiprocessing import Pool
+from tqdm import tqdm
+import proc_trace
+
+import bitladder
+import cost_estimate
+import get_clips_MultiProcess as get_clips
+
+HASH_SIZE = 32
+# popcount of every byte value, for Hamming distances between uint64 hashes
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+def _dct_matrix(n):
+    # orthonormal DCT-II basis, rows are frequencies
+    k = np.arange(n)[:, None]
+    m = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    m[0] /= np.sqrt(2)
+    return m
+
+DCT = _dct_matrix(HASH_SIZE)
+
+def phash(frames):
+    """
+    64-bit perceptual hashes of a (frames, 32, 32) luma batch, as uint64.
+    """
+    low = (DCT[:8] @ frames.astype(np.float64) @ DCT[:8].T).reshape(len(frames), 64)
+    # the DC term only carries the brightness, leave it out of the median
+    bits = low > np.median(low[:, 1:], axis=1, keepdims=True)
+    return np.packbits(bits, axis=1).view('>u8').astype(np.uint64).ravel()
+
+def hamming(a, b):
+    """
+    Hamming distances between all pairs of two uint64 hash arrays, shape (len(a), len(b)).
+    """
+    x = np.bitwise_xor(a[:, None], b[None, :])
+    return POPCOUNT[x.view(np.uint8)].reshape(x.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+"""
+    Hashes of up to max_hashes keyframes of one clip window (decoded at 32x32, keyframes only).
+"""
+def window_hashes(video_path, start, duration=get_clips.CLIP_SECONDS, max_hashes=5):
+    cmd = [
+        proc_trace.FFMPEG,
+        '-v', 'error',
+        '-threads', '1',
+        '-skip_frame', 'nokey',
+        '-ss', str(start),
+        '-i', video_path,
+        '-t', str(duration),
+        '-vf', f"scale={HASH_SIZE}:{HASH_SIZE}:flags=area,format=gray",
+        '-fps_mode', 'passthrough',
+        '-f', 'rawvideo',
+        '-'
+    ]
+    result = proc_trace.run(cmd, stage='dedup', file=video_path, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    frames = np.frombuffer(result.stdout, dtype=np.uint8)
+    frames = frames[:len(frames) // HASH_SIZE**2 * HASH_SIZE**2].reshape(-1, HASH_SIZE, HASH_SIZE)
+    if len(frames) > max_hashes:
+        frames = frames[np.linspace(0, len(frames) - 1, max_hashes).round().astype(int)]
+    return phash(frames) if len(frames) else np.empty(0, dtype=np.uint64)
+
+def _hash_worker(job):
+    video_path, start_times, max_hashes = job
+    rows = []
+    for start in start_times:
+        try:
+            hashes = window_hashes(video_path, start, max_hashes=max_hashes)
+        except Exception as e:
+            print(f"{video_path} at {start}s: hashing failed ({e})")
+            hashes = np.empty(0, dtype=np.uint64)
+        rows.append({'video_path': video_path, 'start': int(start), 'hashes': " ".join(f"{h:016x}" for h in hashes)})
+    return rows
+
+"""
+    Candidate windows of every video with their hashes (one video per worker process).
+"""
+def hash_windows(video_paths, workers=None, max_hashes=5, seed=0):
+    # same seeded draws as get_clips_MultiProcess.py, so the plan holds the windows it would encode
+    jobs = [(v, get_clips.clip_start_times(v, seed), max_hashes) for v in video_paths]
+    with Pool(workers) as pool:
+        results = list(tqdm(pool.imap(_hash_worker, jobs), total=len(jobs)))
+    return pd.DataFrame([row for rows in results for row in rows], columns=['video_path', 'start', 'hashes'])
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+class HashIndex:
+    """
+    Growing index of accepted hashes with the window each one belongs to.
+    """
+    def __init__(self, capacity=1024):
+        self.hashes = np.empty(capacity, dtype=np.uint64)
+        self.owner = np.empty(capacity, dtype=np.int64)
+        self.size = 0
+
+    def add(self, hashes, owner):
+        if self.size + len(hashes) > len(self.hashes):
+            capacity = max(2 * len(self.hashes), self.size + len(hashes))
+            self.hashes = np.resize(self.hashes, capacity)
+            self.owner = np.resize(self.owner, capacity)
+        self.hashes[self.size:self.size + len(hashes)] = hashes
+        self.owner[self.size:self.size + len(hashes)] = owner
+        self.size += len(hashes)
+
+    def match(self, hashes, threshold):
+        """
+        Window owning the most hashes within threshold, and the number of query hashes matched (-1, 0 if none).
+        """
+        if self.size == 0 or len(hashes) == 0:
+            return -1, 0
+        close = hamming(hashes, self.hashes[:self.size]) <= threshold
+        matched = close.any(axis=1)
+        if not matched.any():
+            return -1, 0
+        owners = np.bincount(self.owner[:self.size][close.nonzero()[1]])
+        return int(owners.argmax()), int(matched.sum())
+
+"""
+    Greedy deduplication in plan order: keep a window unless half of its hashes match an accepted window.
+"""
+def deduplicate(plan, threshold=10):
+    index = HashIndex()
+    keep, duplicate_of = [], []
+    for i, hashes in enumerate(plan['hashes'].fillna("")):
+        hashes = np.array([int(h, 16) for h in hashes.split()], dtype=np.uint64)
+        owner, matched = index.match(hashes, threshold)
+        if len(hashes) and 2 * matched >= len(hashes):
+            keep.append(False)
+            duplicate_of.append(f"{plan['video_path'].iloc[owner]}@{plan['start'].iloc[owner]}")
+        else:
+            keep.append(True)
+            duplicate_of.append("")
+            index.add(hashes, i)
+    plan = plan.copy()
+    plan['keep'] = keep
+    plan['duplicate_of'] = duplicate_of
+    return plan
+
+def avoided_cpu_seconds(plan, catalog, ladder, model):
+    """
+    CPU seconds of the clip encodes, ladders and frame decodes of the dropped windows (cost_estimate.py model).
+    """
+    dropped = plan[~plan['keep']].merge(catalog, on='video_path', how='left')
+    if dropped.empty:
+        return 0.0
+    fps = dropped['fps'].apply(lambda x: float(x.split("/")[0]) / float(x.split("/")[1]) if isinstance(x, str) else float(x))
+    return float(sum(cost_estimate.clip_cpu_seconds(w, h, f, ladder, model)
+                     for w, h, f in zip(dropped['width'], dropped['height'], fps)))
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+def main(args):
+    catalog = pd.read_csv(args.catalog)
+    ladder = bitladder.load_ladder(args.bit_ladder_csv)
+    model = cost_estimate.calibrate(args.calibration) if args.calibration else cost_estimate.DEFAULT_MODEL
+
+    plan = hash_windows(list(catalog['video_path']), args.workers, args.max_hashes, args.seed)
+    plan = deduplicate(plan, args.threshold)
+    plan.to_csv(args.save_plan, index=False)
+
+    dropped = int((~plan['keep']).sum())
+    print(f"{len(plan)} clip windows in {len(catalog)} videos: {dropped} near-duplicates dropped "
+          f"({int((plan['hashes'].fillna('') == '').sum())} without keyframes kept), plan saved to {args.save_plan}")
+    avoided = avoided_cpu_seconds(plan, catalog, ladder, model)
+    print(f"Encode time avoided: {avoided / 3600:.1f} CPU-hours"
+          + ("" if args.calibration else " (default cost model, pass --calibration for measured speeds)"))
+    return 0
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--catalog', type=str, default="HDR_meta_data_filtered_bfpHDRLIVE_4K_50fps.csv", help='Filtered metadata csv')
+    parser.add_argument('--save_plan', type=str, default="clip_plan.csv", help='Where to save the clip plan (get_clips_MultiProcess.py --clip_plan)')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes (default: all cores)')
+    parser.add_argument('--threshold', type=int, default=10, help='Max Hamming distance (of 64 bits) between near-duplicate keyframes')
+    parser.add_argument('--max_hashes', type=int, default=5, help='Keyframes hashed per clip window')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the clip start draws')
+    parser.add_argument('--bit_ladder_csv', type=str, default="bitladder.csv", help='Path to bit ladder csv (for the time avoided)')
+    parser.add_argument('--calibration', type=str, nargs='+', default=None, help='benchmark.py result files (see cost_estimate.py)')
+    args = parser.parse_args()
+
+    sys.exit(main(args))
@@ -0,0 +1,234 @@
+"""
+    Content descriptors for the catalogued videos (or clips), to pick a diverse subset without watching them:
+        * si, ti         : spatial / temporal information (ITU-T P.910: std of the Sobel magnitude / of the frame
+                           difference of the luma, max over the sampled frames), si_mean / ti_mean for the averages
+        * colourfulness  : Hasler & Suesstrunk on the non-linear R'G'B', mean over the sampled frames
+        * lum_p01 .. p99 : percentiles of the luminance in cd/m^2 (BT.2020 weights on the PQ-decoded RGB; HLG through
+                           the OOTF for a 1000 cd/m^2 display, see hdr_transfer.py), NaN for other transfers
+
+    They are computed on a proxy, not on the full video: ffmpeg seeks to --samples points spread over the video and
+    decodes a burst of --burst consecutive frames at each one, downscaled to --proxy_width inside ffmpeg. A seek only
+    decodes from the previous keyframe, so the cost is about samples x GOP frames per video whatever its length, and
+    Python only sees the small proxy frames (one vectorized pass per burst). TI only uses differences within a burst.
+    Luma is normalised (tv/pc range) and scaled to 0..255, so SI/TI are on the usual P.910 scale; values at proxy
+    resolution are lower than at full resolution, but comparable across the library, which is what the selection needs.
+
+    Files run in parallel (one per worker process, single-threaded ffmpeg). A 4K HEVC source with 1s GOPs takes about
+    10 CPU seconds with the defaults, i.e. the 10k-video library in well under an hour on one 128-core node.
+
+    Usage:
+        python content_descriptors.py --catalog HDR_meta_data_filtered_bfpHDRLIVE_4K_50fps.csv --workers 128
+        python content_descriptors.py --video_folder ./HDR_Clips/ --save_csv clip_descriptors.csv
+"""
+
+import os
+import json
+import argparse
+import subprocess
+import numpy as np
+import pandas as pd
+from glob import glob
+from multiprocessing import Pool
+from tqdm import tqdm
+import proc_trace
+
+from frame_store import yuv420_to_rgb
+from hdr_transfer import BT2020_LUMA, float_to_code, code_to_nits, normalise_code
+
+PERCENTILES = [1, 10, 50, 90, 99]
+DESCRIPTOR_COLUMNS = ['si', 'si_mean', 'ti', 'ti_mean', 'colourfulness'] + [f"lum_p{p:02d}" for p in PERCENTILES] + ['proxy_frames']
+LUMINANCE_TRANSFERS = ['smpte2084', 'arib-std-b67']
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+def probe_video(video_path):
+    """
+    Size, duration, frame rate, transfer and range of the first video stream (one ffprobe call).
+    """
+    cmd = [proc_trace.FFPROBE, "-v", "error", "-select_streams", "v:0",
+           "-show_entries", "stream=width,height,r_frame_rate,color_transfer,color_range,duration:format=duration",
+           "-of", "json", video_path]
+    result = proc_trace.run(cmd, stage='descriptors', file=video_path, capture_output=True, text=True)
+    info = json.loads(result.stdout)
+    stream = info['streams'][0]
+    num, den = stream.get('r_frame_rate', '0/1').split('/')
+    duration = stream.get('duration') or info.get('format', {}).get('duration') or 0
+    return {'width': int(stream['width']), 'height': int(stream['height']),
+            'fps': float(num) / float(den) if float(den) else 0.0, 'duration': float(duration),
+            'transfer': stream.get('color_transfer', 'unknown'),
+            'range': 'pc' if stream.get('color_range') in ['pc', 'jpeg'] else 'tv'}
+
+def proxy_size(width, height, proxy_width):
+    # even dimensions for 4:2:0, aspect ratio kept, never upscaled
+    w = min(proxy_width, width) // 2 * 2
+    h = max(2, int(round(height * w / width / 2)) * 2)
+    return w, h
+
+def sample_times(duration, samples, burst, fps):
+    # burst starts spread evenly, each burst kept inside the video
+    if duration <= 0:
+        return [0.0]
+    span = max(duration - burst / max(fps, 1.0), 0.0)
+    return [span * (i + 0.5) / samples for i in range(samples)]
+
+"""
+    Decode one burst of frames at the proxy size: (frames, h, w) luma, (frames, h/2, w/2) chroma, 10-bit codes.
+"""
+def read_burst(video_path, start, frames, size, threads=1):
+    w, h = size
+    cmd = [
+        proc_trace.FFMPEG,
+        '-v', 'error',
+        '-threads', str(threads),
+        '-ss', f"{start:.3f}",
+        '-i', video_path,
+        '-frames:v', str(frames),
+        '-vf', f"scale={w}:{h}:flags=area,format=yuv420p10le",
+        '-f', 'rawvideo',
+        '-'
+    ]
+    result = proc_trace.run(cmd, stage='descriptors', file=video_path, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    luma, chroma = w * h, (w // 2) * (h // 2)
+    rows = np.frombuffer(result.stdout, dtype='<u2')
+    count = rows.size // (luma + 2 * chroma)
+    rows = rows[:count * (luma + 2 * chroma)].reshape(count, -1)
+    return (rows[:, :luma].reshape(count, h, w),
+            rows[:, luma:luma + chroma].reshape(count, h // 2, w // 2),
+            rows[:, luma + chroma:].reshape(count, h // 2, w // 2))
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+def spatial_information(luma):
+    """
+    Per-frame std of the Sobel gradient magnitude of a (frames, h, w) float batch (border pixels excluded).
+    """
+    gx = (luma[:, :-2, 2:] + 2 * luma[:, 1:-1, 2:] + luma[:, 2:, 2:]
+          - luma[:, :-2, :-2] - 2 * luma[:, 1:-1, :-2] - luma[:, 2:, :-2])
+    gy = (luma[:, 2:, :-2] + 2 * luma[:, 2:, 1:-1] + luma[:, 2:, 2:]
+          - luma[:, :-2, :-2] - 2 * luma[:, :-2, 1:-1] - luma[:, :-2, 2:])
+    return np.sqrt(gx * gx + gy * gy).std(axis=(1, 2))
+
+def temporal_information(luma):
+    """
+    Per-pair std of the difference of consecutive frames of a (frames, h, w) float batch.
+    """
+    return np.diff(luma, axis=0).std(axis=(1, 2))
+
+def colourfulness(rgb):
+    """
+    Hasler & Suesstrunk colourfulness of a (h, w, 3) R'G'B' frame in [0, 1] (scaled to 0..255 like the paper).
+    """
+    r, g, b = rgb[..., 0] * 255, rgb[..., 1] * 255, rgb[..., 2] * 255
+    rg = r - g
+    yb = 0.5 * (r + g) - b
+    return float(np.hypot(rg.std(), yb.std()) + 0.3 * np.hypot(rg.mean(), yb.mean()))
+
+class ContentDescriptors:
+    """
+    Accumulator over decoded bursts of one video.
+
+    Parameters:
+    - range: str, 'tv' or 'pc'
+    - transfer: str, color_transfer; luminance percentiles only for LUMINANCE_TRANSFERS
+    """
+    def __init__(self, range='tv', transfer='smpte2084'):
+        self.range = range
+        self.transfer = transfer
+        self.si, self.ti, self.colour, self.nits = [], [], [], []
+
+    def update(self, y, u, v):
+        """
+        Add one burst of consecutive frames (raw 10-bit code values).
+        """
+        if y.shape[0] == 0:
+            return self
+        luma = normalise_code(y, 10, self.range).astype(np.float32) * 255
+        self.si.append(spatial_information(luma))
+        if y.shape[0] > 1:
+            self.ti.append(temporal_information(luma))
+
+        rgb = np.empty(y.shape[1:] + (3,), dtype=np.float32)
+        for i in range(y.shape[0]):
+            yuv420_to_rgb(y[i], u[i], v[i], range=self.range, out=rgb)
+            self.colour.append(colourfulness(rgb))
+            if self.transfer in LUMINANCE_TRANSFERS:
+                light = code_to_nits(float_to_code(rgb, 16), self.transfer, 16, 'pc')
+                self.nits.append((light @ BT2020_LUMA).ravel())
+        return self
+
+    def result(self):
+        si = np.concatenate(self.si) if self.si else np.array([np.nan])
+        ti = np.concatenate(self.ti) if self.ti else np.array([np.nan])
+        result = {'si': float(si.max()), 'si_mean': float(si.mean()), 'ti': float(ti.max()), 'ti_mean': float(ti.mean()),
+                  'colourfulness': float(np.mean(self.colour)) if self.colour else np.nan,
+                  'proxy_frames': len(self.colour)}
+        values = np.percentile(np.concatenate(self.nits), PERCENTILES) if self.nits else [np.nan] * len(PERCENTILES)
+        for p, value in zip(PERCENTILES, values):
+            result[f"lum_p{p:02d}"] = float(value)
+        return result
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+"""
+    Descriptors of one video from samples bursts of burst frames at proxy_width.
+"""
+def video_descriptors(video_path, samples=10, burst=3, proxy_width=480, threads=1):
+    info = probe_video(video_path)
+    size = proxy_size(info['width'], info['height'], proxy_width)
+    descriptors = ContentDescriptors(info['range'], info['transfer'])
+    for start in sample_times(info['duration'], samples, burst, info['fps']):
+        descriptors.update(*read_burst(video_path, start, burst, size, threads))
+    return descriptors
+
+def _descriptor_worker(job):
+    video_path, samples, burst, proxy_width = job
+    try:
+        result = video_descriptors(video_path, samples, burst, proxy_width).result()
+    except Exception as e:
+        print(f"{video_path}: descriptors failed ({e})")
+        result = {}
+    result['video_path'] = video_path
+    return result
+
+"""
+    Descriptors for many videos in parallel (one video per worker process).
+"""
+def descriptors_parallel(video_paths, workers=None, samples=10, burst=3, proxy_width=480):
+    jobs = [(v, samples, burst, proxy_width) for v in video_paths]
+    with Pool(workers) as pool:
+        results = list(tqdm(pool.imap_unordered(_descriptor_worker, jobs), total=len(jobs)))
+    return pd.DataFrame(results, columns=['video_path'] + DESCRIPTOR_COLUMNS)
+
+"""
+    Catalog with the descriptor columns added (replaced if already there), matched on video_path.
+"""
+def add_to_catalog(catalog, descriptors):
+    catalog = catalog.drop(columns=[c for c in DESCRIPTOR_COLUMNS if c in catalog.columns])
+    return catalog.merge(descriptors, on='video_path', how='left')
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--catalog', type=str, default=None, help='Catalog csv (video_path column); the descriptors are added to it')
+    parser.add_argument('--video_folder', type=str, default=None, help='Folder of videos/clips to describe instead of a catalog')
+    parser.add_argument('--save_csv', type=str, default=None, help='Output csv (default: overwrite --catalog, or content_descriptors.csv)')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes (default: all cores)')
+    parser.add_argument('--samples', type=int, default=10, help='Seek points per video')
+    parser.add_argument('--burst', type=int, default=3, help='Consecutive frames decoded at each seek point')
+    parser.add_argument('--proxy_width', type=int, default=480, help='Width of the decoded proxy')
+    args = parser.parse_args()
+
+    if args.catalog:
+        catalog = pd.read_csv(args.catalog)
+        vids = list(catalog['video_path'])
+    elif args.video_folder:
+        catalog = None
+        vids = sorted(glob(os.path.join(args.video_folder, "*.mp4")))
+    else:
+        parser.error("give --catalog or --video_folder")
+
+    df = descriptors_parallel(vids, args.workers, args.samples, args.burst, args.proxy_width)
+    failed = df['proxy_frames'].isna() | (df['proxy_frames'] == 0)
+    if failed.any():
+        print(f"{int(failed.sum())} of {len(df)} videos without descriptors")
+    if catalog is not None:
+        df = add_to_catalog(catalog, df)
+    df.to_csv(args.save_csv or args.catalog or "content_descriptors.csv", index=False)
+    print(df[DESCRIPTOR_COLUMNS].describe())
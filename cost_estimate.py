@@ -0,0 +1,208 @@
+"""
+    Cost of a data preparation run before it starts: clip and rung counts, CPU-hours, wall time on a given allocation
+    and output storage, from the filtered catalog, the clip policy of get_clips_MultiProcess.py (10s every 130s) and
+    bitladder.csv.
+
+    Encode cost model, per x265 preset (clips use x265's default preset, medium; the ladder uses slow):
+        CPU seconds per frame = a_preset * megapixels^b
+    Decoding (the clip for the ladder, the rungs for frame extraction) is linear in pixels. a and b come from
+    benchmark.py results (--calibration, one or more runs); runs at several fixture sizes fit b, with one size b = 1.
+    Without calibration rough x265 figures (DEFAULT_MODEL) are used and a warning is printed.
+
+    Wall time assumes the tasks are spread evenly over nodes x workers, each task keeping as many cores busy as ffmpeg
+    did in the benchmark (CPU/wall ratio), capped by the cores of a node; the longest single task is a lower bound.
+    Stages are summed as if run one after the other (one job per stage); pipeline.py overlaps them.
+
+    Usage:
+        python benchmark.py --width 1920 --height 1080 --output bench_1080p.json
+        python benchmark.py --width 960 --height 540 --output bench_540p.json
+        python cost_estimate.py --catalog HDR_meta_data_filtered_bfpHDRLIVE_4K_50fps.csv \
+            --calibration bench_1080p.json bench_540p.json --nodes 1 --workers 100 --cores_per_node 128 --quota_tb 20
+"""
+
+import os
+import sys
+import json
+import argparse
+import numpy as np
+import pandas as pd
+
+import bitladder
+import get_clips_MultiProcess as get_clips
+from frame_store import LAYOUTS, DEFAULT_TILE
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+# Rough x265 / HEVC decode figures for 10-bit content (CPU seconds per megapixel-frame), only for a first guess
+DEFAULT_MODEL = {
+    'b': 1.0,
+    'clips': 0.2,
+    'ladder': 0.5,
+    'decode': 0.0015,
+    'parallelism': {'clips': 8.0, 'ladder': 8.0, 'frames': 2.0},
+}
+STAGES = ['clips', 'ladder', 'frames']
+
+"""
+    Fit the cost model on benchmark.py result files.
+"""
+def calibrate(result_paths):
+    runs = []
+    for path in result_paths:
+        with open(path) as f:
+            runs.append(json.load(f))
+    for path, run in zip(result_paths, runs):
+        if 'child_cpu_s' not in run['stages']['clips']:
+            raise ValueError(f"{path} has no CPU times, re-run benchmark.py")
+
+    # clip encodes at each fixture size: (megapixels, CPU seconds per frame)
+    mpix = np.array([r['config']['width'] * r['config']['height'] / 1e6 for r in runs])
+    clip_cost = np.array([r['stages']['clips']['child_cpu_s'] / (r['stages']['clips']['encoded_fps'] * r['stages']['clips']['seconds'])
+                          for r in runs])
+    b = float(np.polyfit(np.log(mpix), np.log(clip_cost), 1)[0]) if len(set(mpix)) > 1 else 1.0
+
+    ladder, decode = [], []
+    for r, mp in zip(runs, mpix):
+        stages = r['stages']
+        clips = stages['ladder']['files_per_s'] * stages['ladder']['seconds']
+        frames_per_clip = get_clips.CLIP_SECONDS * r['config']['fps']
+        work = clips * frames_per_clip * sum((w * h / 1e6) ** b for _, w, h in r['ladder'].values())
+        ladder.append(stages['ladder']['child_cpu_s'] / work)
+        decode.append(stages['decode']['child_cpu_s'] / (stages['decode']['frames_per_s'] * stages['decode']['seconds'] * mp))
+
+    parallelism = {stage: float(np.mean([r['stages'][bench]['child_cpu_s'] / r['stages'][bench]['seconds'] for r in runs]))
+                   for stage, bench in [('clips', 'clips'), ('ladder', 'ladder'), ('frames', 'frames')]}
+    return {'b': b, 'clips': float(np.mean(clip_cost / mpix ** b)), 'ladder': float(np.mean(ladder)),
+            'decode': float(np.mean(decode)), 'parallelism': parallelism}
+
+def frame_bytes(width, height, layout='rgb', tile=DEFAULT_TILE):
+    # sizes of the .npy files written by frame_store.save_frame (float16 RGB, or uint16 I420 planes)
+    if layout == 'yuv420':
+        return width * height * 3
+    if layout == 'tiled':
+        return -(-height // tile) * tile * -(-width // tile) * tile * 6
+    return width * height * 6
+
+def clip_cpu_seconds(width, height, fps, ladder, model, num_frames=1):
+    # one clip through all stages, same terms as estimate(): reference encode, ladder (decode + rungs), frame decodes
+    b = model['b']
+    mpix = width * height / 1e6
+    frames = get_clips.CLIP_SECONDS * fps
+    rungs = list(ladder.values())
+    clip = frames * model['clips'] * mpix ** b
+    rungs_s = frames * (model['decode'] * mpix + model['ladder'] * sum((w * h / 1e6) ** b for _, w, h in rungs))
+    frames_s = frames * num_frames / (num_frames + 1) * model['decode'] * sum(w * h / 1e6 for _, w, h in rungs)
+    return clip + rungs_s + frames_s
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+"""
+    Per-stage plan for a catalog: task and output counts, frames, CPU seconds, longest task and bytes written.
+"""
+def estimate(df, ladder, model, num_frames=1, layout='rgb', clip_bitrate=50000):
+    b = model['b']
+    df = df.copy()
+    # clip_start_times reads the duration from the name; the catalog column is the fallback
+    duration = []
+    for path, seconds in zip(df['video_path'], df['duration(s)']):
+        try:
+            duration.append(get_clips.source_duration(path))
+        except ValueError:
+            duration.append(float(seconds))
+    fps = df['fps_float'] if 'fps_float' in df else df['fps'].apply(lambda x: float(x.split("/")[0]) / float(x.split("/")[1]))
+    df['clips'] = [len(get_clips.clip_windows(d)) for d in duration]
+    df['frames_per_clip'] = get_clips.CLIP_SECONDS * fps
+    df['mpix'] = df['width'] * df['height'] / 1e6
+
+    rungs = list(ladder.values())
+    rung_cost = sum((w * h / 1e6) ** b for _, w, h in rungs)
+    rung_mpix = sum(w * h / 1e6 for _, w, h in rungs)
+    rung_bytes = sum(bitrate * 1e6 / 8 for bitrate, _, _ in rungs) * get_clips.CLIP_SECONDS
+    # the last selected frame bounds the decode: on average n/(n+1) of the rung for n random frames
+    decoded_share = num_frames / (num_frames + 1)
+
+    clip_task = df['clips'] * df['frames_per_clip'] * model['clips'] * df['mpix'] ** b
+    ladder_task = df['frames_per_clip'] * (model['decode'] * df['mpix'] + model['ladder'] * rung_cost)
+    frames_task = df['frames_per_clip'] * decoded_share * model['decode'] * max(w * h / 1e6 for _, w, h in rungs)
+
+    plan = {
+        'clips': {'tasks': int((df['clips'] > 0).sum()), 'outputs': int(df['clips'].sum()),
+                  'frames': float((df['clips'] * df['frames_per_clip']).sum()),
+                  'cpu_s': float(clip_task.sum()), 'longest_s': float(clip_task.max()) if len(df) else 0.0,
+                  'bytes': float(df['clips'].sum() * clip_bitrate * 1000 / 8 * get_clips.CLIP_SECONDS)},
+        'ladder': {'tasks': int(df['clips'].sum()), 'outputs': int(df['clips'].sum()) * len(rungs),
+                   'frames': float((df['clips'] * df['frames_per_clip']).sum()) * len(rungs),
+                   'cpu_s': float((df['clips'] * ladder_task).sum()),
+                   'longest_s': float(ladder_task[df['clips'] > 0].max()) if (df['clips'] > 0).any() else 0.0,
+                   'bytes': float(df['clips'].sum() * rung_bytes)},
+        'frames': {'tasks': int(df['clips'].sum()) * len(rungs), 'outputs': int(df['clips'].sum()) * len(rungs) * num_frames,
+                   'frames': float((df['clips'] * df['frames_per_clip']).sum()) * len(rungs) * decoded_share,
+                   'cpu_s': float((df['clips'] * df['frames_per_clip']).sum() * decoded_share * model['decode'] * rung_mpix),
+                   'longest_s': float(frames_task.max()) if len(df) else 0.0,
+                   'bytes': float(df['clips'].sum() * num_frames * sum(frame_bytes(w, h, layout) for _, w, h in rungs))},
+    }
+    return plan
+
+def wall_time(stage_plan, parallelism, nodes, workers, cores_per_node, efficiency=0.85):
+    # cores kept busy on a node: each worker runs one ffmpeg at the benchmarked CPU/wall ratio
+    busy_cores = min(cores_per_node, workers * parallelism)
+    spread = stage_plan['cpu_s'] / (nodes * busy_cores * efficiency)
+    longest = stage_plan['longest_s'] / min(parallelism, cores_per_node)
+    return max(spread, longest)
+
+def slurm_time(seconds):
+    minutes = int(np.ceil(seconds / 60))
+    return f"{minutes // 60:d}:{minutes % 60:02d}:00"
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+def main(args):
+    df = pd.read_csv(args.catalog)
+    ladder = bitladder.load_ladder(args.bit_ladder_csv)
+    if args.calibration:
+        model = calibrate(args.calibration)
+    else:
+        print("WARNING: no --calibration, using rough default speeds (run benchmark.py on the target nodes)")
+        model = DEFAULT_MODEL
+    print(f"Model: CPU s/frame = a * Mpix^{model['b']:.2f}, a: clips {model['clips']:.4f}, ladder {model['ladder']:.4f}, "
+          f"decode {model['decode']:.5f}; cores per task {model['parallelism']}")
+
+    plan = estimate(df, ladder, model, args.num_frames, args.layout, args.clip_bitrate)
+    rows = []
+    for stage in args.stages:
+        p = plan[stage]
+        wall = wall_time(p, model['parallelism'][stage], args.nodes, args.workers, args.cores_per_node, args.efficiency)
+        rows.append({'stage': stage, 'tasks': p['tasks'], 'outputs': p['outputs'], 'frames(M)': p['frames'] / 1e6,
+                     'cpu_hours': p['cpu_s'] / 3600, 'wall_hours': wall / 3600, 'storage_gb': p['bytes'] / 1e9})
+    table = pd.DataFrame(rows).set_index('stage')
+    table.loc['total'] = table.sum()
+
+    print(f"{len(df)} sources, {len(ladder)} rungs, {args.nodes} node(s) x {args.workers} workers ({args.cores_per_node} cores/node)")
+    with pd.option_context('display.width', 200, 'display.float_format', '{:.2f}'.format):
+        print(table)
+    for stage in args.stages:
+        print(f"{stage}: #SBATCH -t {slurm_time(table.loc[stage, 'wall_hours'] * 3600 * (1 + args.margin))} "
+              f"(+{args.margin:.0%} margin)")
+
+    storage_tb = table.loc['total', 'storage_gb'] / 1e3
+    if args.quota_tb is not None and storage_tb > args.quota_tb:
+        print(f"Output {storage_tb:.2f} TB EXCEEDS the quota of {args.quota_tb:.2f} TB")
+        return 1
+    return 0
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--catalog', type=str, default="HDR_meta_data_filtered_bfpHDRLIVE_4K_50fps.csv", help='Filtered metadata csv')
+    parser.add_argument('--bit_ladder_csv', type=str, default="bitladder.csv", help='Path to bit ladder csv')
+    parser.add_argument('--calibration', type=str, nargs='+', default=None, help='benchmark.py result files (--output)')
+    parser.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES, help='Stages to plan')
+    parser.add_argument('--nodes', type=int, default=1, help='Nodes of the allocation')
+    parser.add_argument('--workers', type=int, default=100, help='Concurrent tasks per node (ibrun -n / --workers)')
+    parser.add_argument('--cores_per_node', type=int, default=os.cpu_count(), help='Cores per node')
+    parser.add_argument('--efficiency', type=float, default=0.85, help='Fraction of the busy cores doing useful work')
+    parser.add_argument('--num_frames', type=int, default=1, help='Frames extracted from each rung')
+    parser.add_argument('--layout', type=str, default="rgb", choices=LAYOUTS, help='Storage layout of the saved frames')
+    parser.add_argument('--clip_bitrate', type=float, default=50000, help='Clip bitrate in kbps (extract_clips)')
+    parser.add_argument('--margin', type=float, default=0.25, help='Safety margin on the suggested time limits')
+    parser.add_argument('--quota_tb', type=float, default=None, help='Storage quota; exit with 1 if the output exceeds it')
+    args = parser.parse_args()
+
+    sys.exit(main(args))
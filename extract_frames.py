@@ -5,6 +5,11 @@
     Extension: 
                 However, in this code, you can extract n-frames from each clips and possibly create a bigger dataset. 
 
+    Clips are processed in parallel by a process pool. Each worker limits ffmpeg to --threads decode threads so that
+    workers x threads matches the core count, and the clip list can additionally be sharded across launcher ranks
+    (ibrun/srun set PMI_RANK/SLURM_PROCID), e.g.:
+        ibrun -n 4 python extract_frames.py --num_frames 1 --clips_path ... --save_path ... --workers 16
+
     - Shreshth Saini, 2023
 """
 
@@ -12,36 +17,44 @@ import numpy as np
 import json
 import os
 import argparse
-from glob import glob
+from glob import glob, escape
 import subprocess
 import time
-import argparse
 import random
+from multiprocessing import Pool
+import proc_trace
+import staging
+from frame_store import save_frame, yuv420_to_rgb, LAYOUTS, DEFAULT_TILE
 
 #--------------------------------------------------------------*****--------------------------------------------------------------#
 """ 
     Helper function to read 10-bit video frames using FFmpeg
 
     NOTE: Structure is same as read_hdr_10bit.read_mp4_10bit(), except here we convert the frames to RGB format.
+    NOTE: output='yuv' skips the conversion and returns the raw (y, u, v) 10-bit planes plus the colour metadata,
+          for the bit-exact 'yuv420' storage layout.
+    NOTE: frame_idx restricts the output to those frame indices and stops decoding after the last one;
+          threads limits the ffmpeg decode threads.
 """
 
-def read_mp4_10bit(video_path, range='tv'):
+def read_mp4_10bit(video_path, range='tv', output='rgb', frame_idx=None, threads=None):
 
     # Get video metadata
     command_probe = [
-        "../HDR_Clips/ffprobe",
+        proc_trace.FFPROBE,
         "-v", "error",
         "-select_streams", "v:0",
-        "-show_entries", "stream=width,height,pix_fmt",
+        "-show_entries", "stream=width,height,pix_fmt,color_range,color_transfer,color_primaries,color_space",
         "-of", "json",
         video_path
     ]
     
-    result = subprocess.run(command_probe, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    result = proc_trace.run(command_probe, stage='frames', file=video_path, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
     video_info = json.loads(result.stdout)
     video_stream = video_info['streams'][0]
     width = int(video_stream['width'])
     height = int(video_stream['height'])
+    color_meta = {k: video_stream[k] for k in ['pix_fmt', 'color_range', 'color_transfer', 'color_primaries', 'color_space'] if k in video_stream}
     
     # Set FFmpeg codec parameters for 10-bit video
     pix_fmt = video_stream.get('pix_fmt', 'yuv420p10le') # Adjust as necessary based on your video's pixel format
@@ -72,22 +85,29 @@ def read_mp4_10bit(video_path, range='tv'):
         bit_depth = 16
     
     cmd = [
-        '../HDR_Clips/ffmpeg', # Adjust as necessary based on your FFmpeg installation
+        proc_trace.FFMPEG, # HIDRO_FFMPEG to use another build
+        *(['-threads', str(threads)] if threads else []),
         '-i', video_path,
         '-f', 'image2pipe',
         '-pix_fmt', pix_fmt,
         '-vcodec', 'rawvideo', '-'
     ]
 
-    pipe = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    pipe = proc_trace.Popen(cmd, stage='frames', file=video_path, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    keep = None if frame_idx is None else set(frame_idx)
+    last = None if frame_idx is None else max(frame_idx)
 
     frames = []
     count = 0
     while True:
         # Read raw frame data
-        raw_frame = pipe.stdout.read(width * height * bytes_per_pixel)
+        raw_frame = pipe.stdout.read(int(width * height * bytes_per_pixel))
         if not raw_frame:
             break
+        if keep is not None and count not in keep:
+            count += 1
+            continue
         
         # Convert raw frame data to a NumPy array
         dtype = np.uint8 if bit_depth == 8 else np.uint16 # making sure we read the correct bit depth
@@ -97,37 +117,105 @@ def read_mp4_10bit(video_path, range='tv'):
         
         # Reshape the NumPy array to separate the Y, U, and V planes
         y_plane = image[:width*height].reshape((height, width))
-        u_plane = image[width*height:width*height + (width//2)*(height//2)].reshape((height//2, width//2)).repeat(2,axis=0).repeat(2,axis=1)
-        v_plane = image[width*height + (width//2)*(height//2):].reshape((height//2, width//2)).repeat(2,axis=0).repeat(2,axis=1)
-        
-        y = y_plane.astype(np.float32)
-        u = u_plane.astype(np.float32)
-        v = v_plane.astype(np.float32)
-
-        # Convert YUV to RGB
-        cb = u - 512
-        cr = v - 512
-        #print(y,cb,cr)
-        r = y+1.4747*cr
-        g = y-0.1645*cb-0.5719*cr
-        b = y+1.8814*cb
-
-        # Scale the values to the range [0, 1]
-        r = (r-64)/(940-64)
-        g = (g-64)/(940-64)
-        b = (b-64)/(940-64)
-
-        r = np.clip(r,0,1)
-        g = np.clip(g,0,1)
-        b = np.clip(b,0,1)
-        
-        image = np.stack((r,g,b),2)
+        u_plane = image[width*height:width*height + (width//2)*(height//2)].reshape((height//2, width//2))
+        v_plane = image[width*height + (width//2)*(height//2):].reshape((height//2, width//2))
 
-        frames.append(image)
+        if output == 'yuv':
+            frames.append((y_plane, u_plane, v_plane))
+        else:
+            # Convert YUV to RGB and scale the values to the range [0, 1] (see frame_store.yuv420_to_rgb)
+            frames.append(yuv420_to_rgb(y_plane, u_plane, v_plane, 'tv'))
         
         count +=1
         #print("Frames Processed : ", count)
-        return np.asarray(frames)  
+        if last is not None and count > last:
+            break
+
+    # no need to decode the rest of the clip
+    pipe.kill()
+    pipe.wait()
+
+    if output == 'yuv':
+        return frames, color_meta
+    return np.asarray(frames)
+
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+""" 
+    Helper function to get the number of frames of a clip (container value, falls back to counting packets).
+"""
+def count_frames(video_path):
+    command_probe = [
+        proc_trace.FFPROBE,
+        "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "stream=nb_frames",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        video_path
+    ]
+    result = proc_trace.run(command_probe, stage='frames', file=video_path, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    try:
+        return int(result.stdout.strip())
+    except ValueError:
+        command_probe[5:7] = ["-count_packets", "-show_entries", "stream=nb_read_packets"]
+        result = proc_trace.run(command_probe, stage='frames', file=video_path, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        return int(result.stdout.strip())
+
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+""" 
+    Worker: extract num_frames random frames from one clip. Skips clips that already have all their frames saved.
+    Frame indices are seeded by the clip name so re-runs pick the same frames.
+
+    Returns (paths of the frames saved, frames decoded).
+"""
+def extract_clip_frames(vid_path, save_path, num_frames=1, layout='rgb', tile=DEFAULT_TILE, threads=None, seed=0, stager=None):
+    name = os.path.basename(vid_path)[:-4]
+    if len(glob(os.path.join(escape(save_path), escape(name) + "_frame_*.npy"))) >= num_frames:
+        return [], 0
+
+    # extracting n-frames (skipping the last few frames of the clip, as before)
+    total = count_frames(vid_path)
+    rng = random.Random(f"{seed}:{name}")
+    idx = sorted(rng.sample(range(max(total - 4, 1)), min(num_frames, max(total - 4, 1))))
+    if not idx:
+        return [], 0
+
+    # frames
+    if layout == 'yuv420':
+        # keep the decoded 10-bit planes as they are: bit-exact and half the bytes of float16 RGB
+        frames, color_meta = read_mp4_10bit(vid_path, 'tv', output='yuv', frame_idx=idx, threads=threads)
+    else:
+        frames, color_meta = np.float16(read_mp4_10bit(vid_path, 'tv', frame_idx=idx, threads=threads)), None
+
+    # saving the frames (through local scratch with a stager, see staging.py; sidecars go along)
+    frame_paths = [os.path.join(save_path, name + "_frame_" + str(id) + ".npy") for id in idx[:len(frames)]]
+    nbytes = sum(sum(p.nbytes for p in f) if isinstance(f, tuple) else f.nbytes for f in frames)
+    with staging.staged(stager, frame_paths, reserve=nbytes) as targets:
+        for target, frame in zip(targets, frames):
+            save_frame(target, frame, layout=layout, tile=tile, meta=color_meta)
+    return frame_paths, idx[-1] + 1
+
+_stager = None
+
+def _init_worker(scratch, scratch_gb, copy_workers):
+    global _stager
+    if scratch:
+        _stager = staging.OutputStager(scratch, int(scratch_gb * 2**30), copy_workers)
+
+def _extract_worker(job):
+    frame_paths, decoded = extract_clip_frames(*job, stager=_stager)
+    if _stager is not None:
+        # pool workers are not told when the run ends, so each clip waits for its copies (other workers keep decoding)
+        _stager.drain()
+    return len(frame_paths), decoded
+
+def launcher_rank():
+    # ibrun (TACC) and mpirun export PMI_*, srun exports SLURM_*
+    for rank_var, size_var in [("PMI_RANK", "PMI_SIZE"), ("SLURM_PROCID", "SLURM_NTASKS"), ("OMPI_COMM_WORLD_RANK", "OMPI_COMM_WORLD_SIZE")]:
+        if rank_var in os.environ and size_var in os.environ:
+            return int(os.environ[rank_var]), int(os.environ[size_var])
+    return 0, 1
 
 
 #--------------------------------------------------------------*****--------------------------------------------------------------#
@@ -136,37 +224,47 @@ def read_mp4_10bit(video_path, range='tv'):
 """
 def main():
     parser = argparse.ArgumentParser(description="Extract frames from HDR clips")
-    parser.add_argument("--num_frames", type=int, help="The number to process")
+    parser.add_argument("--num_frames", type=int, default=1, help="Number of frames to extract from each clip")
     parser.add_argument("--clips_path", type=str, help="Path to HDR clips")
     parser.add_argument("--save_path", type=str, help="Path to save the frames")
+    parser.add_argument("--layout", type=str, default="rgb", choices=LAYOUTS, help="Storage layout of the saved frames (see frame_store.py)")
+    parser.add_argument("--tile", type=int, default=DEFAULT_TILE, help="Tile size for the tiled layout")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: cores / threads)")
+    parser.add_argument("--threads", type=int, default=2, help="ffmpeg decode threads per worker")
+    parser.add_argument("--rank", type=int, default=None, help="Shard index (default: from the launcher environment)")
+    parser.add_argument("--world_size", type=int, default=None, help="Number of shards (default: from the launcher environment)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the frame selection")
+    staging.add_staging_args(parser)
     # Parse the command-line arguments
     args = parser.parse_args()
 
-    # Access the parsed number and perform some action
-    files = sorted(glob(args.clips_path + "/*.mp4"))
-    write_fdr = args.save_path 
+    rank, world_size = launcher_rank()
+    rank = rank if args.rank is None else args.rank
+    world_size = world_size if args.world_size is None else args.world_size
 
-    n = args.num_frames 
+    # Shard the clip list across launcher ranks
+    files = sorted(glob(args.clips_path + "/*.mp4"))[rank::world_size]
+    os.makedirs(args.save_path, exist_ok=True)
+
+    # workers x threads should match the cores available to this rank
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    workers = args.workers or max(1, cores // args.threads)
+    print(f"Rank {rank}/{world_size}: {len(files)} clips, {workers} workers x {args.threads} ffmpeg threads")
+
+    jobs = [(f, args.save_path, args.num_frames, args.layout, args.tile, args.threads, args.seed) for f in files]
 
-    # index for frame count
-    start = 2000 * (n-1)
-    end =  2000 * (n)
-    #print(start,end)
-    
     # getting the frames from the video and saving them in the folder
-    for step,vid_path in enumerate(files[start:end]):
-        print(step)
-        
-        start = time.time()
-        # frames
-        rgb_frames = np.float16(read_mp4_10bit(vid_path, 'tv'))
-        # extracting n-frames
-        random_number1 = random.randint(0, rgb_frames.shape[0]-5)
-        idx = [random_number1]
-        # saving the frames
-        for id in idx : 
-            np.save(write_fdr + vid_path.split("/")[-1][:-4] + "_frame_" +str(id)+".npy", rgb_frames[id])        
-        print(time.time()-start)
+    start = time.time()
+    saved, decoded, skipped = 0, 0, 0
+    with Pool(workers, initializer=_init_worker, initargs=(args.scratch, args.scratch_gb, args.copy_workers)) as pool:
+        for step, (n_saved, n_decoded) in enumerate(pool.imap_unordered(_extract_worker, jobs)):
+            saved += n_saved
+            decoded += n_decoded
+            skipped += n_saved == 0
+            if (step + 1) % 100 == 0 or step + 1 == len(jobs):
+                elapsed = time.time() - start
+                print(f"{step + 1}/{len(jobs)} clips ({skipped} skipped), {saved} frames saved, "
+                      f"{decoded / elapsed:.1f} decoded frames/sec, {saved / elapsed:.2f} saved frames/sec")
 
 if __name__ == "__main__":
     #files = sorted(glob("/corral/utexas/Automatic-Assessment/avinab/HDR_Clips/HDR_Clips_BitLadder/*.mp4"))
@@ -26,11 +26,11 @@
 from pathlib import Path
 import os 
 import json 
-import subprocess 
 import pandas as pd
 import numpy as np
 from tqdm import tqdm 
 import argparse
+import proc_trace
 
 #--------------------------------------------------------------*****--------------------------------------------------------------#
 """ 
@@ -39,7 +39,7 @@ import argparse
 def get_metadata(video):
     
     cmd = [
-        "ffprobe", 
+        proc_trace.FFPROBE,
         "-v", "error", 
         "-show_streams",
         "-select_streams", "v:0",
@@ -47,7 +47,7 @@ def get_metadata(video):
         video
         ]
     
-    result = subprocess.run(cmd, capture_output=True, text=True)
+    result = proc_trace.run(cmd, stage='catalog', file=video, capture_output=True, text=True)
     video_info = json.loads(result.stdout)
     video_stream = video_info["streams"][0]
 
@@ -83,19 +83,19 @@ def add_metadata(df, video, video_stream,count):
     # If duration is not available, get from ffprobe show_entries      
     if "duration" not in video_stream:
         cmd_duration = [
-            "ffprobe",
+            proc_trace.FFPROBE,
             "-v", "error",
             "-show_entries", "format=duration",
             "-of", "default=noprint_wrappers=1:nokey=1",
             video
         ]
-        result_duration = subprocess.run(cmd_duration, capture_output=True, text=True)
+        result_duration = proc_trace.run(cmd_duration, stage='catalog', file=video, capture_output=True, text=True)
         duration = result_duration.stdout
     else:
         duration = video_stream["duration"]
     
     # If bitrate is not available, calculate from size and duration. Get the size from os 
-    bitrate = (os.path.getsize(video)*8) / (float(result_duration.stdout)*1000000)
+    bitrate = (os.path.getsize(video)*8) / (float(duration)*1000000)
     
     # If size is not available, get it from os 
     if "size" not in video_stream:
@@ -120,28 +120,19 @@ def add_metadata(df, video, video_stream,count):
     return df
     
 #--------------------------------------------------------------*****--------------------------------------------------------------#
-""" 
-    Filter and save csv file with metadata of all videos.
-
 """
-
-def filter_save(df, hdr_vids):
-
+    Derived columns and the quality filter, shared by filter_save() and the per-video check in pipeline.py.
+"""
+def add_derived_columns(df):
     # Split the fps column into two columns: num and dec and get the float value of fps. 
     df["fps_float"] = df["fps"].apply(lambda x: float(x.split("/")[0])/float(x.split("/")[1]))
 
     # Make new column with bitrate(in MBps)/(resolution*frame_rate) and then filter based on that.
     # Use MBps not bps
     df["bit_per_frame_per_pixel"] = (df["bitrate(Mbps)"])/(df["width"]*df["height"]*df["fps_float"])
+    return df
 
-    # filter HDR videos from numpy array
-    hdr_files = np.load(hdr_vids)
-    df = df[df["video_name"].isin(hdr_files)]
-
-    # Save the HDR dataframe as csv file
-    df.to_csv('HDR_vids_meta_data.csv', index=False)
-
-
+def pristine_filter(df):
     # Filtering the dataframe based on width and height, bitrate, duration, fps.    
     # Filter all 4k videos 
     df_filtered = df[(df["width"]==3840) & (df["height"]==2160)]
@@ -150,6 +141,26 @@ def filter_save(df, hdr_vids):
     threshold = 28/(3840*2160*60) #0.32
 
     df_filtered = df_filtered[(df_filtered["bit_per_frame_per_pixel"]>=threshold) & (df_filtered["fps_float"]>=50)]
+    return df_filtered
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+""" 
+    Filter and save csv file with metadata of all videos.
+
+"""
+
+def filter_save(df, hdr_vids):
+
+    df = add_derived_columns(df)
+
+    # filter HDR videos from numpy array
+    hdr_files = np.load(hdr_vids)
+    df = df[df["video_name"].isin(hdr_files)]
+
+    # Save the HDR dataframe as csv file
+    df.to_csv('HDR_vids_meta_data.csv', index=False)
+
+    df_filtered = pristine_filter(df)
     print("Final Assumed Pristine HDR 4K High FPS and High Bitrate Videos: ",len(df_filtered))
 
     #save the dataframe as csv file
@@ -0,0 +1,280 @@
+"""
+    Storage and random-access reads for the frames saved by extract_frames.py.
+
+    HIDRO-VQA trains on crops, so loading a whole 3840x2160x3 float16 frame (~50 MB) to get one patch wastes
+    almost all of the I/O. Frames here are opened memory-mapped and only the bytes under the requested patch are read.
+
+    Layouts:
+        rgb   : plain (H, W, 3) array saved with np.save (what extract_frames.py always wrote).
+                A (h, w) patch touches h separate row segments.
+        tiled : (H/T, W/T, T, T, 3) array of square tiles, padded at the right/bottom edge.
+                A patch touches only the few tiles under it, each one a contiguous block on disk.
+        yuv420: the decoded 10-bit Y, U, V planes as stored in the video (uint16, I420 order, 1.5 samples/pixel).
+                Half the bytes of the float16 RGB layout and bit-exact to the source; converted to RGB on load.
+
+    Non-default layouts write a small JSON sidecar next to the .npy (same name, .json) describing the layout and the
+    original frame size (and the colour metadata for yuv420). A .npy without sidecar is read as 'rgb', so all existing
+    frame folders keep working.
+
+    Usage (throughput of full-frame loads vs. patch reads):
+        python frame_store.py --frames_path ./path/to/frames/ --patch 256 --num_patches 500
+"""
+
+import numpy as np
+import json
+import os
+import argparse
+import time
+import shutil
+import tempfile
+from glob import glob
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+LAYOUTS = ['rgb', 'tiled', 'yuv420']
+DEFAULT_TILE = 256
+
+def sidecar_path(frame_path):
+    return os.path.splitext(frame_path)[0] + ".json"
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+"""
+    YUV 4:2:0 (10-bit code values) to R'G'B' in [0, 1], still PQ/HLG encoded (i.e. the same values extract_frames.py
+    has always saved). Chroma terms are computed at chroma resolution and broadcast over each 2x2 luma block, so no
+    upsampled chroma planes are ever materialised.
+"""
+def yuv420_to_rgb(y_plane, u_plane, v_plane, range='tv', out=None):
+    height, width = y_plane.shape
+    if range == 'tv':
+        offset, scale = 64, 1 / (940 - 64)
+    else:  # full range
+        offset, scale = 0, 1 / 1023
+
+    cb = u_plane.astype(np.float32) - 512
+    cr = v_plane.astype(np.float32) - 512
+
+    # BT.2020 non-constant luminance coefficients
+    r_c = (1.4747 * cr)[:, None, :, None]
+    g_c = (-0.1645 * cb - 0.5719 * cr)[:, None, :, None]
+    b_c = (1.8814 * cb)[:, None, :, None]
+
+    if out is None:
+        out = np.empty((height, width, 3), dtype=np.float32)
+    y = (y_plane.astype(np.float32) - offset).reshape(height // 2, 2, width // 2, 2)
+    for c, chroma in enumerate((r_c, g_c, b_c)):
+        # splitting the axes of the strided channel view keeps it a view, so results land in out directly
+        channel = out[..., c].reshape(height // 2, 2, width // 2, 2)
+        np.add(y, chroma, out=channel)
+        channel *= scale
+    np.clip(out, 0, 1, out=out)
+    return out
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+"""
+    Save a frame in one of the supported layouts.
+
+    For 'yuv420', frame is a (y, u, v) tuple of uint16 planes and meta carries the colour metadata from ffprobe
+    (color_range, color_transfer, color_primaries, color_space, pix_fmt).
+"""
+def save_frame(frame_path, frame, layout='rgb', tile=DEFAULT_TILE, meta=None):
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown frame layout: {layout}. Use one of {LAYOUTS}")
+
+    if layout == 'yuv420':
+        y_plane, u_plane, v_plane = frame
+        height, width = y_plane.shape
+        np.save(frame_path, np.concatenate((y_plane.ravel(), u_plane.ravel(), v_plane.ravel())).astype(np.uint16))
+        side = {'layout': layout, 'height': height, 'width': width, 'channels': 3}
+        side.update(meta or {})
+        with open(sidecar_path(frame_path), 'w') as f:
+            json.dump(side, f)
+        return
+
+    if layout == 'rgb':
+        np.save(frame_path, frame)
+        # remove a stale sidecar so the frame is not read with an old layout
+        if os.path.exists(sidecar_path(frame_path)):
+            os.remove(sidecar_path(frame_path))
+        return
+
+    height, width = frame.shape[:2]
+    channels = frame.shape[2] if frame.ndim == 3 else 1
+    ty, tx = -(-height // tile), -(-width // tile)
+
+    # Pad to a whole number of tiles and reorder (H, W, C) -> (ty, tx, T, T, C) so each tile is contiguous
+    padded = np.zeros((ty * tile, tx * tile, channels), dtype=frame.dtype)
+    padded[:height, :width] = frame.reshape(height, width, channels)
+    tiles = padded.reshape(ty, tile, tx, tile, channels).transpose(0, 2, 1, 3, 4)
+    np.save(frame_path, np.ascontiguousarray(tiles))
+
+    with open(sidecar_path(frame_path), 'w') as f:
+        json.dump({'layout': layout, 'height': height, 'width': width, 'channels': channels, 'tile': tile}, f)
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+class StoredFrame:
+    """
+    Memory-mapped view of a stored frame. Nothing is read from disk until a patch is requested.
+
+    Parameters:
+    - frame_path: str, path to the .npy frame
+
+    Attributes:
+    - shape: (height, width, channels) of the original frame
+    - layout: one of LAYOUTS
+    """
+    def __init__(self, frame_path):
+        self.path = frame_path
+        self.data = np.load(frame_path, mmap_mode='r')
+
+        meta = {}
+        if os.path.exists(sidecar_path(frame_path)):
+            with open(sidecar_path(frame_path)) as f:
+                meta = json.load(f)
+        self.meta = meta
+        self.layout = meta.get('layout', 'rgb')
+
+        if self.layout == 'rgb':
+            self.shape = self.data.shape if self.data.ndim == 3 else self.data.shape + (1,)
+        elif self.layout == 'tiled':
+            self.tile = meta['tile']
+            self.shape = (meta['height'], meta['width'], meta['channels'])
+        elif self.layout == 'yuv420':
+            self.shape = (meta['height'], meta['width'], 3)
+            self.range = 'pc' if meta.get('color_range') in ['pc', 'jpeg'] else 'tv'
+        else:
+            raise ValueError(f"Unknown frame layout in {sidecar_path(frame_path)}: {self.layout}")
+
+    def planes(self):
+        """
+        Zero-copy (y, u, v) views of a yuv420 frame, raw 10-bit code values.
+        """
+        if self.layout != 'yuv420':
+            raise ValueError(f"{self.path} is stored as '{self.layout}', not 'yuv420'.")
+        height, width = self.shape[:2]
+        luma, chroma = height * width, (height // 2) * (width // 2)
+        y_plane = self.data[:luma].reshape(height, width)
+        u_plane = self.data[luma:luma + chroma].reshape(height // 2, width // 2)
+        v_plane = self.data[luma + chroma:luma + 2 * chroma].reshape(height // 2, width // 2)
+        return y_plane, u_plane, v_plane
+
+    def load(self):
+        """
+        Full frame as (H, W, 3) R'G'B' in [0, 1] (float32 for yuv420, stored dtype otherwise).
+        """
+        height, width = self.shape[:2]
+        if self.layout == 'yuv420':
+            return yuv420_to_rgb(*self.planes(), range=self.range)
+        return self.read_patch(0, 0, height, width)
+
+    def read_patch(self, y, x, h, w):
+        """
+        Read the (y, x, h, w) crop of the frame as an in-memory (h, w, C) array.
+        yuv420 frames are converted to R'G'B' (float32) on the fly.
+        """
+        height, width = self.shape[:2]
+        if y < 0 or x < 0 or y + h > height or x + w > width:
+            raise ValueError(f"Patch ({y}, {x}, {h}, {w}) is outside the {height}x{width} frame.")
+
+        if self.layout == 'rgb':
+            return np.array(self.data[y:y+h, x:x+w])
+
+        if self.layout == 'yuv420':
+            # Convert the smallest chroma-aligned (even) window around the patch, then crop
+            y0, x0 = y - y % 2, x - x % 2
+            y1, x1 = y + h + (y + h) % 2, x + w + (x + w) % 2
+            y_plane, u_plane, v_plane = self.planes()
+            rgb = yuv420_to_rgb(y_plane[y0:y1, x0:x1], u_plane[y0//2:y1//2, x0//2:x1//2],
+                                v_plane[y0//2:y1//2, x0//2:x1//2], range=self.range)
+            return rgb[y - y0:y - y0 + h, x - x0:x - x0 + w]
+
+        # Only the tiles covering the patch are touched; every tile in a tile-row is contiguous on disk
+        t = self.tile
+        ty0, ty1 = y // t, (y + h - 1) // t + 1
+        tx0, tx1 = x // t, (x + w - 1) // t + 1
+        block = np.asarray(self.data[ty0:ty1, tx0:tx1])
+        block = block.transpose(0, 2, 1, 3, 4).reshape((ty1 - ty0) * t, (tx1 - tx0) * t, -1)
+        oy, ox = y - ty0 * t, x - tx0 * t
+        return np.ascontiguousarray(block[oy:oy+h, ox:ox+w])
+
+    def random_patches(self, num_patches, h, w, rng=None):
+        """
+        Read a batch of random (h, w) crops.
+
+        Returns:
+        - patches: (num_patches, h, w, C) array
+        - coords: (num_patches, 2) array of the (y, x) top-left corners
+        """
+        rng = np.random.default_rng(rng)
+        height, width = self.shape[:2]
+        ys = rng.integers(0, height - h + 1, size=num_patches)
+        xs = rng.integers(0, width - w + 1, size=num_patches)
+
+        dtype = np.float32 if self.layout == 'yuv420' else self.data.dtype
+        patches = np.empty((num_patches, h, w, self.shape[2]), dtype=dtype)
+        # reading in row order keeps the accesses to the mapped file mostly forward
+        for i in np.argsort(ys * width + xs, kind='stable'):
+            patches[i] = self.read_patch(ys[i], xs[i], h, w)
+        return patches, np.stack((ys, xs), axis=1)
+
+def open_frame(frame_path):
+    return StoredFrame(frame_path)
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+"""
+    Compare patches/sec for: full np.load + crop (current loader), memory-mapped crop and tiled crop.
+    yuv420 frames are fully loaded and converted in the first case, so the cost of the converter is included.
+    NOTE: drop the page cache between runs (or use frames larger than RAM) to measure cold reads.
+"""
+def benchmark(frame_paths, patch=256, num_patches=500, tile=DEFAULT_TILE, tmp_dir=None, seed=0):
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(0, len(frame_paths), size=num_patches)
+    results = {}
+
+    # Current loader: load the full frame for every patch
+    start = time.time()
+    for i in picks:
+        frame = open_frame(frame_paths[i]).load() if os.path.exists(sidecar_path(frame_paths[i])) else np.load(frame_paths[i])
+        y = rng.integers(0, frame.shape[0] - patch + 1)
+        x = rng.integers(0, frame.shape[1] - patch + 1)
+        _ = np.array(frame[y:y+patch, x:x+patch])
+    results['full_load'] = num_patches / (time.time() - start)
+
+    # Memory-mapped crop on the existing files
+    frames = [open_frame(p) for p in frame_paths]
+    start = time.time()
+    for i in picks:
+        frames[i].random_patches(1, patch, patch, rng)
+    results['mmap'] = num_patches / (time.time() - start)
+
+    # Tiled copies of the same frames, in a temporary folder (never next to the dataset) removed afterwards
+    work_dir = tempfile.mkdtemp(prefix="tiled_bench_", dir=tmp_dir)
+    try:
+        tiled_paths = []
+        for p in frame_paths:
+            out = os.path.join(work_dir, os.path.basename(p))
+            save_frame(out, open_frame(p).load(), layout='tiled', tile=tile)
+            tiled_paths.append(out)
+        frames = [open_frame(p) for p in tiled_paths]
+        start = time.time()
+        for i in picks:
+            frames[i].random_patches(1, patch, patch, rng)
+        results['tiled'] = num_patches / (time.time() - start)
+    finally:
+        frames = None
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    for name, rate in results.items():
+        print(f"{name:>10s}: {rate:10.1f} patches/sec  ({rate / results['full_load']:.1f}x)")
+    return results
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Patch read throughput on stored frames")
+    parser.add_argument('--frames_path', type=str, required=True, help='Folder with .npy frames from extract_frames.py')
+    parser.add_argument('--patch', type=int, default=256, help='Patch size (square)')
+    parser.add_argument('--num_patches', type=int, default=500, help='Number of patches to read per method')
+    parser.add_argument('--tile', type=int, default=DEFAULT_TILE, help='Tile size for the tiled layout')
+    parser.add_argument('--tmp_dir', type=str, default=None, help='Folder for the temporary tiled copies (default: system temp dir)')
+    args = parser.parse_args()
+
+    paths = sorted(glob(os.path.join(args.frames_path, "*.npy")))
+    benchmark(paths, args.patch, args.num_patches, args.tile, args.tmp_dir)
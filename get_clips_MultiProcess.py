@@ -5,7 +5,7 @@
 
     NOTE: We did not use two-pass encoding since we are using CBR. 
     NOTE: We did not use extra metadata info for encoding with H.265, it increases the encoding time but gives better HDR10 encodings. We didn't see any significant difference.
-    NOTE: make sure to keep the ffmpeg binary in the same folder as this script.
+    NOTE: make sure to keep the ffmpeg binary in the same folder as this script (or set HIDRO_FFMPEG, see proc_trace.py).
 
     -- Shreshth Saini, Sept. 2023
 
@@ -17,7 +17,16 @@ import os
 from tqdm import tqdm
 import subprocess
 import json 
+import time
+import random
 import argparse
+from collections import Counter
+import proc_trace
+import staging
+import source_cache
+import bitladder
+import chunked_encode
+from hdr_stats import video_stats
 
 
 #--------------------------------------------------------------*****--------------------------------------------------------------#
@@ -25,23 +34,23 @@ import argparse
 def parse_probe_out(filename):
 
     # Get the fps 
-    fps_cmnd = ['ffprobe', '-v', 'error', '-select_streams', 'v', '-of',
+    fps_cmnd = [proc_trace.FFPROBE, '-v', 'error', '-select_streams', 'v', '-of',
                 'default=noprint_wrappers=1:nokey=1', '-show_entries', 'stream=r_frame_rate', filename]
 
-    p = subprocess.Popen(fps_cmnd, stdout=subprocess.PIPE,
-                         stderr=subprocess.PIPE)
-    fps_out, err = p.communicate()
+    p = proc_trace.run(fps_cmnd, stage='clips', file=filename, stdout=subprocess.PIPE,
+                       stderr=subprocess.PIPE)
+    fps_out, err = p.stdout, p.stderr
     fps_out = fps_out.decode()
     fps = eval(fps_out.split('\r')[0])
 
     # Get the metadata
-    cmnd = ['ffprobe', '-show_streams', 
+    cmnd = [proc_trace.FFPROBE, '-show_streams', 
             '-print_format', 'json',
             filename]
     # ffprobe command to read the first frameformat (since HDR10, it's sufficient to read the first frame)
     # information about color_space,color_primaries,color_transfer,side_data_list,pix_fmt are extracted to the variable out
-    p = subprocess.Popen(cmnd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    out, err = p.communicate()
+    p = proc_trace.run(cmnd, stage='clips', file=filename, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = p.stdout, p.stderr
 
     # Get dictionary of metadata 
     out = out.decode()
@@ -71,12 +80,38 @@ def parse_probe_out(filename):
     return side_info, fps
         
      
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+""" 
+    x265 options of one reference clip (CBR at side_info['bitrate'], HDR10 metadata of the source), after its -map.
+"""
+def reference_args(output, side_info, max_cll="0,0"):
+    # Add more color and metadata info for better encoding  
+    x_265_paras_10bit = f'hdr-opt=1:repeat-headers=1:keyint={side_info["keyint"]}:colorprim=bt2020:transfer=smpte2084:colormatrix=bt2020nc:master-display=G({side_info["green_x"]},{side_info["green_y"]})B({side_info["blue_x"]},{side_info["blue_y"]})R({side_info["red_x"]},{side_info["red_y"]})WP({side_info["white_point_x"]},{side_info["white_point_y"]})L({side_info["max_luminance"]},{side_info["min_luminance"]}):max-cll={max_cll}:strict-cbr=1:level={side_info["level"]}:vbv-maxrate={side_info["bitrate"]}:vbv-bufsize={side_info["bufsize"]}:'
+    return ['-map_metadata', '0', "-c:v", "libx265", '-profile:v', 'main10', "-b:v", f"{side_info['bitrate']}k", "-minrate", f"{side_info['bitrate']}k", "-maxrate", f"{side_info['bitrate']}k", "-bufsize", f"{side_info['bufsize']}k", '-x265-params', x_265_paras_10bit, output]
+
+def reference_side_info(input_file, bitrate, level=5.1):
+    # probe once, plus the rate control of the reference clips
+    side_info, fps = parse_probe_out(input_file)
+    side_info['level'] = level
+    side_info['keyint'] = int(2*fps)
+    side_info['bitrate'] = bitrate
+    side_info['bufsize'] = int(2*bitrate)
+    return side_info, fps
+
+def construct_window_command(input_args, output_file, color_tf, side_info, max_cll="0,0"):
+    # one reference clip from an input already cut to the window (input_args with -ss/-t), used by the chunked mode
+    tf = ["-vf", f"zscale=transfer=smpte2084:transferin={color_tf}"] if color_tf == "arib-std-b67" else []
+    return [proc_trace.FFMPEG, *input_args, "-map", "0:v:0", *tf, *reference_args(output_file, side_info, max_cll)]
+
 #--------------------------------------------------------------*****--------------------------------------------------------------#
 """ 
     Function to construct ffmpeg command for clipping and encoding the video.
 """
-def construct_ffmpeg_command(input_file, output_file, color_tf, start_time, duration, bitrate, level=5.1):
+def construct_ffmpeg_command(input_file, output_file, color_tf, start_time, duration, bitrate, level=5.1, max_cll=None):
     # See https://trac.ffmpeg.org/wiki/Encode/H.265 for more details
+    # max_cll: optional list with one "MaxCLL,MaxFALL" per output (see hdr_stats.py), 0,0 if unknown
+    if max_cll is None:
+        max_cll = ["0,0"] * len(output_file)
     
     # get metadata 
     side_info, fps = parse_probe_out(input_file)
@@ -85,30 +120,22 @@ def construct_ffmpeg_command(input_file, output_file, color_tf, start_time, dura
     side_info['bitrate'] = bitrate
     side_info['bufsize'] = int(2*bitrate)
 
-    # Add more color and metadata info for better encoding  
-    x_265_paras_10bit = f'hdr-opt=1:repeat-headers=1:keyint={side_info["keyint"]}:colorprim=bt2020:transfer=smpte2084:colormatrix=bt2020nc:master-display=G({side_info["green_x"]},{side_info["green_y"]})B({side_info["blue_x"]},{side_info["blue_y"]})R({side_info["red_x"]},{side_info["red_y"]})WP({side_info["white_point_x"]},{side_info["white_point_y"]})L({side_info["max_luminance"]},{side_info["min_luminance"]}):max-cll=0,0:strict-cbr=1:level={side_info["level"]}:vbv-maxrate={side_info["bitrate"]}:vbv-bufsize={side_info["bufsize"]}:'
-    # Add this to extend line : '-x265-params', x_265_paras_10bit, 
-    
     # trying to split video at once into multipl clips 
     filters = ";".join([
         f"[0:v]trim={start}:{start + dur},setpts=PTS-STARTPTS[v{i}]" 
         for i, (start, dur) in enumerate(zip(start_time, duration))
     ])
-    
-    # Add more color and metadata info for better encoding  
-    x_265_paras_10bit = f'hdr-opt=1:repeat-headers=1:keyint={side_info["keyint"]}:colorprim=bt2020:transfer=smpte2084:colormatrix=bt2020nc:master-display=G({side_info["green_x"]},{side_info["green_y"]})B({side_info["blue_x"]},{side_info["blue_y"]})R({side_info["red_x"]},{side_info["red_y"]})WP({side_info["white_point_x"]},{side_info["white_point_y"]})L({side_info["max_luminance"]},{side_info["min_luminance"]}):max-cll=0,0:strict-cbr=1:level={side_info["level"]}:vbv-maxrate={side_info["bitrate"]}:vbv-bufsize={side_info["bufsize"]}:'
-    # Add this to extend line : '-x265-params', x_265_paras_10bit, 
         
     map_args = []
     for i, output in enumerate(output_file):
         if color_tf == "arib-std-b67":
             filters += f";[v{i}]zscale=transfer=smpte2084:transferin={color_tf}[outv{i}]"
-            map_args.extend([f"-map", f"[outv{i}]", '-map_metadata', '0', "-c:v", "libx265", '-profile:v', 'main10', "-b:v", f"{side_info['bitrate']}k", "-minrate",f"{side_info['bitrate']}k", "-maxrate", f"{side_info['bitrate']}k", "-bufsize", f"{side_info['bufsize']}k", '-x265-params', x_265_paras_10bit, output]) #buf is 2 times of bitrate
+            map_args.extend([f"-map", f"[outv{i}]", *reference_args(output, side_info, max_cll[i])]) #buf is 2 times of bitrate
         else:
-            map_args.extend([f"-map", f"[v{i}]", '-map_metadata', '0', "-c:v", "libx265", '-profile:v', 'main10', "-b:v", f"{side_info['bitrate']}k", "-minrate", f"{side_info['bitrate']}k", "-maxrate", f"{side_info['bitrate']}k", "-bufsize", f"{side_info['bufsize']}k", '-x265-params', x_265_paras_10bit, output])
+            map_args.extend([f"-map", f"[v{i}]", *reference_args(output, side_info, max_cll[i])])
 
     cmd = [
-        "./ffmpeg",
+        proc_trace.FFMPEG,
         "-i", input_file,
         "-filter_complex", filters,        
         *map_args
@@ -117,33 +144,290 @@ def construct_ffmpeg_command(input_file, output_file, color_tf, start_time, dura
     return cmd
 
 
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+"""
+    Stream-copy fast path: a source that already meets the reference spec (HEVC main10, PQ/BT.2020, at least the clip
+    bitrate, keyframes at most max_gop seconds apart) is cut on its keyframes with -c copy instead of being re-encoded.
+    A clip starts at the first keyframe of [start, start + max_gop] and ends on the first keyframe at least CLIP_SECONDS
+    later (at most max_overrun seconds longer); clips that can't be cut this way, and failed copies, are encoded.
+    The file name keeps the drawn start time. The bitstream (HDR10 SEI included) is the source's, so --compute_cll
+    only applies to the encoded clips. With open GOPs the leading pictures of the opening keyframe are not decodable
+    and are dropped by the decoder (a few frames per clip).
+"""
+COPY_POLICY = {
+    'codecs': ['hevc'],
+    'pix_fmts': ['yuv420p10le'],
+    'transfers': ['smpte2084'],
+    'primaries': ['bt2020'],
+    'max_gop': 2.0,
+    'max_overrun': 1.0,
+}
+
+def probe_copy_source(filename):
+    cmnd = [proc_trace.FFPROBE, '-v', 'error', '-select_streams', 'v:0', '-of', 'json',
+            '-show_entries', 'stream=codec_name,pix_fmt,color_transfer,color_primaries,bit_rate:format=bit_rate', filename]
+    p = proc_trace.run(cmnd, stage='clips', file=filename, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    info = json.loads(p.stdout.decode())
+    stream = info['streams'][0]
+    # mkv/webm have no stream bitrate, the container one is close enough for video-only sources
+    bitrate = stream.get('bit_rate') or info.get('format', {}).get('bit_rate') or 0
+    stream['bitrate'] = int(bitrate) / 1000  # kbps
+    return stream
+
+def packet_index(filename, start_times, span):
+    # pts and keyframe flag of the packets around the clip windows, in decode order (demuxing only, no decoding)
+    # overlapping windows are merged, else their packets would be listed twice
+    merged = []
+    for ss in sorted(start_times):
+        if merged and ss <= merged[-1][1]:
+            merged[-1][1] = ss + span
+        else:
+            merged.append([ss, ss + span])
+    intervals = ",".join(f"{start}%{end}" for start, end in merged)
+    cmnd = [proc_trace.FFPROBE, '-v', 'error', '-select_streams', 'v:0', '-read_intervals', intervals,
+            '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', filename]
+    p = proc_trace.run(cmnd, stage='clips', file=filename, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    pts, key = [], []
+    for line in p.stdout.decode().splitlines():
+        fields = line.strip().split(',')
+        if len(fields) >= 2 and fields[0] not in ['', 'N/A']:
+            pts.append(float(fields[0]))
+            key.append('K' in fields[1])
+    return np.array(pts), np.array(key, dtype=bool)
+
+"""
+    Keyframe-aligned (start, packets, duration) cut of each clip, None where the clip has to be encoded, and the source bitrate.
+"""
+def copy_cuts(vid, start_times, bitrate, policy=COPY_POLICY):
+    info = probe_copy_source(vid)
+    eligible = (info.get('codec_name') in policy['codecs'] and info.get('pix_fmt') in policy['pix_fmts']
+                and info.get('color_transfer') in policy['transfers'] and info.get('color_primaries') in policy['primaries']
+                and info['bitrate'] >= bitrate)
+    if not eligible or not len(start_times):
+        return [None] * len(start_times), info['bitrate']
+
+    pts, key = packet_index(vid, start_times, CLIP_SECONDS + policy['max_gop'] + policy['max_overrun'] + 1)
+    keyframes = np.flatnonzero(key)
+    cuts = []
+    for ss in start_times:
+        first = keyframes[(pts[keyframes] >= ss) & (pts[keyframes] <= ss + policy['max_gop'])]
+        last = keyframes[pts[keyframes] >= pts[first[0]] + CLIP_SECONDS - 1e-3] if len(first) else []
+        last = [k for k in last if k > first[0]]
+        if not len(first) or not len(last) or pts[last[0]] - pts[first[0]] > CLIP_SECONDS + policy['max_overrun']:
+            cuts.append(None)
+            continue
+        gops = np.diff(pts[keyframes[(keyframes >= first[0]) & (keyframes <= last[0])]])
+        if gops.max() > policy['max_gop'] + 1e-3:
+            cuts.append(None)
+            continue
+        # the clip is every packet from the opening keyframe up to the closing one, in decode order
+        cuts.append((float(pts[first[0]]), int(last[0] - first[0]), float(pts[last[0]] - pts[first[0]])))
+    return cuts, info['bitrate']
+
+def construct_copy_command(input_file, output_file, start, packets):
+    # the input seek lands on the keyframe at start (the last one at or before the time given); counting packets
+    # rather than seconds ends the clip exactly before the closing keyframe, whatever the reordering delay
+    return [
+        proc_trace.FFMPEG,
+        "-v", "error",
+        "-ss", f"{start + 1e-3:.6f}",
+        "-i", input_file,
+        "-frames:v", str(packets),
+        "-map", "0:v:0", "-c", "copy", "-map_metadata", "0",
+        "-avoid_negative_ts", "make_zero",
+        output_file
+    ]
+
+
 #--------------------------------------------------------------*****--------------------------------------------------------------#
 """ 
     Function to extract clips from the video.
+    copy_policy: optional COPY_POLICY, to stream-copy the clips the source allows (see above)
+    report: optional collections.Counter, gets the clip counts and seconds per path ('copied', 'encoded', 'copy_s', 'encode_s')
+    chunk_seconds: encode each clip in GOP-aligned chunks run in parallel (chunked_encode.py), 0 for one encode of all clips
 """
-def extract_clips(vid, start_times, color_tf, save_add, bitrate=50000): #bitrate in kbps
-    durations = [10] * len(start_times)  # All clips are 10 seconds long
+def extract_clips(vid, start_times, color_tf, save_add, bitrate=50000, compute_cll=False, stager=None, copy_policy=None, report=None,
+                  chunk_seconds=0, chunk_workers=4): #bitrate in kbps
     output_files = [os.path.join(save_add, f"{os.path.basename(vid).split('.')[0]}_{ss}.mp4") for ss in start_times]
+    counts = {'copied': 0, 'encoded': 0, 'copy_s': 0.0, 'encode_s': 0.0}
+
+    # fast path first: clips cut from the source bitstream
+    encode = list(range(len(start_times)))
+    if copy_policy is not None:
+        started = time.time()
+        cuts, source_bitrate = copy_cuts(vid, start_times, bitrate, copy_policy)
+        encode = []
+        for i, cut in enumerate(cuts):
+            if cut is None:
+                encode.append(i)
+                continue
+            try:
+                with staging.staged(stager, [output_files[i]], reserve=int(cut[2] * source_bitrate * 1000 // 8)) as targets:
+                    p = proc_trace.run(construct_copy_command(vid, targets[0], cut[0], cut[1]), stage='clips', file=vid)
+                    if p.returncode:
+                        raise RuntimeError(f"stream copy exited with {p.returncode}")
+                counts['copied'] += 1
+            except RuntimeError as e:
+                print(f"{output_files[i]}: {e}, encoding it instead")
+                if stager is None and os.path.exists(output_files[i]):
+                    os.remove(output_files[i])
+                encode.append(i)
+        counts['copy_s'] = time.time() - started
+
+    if encode:
+        started = time.time()
+        start_times = [start_times[i] for i in encode]
+        encode_files = [output_files[i] for i in encode]
+        durations = [CLIP_SECONDS] * len(start_times)  # All clips are 10 seconds long
+
+        # Content light levels of each clip window (decodes only the windows). For HLG these are the levels after conversion to PQ.
+        max_cll = None
+        if compute_cll and color_tf in ["smpte2084", "arib-std-b67"]:
+            max_cll = [video_stats(vid, ss, dur, color_tf).max_cll_param() for ss, dur in zip(start_times, durations)]
 
-    ffmpeg_cmd = construct_ffmpeg_command(vid, output_files, color_tf, start_times,durations, bitrate)
-    subprocess.run(ffmpeg_cmd)
+        # with a stager (staging.py) the clips are encoded on local scratch and copied to save_add in the background
+        with staging.staged(stager, encode_files, reserve=sum(durations) * bitrate * 1000 // 8) as targets:
+            if chunk_seconds:
+                side_info, fps = reference_side_info(vid, bitrate)
+                for i, (target, ss, dur) in enumerate(zip(targets, start_times, durations)):
+                    clip_cll = max_cll[i] if max_cll else "0,0"
+                    chunked_encode.encode_chunked(vid, [target],
+                                                  lambda input_args, outputs: construct_window_command(input_args, outputs[0], color_tf, side_info, clip_cll),
+                                                  ss, dur, fps, chunk_seconds, chunk_workers, [(bitrate, 2 * bitrate)], stage='clips')
+            else:
+                ffmpeg_cmd = construct_ffmpeg_command(vid, targets, color_tf, start_times,durations, bitrate, max_cll=max_cll)
+                proc_trace.run(ffmpeg_cmd, stage='clips', file=vid)
+        counts['encoded'] += len(encode)
+        counts['encode_s'] = time.time() - started
+
+    if report is not None:
+        report.update(counts)
+    return output_files
+
+"""
+    Clips per path and throughput, from the extract_clips report.
+"""
+def path_report(report):
+    rate = lambda n, s: f"{n / s * 3600:.0f} clips/h" if s > 0 else "-"
+    return (f"Clips: {report['copied']} stream-copied ({rate(report['copied'], report['copy_s'])}), "
+            f"{report['encoded']} encoded ({rate(report['encoded'], report['encode_s'])})")
+
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+"""
+    Fused clip-and-ladder mode: one ffmpeg per clip window seeks to the window, decodes it once, converts HLG to PQ if
+    needed and splits it into the reference clip and every rung of the ladder (scaled from the same frames). This
+    replaces the second decode of the reference by bitladder.py, and the rungs are encoded from the source instead of
+    the 50 Mbps intermediate. Names are the usual ones: save_add/<name>_<start>.mp4 and ladder_add/<rung>#<name>_<start>.mp4.
+    Every window is decoded for the rungs, so stream copy and chunked encoding do not combine with it (the CLIs reject
+    them); report counts the clips as encoded, like extract_clips.
+"""
+def construct_fused_command(input_file, clip_file, rung_files, ladder, color_tf, start, duration, side_info, fps, level=5.1, max_cll="0,0"):
+    # input seeking: only the window (from the previous keyframe) is decoded
+    tf = f"zscale=transfer=smpte2084:transferin={color_tf}," if color_tf == "arib-std-b67" else ""
+    labels = "".join(f"[s{i}]" for i in range(len(rung_files)))
+    filters = f"[0:v]{tf}split={len(rung_files) + 1}[ref]{labels}"
+    for i, values in enumerate(ladder.values()):
+        filters += f";[s{i}]scale={values[1]}:{values[2]}[r{i}]"
+
+    cmd = [
+        proc_trace.FFMPEG,
+        "-ss", str(start), "-t", str(duration),
+        "-i", input_file,
+        "-filter_complex", filters,
+        "-map", "[ref]", *reference_args(clip_file, side_info, max_cll)
+    ]
+    for i, (rung_file, values) in enumerate(zip(rung_files, ladder.values())):
+        cmd.extend(["-map", f"[r{i}]", "-an", *bitladder.rung_args(rung_file, values, side_info, fps, level, max_cll)])
+    return cmd
+
+def extract_clips_fused(vid, start_times, color_tf, save_add, ladder, ladder_add, bitrate=50000, compute_cll=False, stager=None, report=None): #bitrate in kbps
+    side_info, fps = reference_side_info(vid, bitrate)
+
+    started = time.time()
+    outputs = []
+    for ss in start_times:
+        clip_file = os.path.join(save_add, f"{os.path.basename(vid).split('.')[0]}_{ss}.mp4")
+        rung_files = [os.path.join(ladder_add, name + "#" + os.path.basename(clip_file)) for name in ladder]
+        max_cll = "0,0"
+        if compute_cll and color_tf in ["smpte2084", "arib-std-b67"]:
+            max_cll = video_stats(vid, ss, CLIP_SECONDS, color_tf).max_cll_param()
+
+        # reference plus a ladder that adds up to about the same size
+        with staging.staged(stager, [clip_file] + rung_files, reserve=2 * CLIP_SECONDS * bitrate * 1000 // 8) as targets:
+            cmd = construct_fused_command(vid, targets[0], targets[1:], ladder, color_tf, ss, CLIP_SECONDS, side_info, fps, max_cll=max_cll)
+            proc_trace.run(cmd, stage='clips', file=vid)
+        outputs.append((clip_file, rung_files))
+    if report is not None:
+        report.update({'encoded': len(outputs), 'encode_s': time.time() - started})
+    return outputs
+
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+"""
+    Clip policy: one random 10s clip in every 130s window, skipping the first minute (duration is encoded in the name).
+    The draws are seeded by the video name, so a re-run or a retried work queue task writes the same clips.
+    cost_estimate.py counts clips with the same windows.
+"""
+CLIP_SECONDS = 10
+CLIP_EVERY = 130
+CLIP_SKIP = 60
+
+def source_duration(video_path):
+    return int(video_path.split("_")[-1].split(".")[0])
+
+def clip_windows(duration):
+    return range(CLIP_SKIP, int(duration) - CLIP_EVERY, CLIP_EVERY)
+
+def clip_start_times(video_path, seed=0):
+    rng = random.Random(f"{seed}:{os.path.basename(video_path)}")
+    return [rng.randrange(st, st + CLIP_EVERY - CLIP_SECONDS) for st in clip_windows(source_duration(video_path))]
 
 
 #--------------------------------------------------------------*****--------------------------------------------------------------#
 """
     Main function
 """
-def main(df,save_add):
+def main(df,save_add,compute_cll=False,stager=None,cache=None,ladder=None,ladder_add=None,copy_policy=None,plan=None,chunk_seconds=0,chunk_workers=4):
+    # plan: optional {video_path: start times} (clip_dedup.py), instead of drawing the windows here
+    report = Counter()
+    # the next sources are copied to local disk while the current one is encoded (source_cache.py)
+    if cache is not None:
+        cache.schedule(list(df['video_path']))
     for _, row in tqdm(df.iterrows(), total=len(df)):
         # Skip clipping if aready clipped     
         #NOT IMPLEMENTED YET
 
-        extract_clips(
-            vid=row['video_path'], 
-            start_times=[np.random.randint(st, st+120) for st in range(60, int(row['video_path'].split("_")[-1].split(".")[0])-130, 130)],
-            color_tf=row['color_transfer'],
-            save_add=save_add
-        ) 
+        if plan is not None:
+            starts = plan.get(row['video_path'], [])
+        else:
+            starts = clip_start_times(row['video_path'])
+        try:
+            with source_cache.using(cache, row['video_path']) as vid:
+                if ladder is not None:
+                    # fused mode: the rungs come from the same decode as the clips
+                    extract_clips_fused(vid, starts, row['color_transfer'], save_add,
+                                        ladder, ladder_add, compute_cll=compute_cll, stager=stager, report=report)
+                else:
+                    extract_clips(
+                        vid=vid, 
+                        start_times=starts,
+                        color_tf=row['color_transfer'],
+                        save_add=save_add,
+                        compute_cll=compute_cll,
+                        stager=stager,
+                        copy_policy=copy_policy,
+                        report=report,
+                        chunk_seconds=chunk_seconds,
+                        chunk_workers=chunk_workers
+                    ) 
+        except RuntimeError as e:
+            print(e)
+    print(path_report(report))
+    if stager is not None:
+        stager.close()
+    if cache is not None:
+        cache.close()
 
 #--------------------------------------------------------------*****--------------------------------------------------------------#
 if __name__ == "__main__":
@@ -152,12 +436,34 @@ if __name__ == "__main__":
     
     parser = argparse.ArgumentParser()
     parser.add_argument('--save_add', type=str, default="./HDR_Clips/", help='Path to save the clips')
+    parser.add_argument('--compute_cll', action='store_true', help='Measure MaxCLL/MaxFALL of each clip and signal them in the encode')
+    parser.add_argument('--fused_ladder', type=str, default=None, help='Bit ladder csv: also encode the rungs from the same decode (fused mode, replaces bitladder.py)')
+    parser.add_argument('--ladder_save_add', type=str, default="./HDR_Clips_BitLadder/", help='Path to save the rungs in fused mode')
+    parser.add_argument('--stream_copy', action='store_true', help='Cut clips of sources that meet the reference spec on keyframes instead of encoding them')
+    parser.add_argument('--clip_plan', type=str, default=None, help='Clip plan csv from clip_dedup.py: encode only its kept windows')
+    parser.add_argument('--copy_max_gop', type=float, default=COPY_POLICY['max_gop'], help='Longest keyframe interval (s) allowed for stream copy')
+    staging.add_staging_args(parser)
+    source_cache.add_cache_args(parser)
+    chunked_encode.add_chunk_args(parser)
     args = parser.parse_args()
+    if args.fused_ladder and (args.stream_copy or args.chunk_seconds):
+        parser.error("--fused_ladder decodes every window for the rungs; it cannot be combined with --stream_copy or --chunk_seconds")
 
     # Create the folder if it doesn't exist 
     if not os.path.exists(args.save_add):
         os.makedirs(args.save_add)
+    ladder = None
+    if args.fused_ladder:
+        ladder = bitladder.load_ladder(args.fused_ladder)
+        os.makedirs(args.ladder_save_add, exist_ok=True)
+    
+    copy_policy = dict(COPY_POLICY, max_gop=args.copy_max_gop) if args.stream_copy else None
+    plan = None
+    if args.clip_plan:
+        kept = pd.read_csv(args.clip_plan)
+        kept = kept[kept['keep']]
+        plan = {vid: sorted(starts) for vid, starts in kept.groupby('video_path')['start']}
     
-    main(df,args.save_add)
+    main(df,args.save_add,args.compute_cll,staging.from_args(args),source_cache.from_args(args),ladder,args.ladder_save_add,copy_policy,plan,args.chunk_seconds,args.chunk_workers)
 
 
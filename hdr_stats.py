@@ -0,0 +1,230 @@
+"""
+    Single-pass streaming statistics for HDR10 clips.
+
+    Consumes raw 10-bit (y, u, v) frame batches (read_hdr_10bit.iter_yuv_batches for videos, YUVReader.batches for raw
+    .yuv files) and keeps only running values, so memory is constant whatever the clip length:
+        * min / max code value per plane
+        * code-value histograms per plane
+        * fraction of luma values above the 8-bit ceiling (same threshold as read_hdr_10bit.verify_frames)
+        * MaxCLL / MaxFALL (CTA-861.3) from the PQ-decoded max(R,G,B) of every pixel
+
+    MaxCLL/MaxFALL are computed for PQ (smpte2084) content and for HLG (arib-std-b67), where they are the light levels
+    after the HLG->PQ conversion done on encode (1000 cd/m^2 display, see hdr_transfer.py). They are None otherwise.
+    The values can be passed to the encoders (max-cll=MaxCLL,MaxFALL) instead of the old hard-coded 0,0.
+
+    Usage:
+        python hdr_stats.py --video_folder ./path/to/clips/ --workers 16 --save_csv ./clip_stats.csv
+"""
+
+import numpy as np
+import pandas as pd
+import os
+import argparse
+from glob import glob
+from multiprocessing import Pool
+from tqdm import tqdm
+import proc_trace
+import shm_batches
+
+from read_hdr_10bit import check_video_range, iter_yuv_batches
+from frame_store import yuv420_to_rgb
+from hdr_transfer import pq_eotf, float_to_code, code_to_linear, code_to_nits
+
+# transfers with content light levels
+CLL_TRANSFERS = ['smpte2084', 'arib-std-b67']
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+class HDRStats:
+    """
+    Streaming accumulator over raw (y, u, v) batches.
+
+    Parameters:
+    - bit_depth: int, bit depth of the code values
+    - range: str, 'tv' or 'pc' (used for the normalisation and the RGB conversion)
+    - transfer: str, color_transfer of the clip; MaxCLL/MaxFALL are computed for CLL_TRANSFERS only
+    """
+    def __init__(self, bit_depth=10, range='tv', transfer='smpte2084'):
+        self.bit_depth = bit_depth
+        self.range = range
+        self.transfer = transfer
+        self.frames = 0
+        self.minimum = [np.inf] * 3
+        self.maximum = [-np.inf] * 3
+        self.histograms = np.zeros((3, 1 << bit_depth), dtype=np.int64)
+        self.max_cll = 0.0
+        self.max_fall = 0.0
+        self._rgb = None
+        self._nits = None
+
+    def update(self, y, u, v):
+        """
+        Add a batch of frames: y (frames, h, w), u and v (frames, h/2, w/2), raw code values.
+        """
+        for c, plane in enumerate((y, u, v)):
+            self.minimum[c] = min(self.minimum[c], int(plane.min()))
+            self.maximum[c] = max(self.maximum[c], int(plane.max()))
+            self.histograms[c] += np.bincount(plane.ravel(), minlength=self.histograms.shape[1])[:self.histograms.shape[1]]
+
+        if self.transfer in CLL_TRANSFERS:
+            if self._rgb is None or self._rgb.shape[:2] != y.shape[1:]:
+                self._rgb = np.empty(y.shape[1:] + (3,), dtype=np.float32)
+                self._nits = np.empty(y.shape[1:], dtype=np.float32)
+            for i in range(y.shape[0]):
+                rgb = yuv420_to_rgb(y[i], u[i], v[i], range=self.range, out=self._rgb)
+                if self.transfer == 'smpte2084':
+                    # the EOTF is monotonic: decode max(R',G',B') instead of all three channels. The frame average
+                    # goes through the 16-bit lookup table, the peak through the exact formula.
+                    max_rgb = np.maximum(np.maximum(rgb[..., 0], rgb[..., 1]), rgb[..., 2])
+                    nits = code_to_linear(float_to_code(max_rgb, 16), 'smpte2084', 16, 'pc', out=self._nits)
+                    peak = float(pq_eotf(np.float64(max_rgb.max())))
+                else:
+                    # HLG: the OOTF mixes channels, so decode the full RGB to display light first (lookup table for
+                    # the inverse OETF, then the OOTF)
+                    light = code_to_nits(float_to_code(rgb, 16), 'arib-std-b67', 16, 'pc', out=rgb)
+                    nits = np.maximum(np.maximum(light[..., 0], light[..., 1]), light[..., 2], out=self._nits)
+                    peak = float(nits.max())
+                self.max_cll = max(self.max_cll, peak)
+                self.max_fall = max(self.max_fall, float(nits.mean(dtype=np.float64)))
+
+        self.frames += y.shape[0]
+        return self
+
+    def merge(self, other):
+        """
+        Combine with the statistics of another part of the same clip (or another clip).
+        """
+        self.frames += other.frames
+        self.minimum = [min(a, b) for a, b in zip(self.minimum, other.minimum)]
+        self.maximum = [max(a, b) for a, b in zip(self.maximum, other.maximum)]
+        self.histograms += other.histograms
+        self.max_cll = max(self.max_cll, other.max_cll)
+        self.max_fall = max(self.max_fall, other.max_fall)
+        return self
+
+    def normalise(self, code):
+        if self.range == 'tv':
+            return (code - 64) / (940 - 64)
+        return code / ((1 << self.bit_depth) - 1)
+
+    def fraction_above_8bit(self):
+        # same criterion as verify_frames: normalised luma above 255/1023
+        codes = np.arange(self.histograms.shape[1])
+        above = self.normalise(codes) > 255 / 1023
+        total = self.histograms[0].sum()
+        return float(self.histograms[0][above].sum() / total) if total else 0.0
+
+    def result(self):
+        """
+        Summary dict (histograms are available on the object).
+        """
+        hdr10 = self.transfer in CLL_TRANSFERS and self.frames > 0
+        return {
+            'frames': self.frames,
+            'y_min': self.minimum[0], 'y_max': self.maximum[0],
+            'u_min': self.minimum[1], 'u_max': self.maximum[1],
+            'v_min': self.minimum[2], 'v_max': self.maximum[2],
+            'frac_above_8bit': self.fraction_above_8bit(),
+            'max_cll': int(round(self.max_cll)) if hdr10 else None,
+            'max_fall': int(round(self.max_fall)) if hdr10 else None,
+        }
+
+    def max_cll_param(self):
+        """
+        Value for the x265 max-cll parameter, "MaxCLL,MaxFALL" (0,0 = unknown).
+        """
+        result = self.result()
+        if result['max_cll'] is None:
+            return "0,0"
+        return f"{result['max_cll']},{result['max_fall']}"
+
+    def verify(self):
+        """
+        Same checks as read_hdr_10bit.verify_frames, on the streamed statistics.
+        """
+        if self.frames == 0:
+            print("No frames to verify.")
+            return False
+
+        # Code values can't leave the range of the bit depth, so (after clipping, as verify_frames does) only the
+        # 8-bit ceiling check can fail
+        max_value = min(max(self.normalise(self.maximum[0]), 0), 1)
+
+        # Check if there are any values above the 8-bit maximum
+        if self.fraction_above_8bit() == 0:
+            print(f"No values above 8-bit maximum: max value={max_value}")
+            return False
+
+        print("The frames correctly represent an HDR 10-bit video.")
+        return True
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+"""
+    Statistics of one video (or a [start, start+duration] window of it) in a single streaming pass.
+"""
+def video_stats(video_path, start=None, duration=None, transfer=None, batch_size=8, threads=None):
+    color_range = check_video_range(video_path)
+    if transfer is None:
+        transfer = probe_transfer(video_path)
+
+    stats = HDRStats(10, 'pc' if color_range in ['pc', 'jpeg'] else 'tv', transfer)
+    for y, u, v in iter_yuv_batches(video_path, batch_size, start, duration, threads):
+        stats.update(y, u, v)
+    return stats
+
+def probe_transfer(video_path):
+    cmd = [proc_trace.FFPROBE, "-v", "error", "-select_streams", "v:0", "-show_entries", "stream=color_transfer",
+           "-of", "default=noprint_wrappers=1:nokey=1", video_path]
+    result = proc_trace.run(cmd, stage='stats', file=video_path, capture_output=True, text=True)
+    return result.stdout.strip() or 'unknown'
+
+def verify_video(video_path):
+    """
+    HDR 10-bit verification of a clip of any length (constant memory).
+    """
+    return video_stats(video_path).verify()
+
+def _stats_worker(job):
+    video_path, threads = job
+    try:
+        result = video_stats(video_path, threads=threads).result()
+    except Exception as e:
+        print(f"{video_path}: statistics failed ({e})")
+        result = {}
+    result['video_path'] = video_path
+    return result
+
+"""
+    Statistics for many clips in parallel (one clip per worker process).
+"""
+def stats_parallel(video_paths, workers=None, threads=1):
+    jobs = [(v, threads) for v in video_paths]
+    with Pool(workers) as pool:
+        results = list(tqdm(pool.imap_unordered(_stats_worker, jobs), total=len(jobs)))
+    return pd.DataFrame(results)
+
+"""
+    Statistics for many clips with the shared-memory engine (shm_batches.py): decoding and the NumPy work run in
+    separate processes, so even a single long 4K clip keeps several cores busy.
+"""
+def stats_shared(video_paths, decoders=1, workers=None, threads=None):
+    state_args = [(10, 'pc' if check_video_range(v) in ['pc', 'jpeg'] else 'tv', probe_transfer(v)) for v in video_paths]
+    states = shm_batches.run_shared(video_paths, HDRStats, state_args, decoders, workers or os.cpu_count(), threads=threads)
+    return pd.DataFrame([dict(states[v].result(), video_path=v) if v in states else {'video_path': v} for v in video_paths])
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--video_folder', type=str, required=True, help='Path to folder of clips')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes (default: all cores)')
+    parser.add_argument('--threads', type=int, default=1, help='ffmpeg decode threads per worker')
+    parser.add_argument('--decoders', type=int, default=0, help='Decoder processes of the shared-memory engine (0: one process per clip)')
+    parser.add_argument('--save_csv', type=str, default="clip_stats.csv", help='Where to save the statistics')
+    args = parser.parse_args()
+
+    vids = sorted(glob(os.path.join(args.video_folder, "*.mp4")))
+    if args.decoders:
+        df = stats_shared(vids, args.decoders, args.workers, args.threads)
+    else:
+        df = stats_parallel(vids, args.workers, args.threads)
+    df.to_csv(args.save_csv, index=False)
+    print(df.describe())
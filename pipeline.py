@@ -0,0 +1,342 @@
+"""
+    Single entry point for the whole data preparation, with per-item dependencies instead of stage barriers:
+
+        source video --classify--> HDR? --catalog--> pristine? --clips--> clip --ladder--> rungs --frames--> frames
+
+    Each stage works on one item (a source, a clip, a rung) and hands its outputs to the next stage as soon as they
+    exist, so ladder encoding of the first clips starts while other sources are still being clipped. All stages share
+    one worker pool; --limit_<stage> caps how many tasks of a stage run at once (e.g. to keep a few cores for ffprobe
+    while the x265 encodes run). Downstream stages are dispatched first, so items drain through the pipeline instead of
+    piling up between stages.
+
+    The heavy lifting happens in ffmpeg/ffprobe child processes, so the pool uses threads. Set HIDRO_TRACE=trace.jsonl
+    to record every child process under the stage of its task (see proc_trace.py).
+
+    Usage:
+        python pipeline.py --video_root ./path/to/videos --bit_ladder_csv bitladder.csv \
+            --save_clips ./HDR_Clips/ --save_ladder ./HDR_Clips_BitLadder/ --save_frames ./HDR_Frames/ --workers 32
+
+    Writes the same catalog files as remove_non_HDR.py / filter_HDR.py (HDR_videos.npy, non_HDR_videos.npy,
+    HDR_vids_meta_data.csv, HDR_meta_data_filtered_bfpHDRLIVE_4K_50fps.csv).
+"""
+
+import os
+import json
+import time
+import argparse
+import threading
+import traceback
+from collections import deque, defaultdict, Counter
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob
+import numpy as np
+import pandas as pd
+
+import remove_non_HDR
+import filter_HDR
+import get_clips_MultiProcess as get_clips
+import bitladder
+import extract_frames
+import hdr_stats
+import proc_trace
+import staging
+from frame_store import LAYOUTS
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+class StagePipeline:
+    """
+    Dependency-driven task runner.
+
+    Stages are registered in pipeline order with add_stage(name, fn, limit). fn(item) returns an iterable of
+    (next_stage, next_item) pairs, which are queued as soon as fn returns. Failed tasks are logged and counted, their
+    item does not go further.
+    """
+    def __init__(self, workers):
+        self.workers = workers
+        self.stages = []
+        self.functions = {}
+        self.limits = {}
+        self.queues = defaultdict(deque)
+        self.running = defaultdict(int)
+        self.total_running = 0
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.done = threading.Condition(self.lock)
+        self.executor = None
+        self.report = defaultdict(lambda: {'done': 0, 'failed': 0, 'busy': 0.0, 'first_start': None, 'last_end': None})
+
+    def add_stage(self, name, fn, limit=None):
+        self.stages.append(name)
+        self.functions[name] = fn
+        self.limits[name] = limit or self.workers
+        return self
+
+    def submit(self, stage, item):
+        with self.lock:
+            self.queues[stage].append(item)
+            self.pending += 1
+            self._dispatch()
+
+    def _dispatch(self):
+        # called with the lock held: start as many queued tasks as the pool and the stage limits allow,
+        # most downstream stage first
+        for stage in reversed(self.stages):
+            queue = self.queues[stage]
+            while queue and self.total_running < self.workers and self.running[stage] < self.limits[stage]:
+                item = queue.popleft()
+                self.running[stage] += 1
+                self.total_running += 1
+                self.executor.submit(self._run, stage, item)
+
+    def _run(self, stage, item):
+        start = time.time()
+        outputs, failed = [], False
+        try:
+            with proc_trace.tag(stage=stage):
+                outputs = list(self.functions[stage](item) or [])
+        except Exception:
+            failed = True
+            print(f"[{stage}] failed on {item}:\n{traceback.format_exc()}")
+        end = time.time()
+
+        with self.lock:
+            stats = self.report[stage]
+            stats['failed' if failed else 'done'] += 1
+            stats['busy'] += end - start
+            stats['first_start'] = start if stats['first_start'] is None else min(stats['first_start'], start)
+            stats['last_end'] = end if stats['last_end'] is None else max(stats['last_end'], end)
+
+            for next_stage, next_item in outputs:
+                self.queues[next_stage].append(next_item)
+                self.pending += 1
+            self.running[stage] -= 1
+            self.total_running -= 1
+            self.pending -= 1
+            self._dispatch()
+            if self.pending == 0:
+                self.done.notify_all()
+
+    def run(self, stage, items):
+        """
+        Feed items into the given stage and block until everything downstream has finished.
+        """
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            self.executor = executor
+            with self.lock:
+                for item in items:
+                    self.queues[stage].append(item)
+                    self.pending += 1
+                self._dispatch()
+                while self.pending > 0:
+                    self.done.wait()
+        self.print_report(time.time() - start)
+        return self.report
+
+    def print_report(self, makespan):
+        print(f"{'stage':>10s} {'done':>6s} {'failed':>6s} {'busy(s)':>10s} {'active(s)':>10s}")
+        busy_sum = 0.0
+        for stage in self.stages:
+            stats = self.report[stage]
+            active = (stats['last_end'] - stats['first_start']) if stats['first_start'] is not None else 0.0
+            busy_sum += stats['busy']
+            print(f"{stage:>10s} {stats['done']:6d} {stats['failed']:6d} {stats['busy']:10.1f} {active:10.1f}")
+        print(f"Makespan: {makespan:.1f}s (sum of stage busy time: {busy_sum:.1f}s on {self.workers} workers)")
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+"""
+    Stage functions for the HIDRO-VQA data preparation. Each takes one item and returns (next_stage, next_item) pairs.
+"""
+class DataPipeline:
+    CATALOG_COLUMNS = ['video_name', 'video_path', 'resolution', 'width', 'height', 'fps', 'codec', 'pix_fmt', 'bit_depth',
+                       'bitrate(Mbps)', 'duration(s)', 'size(b)', 'colorspace', 'color_transfer', 'color_range', 'color_primaries']
+
+    def __init__(self, args, catalog_part=None):
+        self.args = args
+        # work_queue.py workers: every classify/catalog result is appended to this JSONL file as its task finishes
+        self.catalog_part = catalog_part
+        self.ladder = bitladder.load_ladder(args.bit_ladder_csv)
+        self.lock = threading.Lock()
+        self.hdr_videos, self.non_hdr_videos, self.catalog = [], [], []
+        # with --scratch, encodes go to local scratch; a task hands its outputs on once they are copied out
+        self.stager = staging.from_args(args)
+        # --stream_copy: clips of sources already at the reference spec are cut without re-encoding
+        self.copy_policy = get_clips.COPY_POLICY if getattr(args, 'stream_copy', False) else None
+        self.clip_report = Counter()
+
+    def classify(self, video):
+        hdr = remove_non_HDR.is_video_hdr(video)
+        with self.lock:
+            (self.hdr_videos if hdr else self.non_hdr_videos).append(os.path.basename(video))
+        self._persist({'hdr' if hdr else 'non_hdr': os.path.basename(video)})
+        return [('catalog', video)] if hdr else []
+
+    def catalog_video(self, video):
+        df = pd.DataFrame(columns=self.CATALOG_COLUMNS)
+        df = filter_HDR.add_metadata(df, video, filter_HDR.get_metadata(video), 0)
+        df = filter_HDR.add_derived_columns(df)
+        with self.lock:
+            self.catalog.append(df)
+        for row in json.loads(df.to_json(orient='records')):
+            self._persist({'catalog': row})
+        return [('clips', {'video_path': row['video_path'], 'color_transfer': row['color_transfer']})
+                for _, row in filter_HDR.pristine_filter(df).iterrows()]
+
+    def clips(self, row):
+        if self.args.fused:
+            return self.clips_fused(row)
+        report = Counter()
+        clips = get_clips.extract_clips(
+            vid=row['video_path'],
+            start_times=get_clips.clip_start_times(row['video_path']),
+            color_tf=row['color_transfer'],
+            save_add=self.args.save_clips,
+            compute_cll=self.args.compute_cll,
+            stager=self.stager,
+            copy_policy=self.copy_policy,
+            report=report
+        )
+        with self.lock:
+            self.clip_report.update(report)
+        if self.stager is not None:
+            self.stager.wait(clips)
+        return [('ladder', clip) for clip in clips if os.path.exists(clip)]
+
+    def clips_fused(self, row):
+        # clips and rungs from one decode of each window; the rungs go straight to frame extraction
+        report = Counter()
+        outputs = get_clips.extract_clips_fused(row['video_path'], get_clips.clip_start_times(row['video_path']),
+                                                row['color_transfer'], self.args.save_clips, self.ladder,
+                                                self.args.save_ladder, compute_cll=self.args.compute_cll, stager=self.stager,
+                                                report=report)
+        with self.lock:
+            self.clip_report.update(report)
+        rungs = [rung for _, clip_rungs in outputs for rung in clip_rungs]
+        if self.stager is not None:
+            self.stager.wait(rungs)
+        return [('frames', rung) for rung in rungs if os.path.exists(rung)]
+
+    def ladder_encode(self, clip):
+        rungs = [os.path.join(self.args.save_ladder, name + "#" + os.path.basename(clip)) for name in self.ladder]
+        if not all(os.path.exists(r) for r in rungs):
+            # content light levels of the clip, as bitladder.main does
+            max_cll = hdr_stats.video_stats(clip).max_cll_param() if self.args.compute_cll else "0,0"
+            rungs = bitladder.compress_vid(clip, self.args.save_ladder, self.ladder, max_cll=max_cll, stager=self.stager)
+            if self.stager is not None:
+                self.stager.wait(rungs)
+        return [('frames', rung) for rung in rungs if os.path.exists(rung)]
+
+    def frames(self, rung):
+        frame_paths, _ = extract_frames.extract_clip_frames(rung, self.args.save_frames, self.args.num_frames, self.args.layout,
+                                                            threads=self.args.frame_threads, stager=self.stager)
+        if self.stager is not None:
+            self.stager.wait(frame_paths)
+        return []
+
+    def close(self):
+        if self.clip_report:
+            print(get_clips.path_report(self.clip_report))
+        if self.stager is not None:
+            self.stager.close()
+
+    def save_catalog(self):
+        write_catalog(self.hdr_videos, self.non_hdr_videos, self.catalog)
+
+    def _persist(self, record):
+        # one line per result, written before the task is completed, so a killed worker loses nothing marked done
+        if self.catalog_part is None:
+            return
+        line = (json.dumps(record) + "\n").encode()
+        fd = os.open(self.catalog_part, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+def write_catalog(hdr_videos, non_hdr_videos, catalog):
+    np.save('HDR_videos.npy', hdr_videos)
+    np.save('non_HDR_videos.npy', non_hdr_videos)
+    if catalog:
+        df = pd.concat(catalog, ignore_index=True)
+        df.to_csv('HDR_vids_meta_data.csv', index=False)
+        filter_HDR.pristine_filter(df).to_csv('HDR_meta_data_filtered_bfpHDRLIVE_4K_50fps.csv', index=False)
+
+"""
+    Write the catalog files from the JSONL shares of all work_queue.py workers in folder. A task re-run after a lost
+    lease can be in two shares, so videos are kept once; a line cut short by a killed worker is skipped.
+"""
+def merge_catalog_parts(folder):
+    hdr_videos, non_hdr_videos, rows = [], [], []
+    for part in sorted(glob(os.path.join(folder, "*.jsonl"))):
+        with open(part) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                hdr_videos += [record['hdr']] if 'hdr' in record else []
+                non_hdr_videos += [record['non_hdr']] if 'non_hdr' in record else []
+                rows += [record['catalog']] if 'catalog' in record else []
+    catalog = [pd.DataFrame(rows).drop_duplicates('video_path')] if rows else []
+    hdr_videos, non_hdr_videos = list(dict.fromkeys(hdr_videos)), list(dict.fromkeys(non_hdr_videos))
+    write_catalog(hdr_videos, non_hdr_videos, catalog)
+    return len(hdr_videos), len(non_hdr_videos)
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+def main(args):
+    for folder in [args.save_clips, args.save_ladder, args.save_frames]:
+        os.makedirs(folder, exist_ok=True)
+
+    videos = [os.path.join(args.video_root, v) for v in sorted(os.listdir(args.video_root))
+              if v.split('.')[-1] in ['mp4', 'mkv', 'mov', 'webm']]
+    print(f"Total video count: {len(videos)}")
+
+    data = DataPipeline(args)
+    pipeline = StagePipeline(args.workers)
+    pipeline.add_stage('classify', data.classify, args.limit_classify)
+    pipeline.add_stage('catalog', data.catalog_video, args.limit_catalog)
+    pipeline.add_stage('clips', data.clips, args.limit_clips)
+    pipeline.add_stage('ladder', data.ladder_encode, args.limit_ladder)
+    pipeline.add_stage('frames', data.frames, args.limit_frames)
+    pipeline.run('classify', videos)
+
+    data.close()
+    data.save_catalog()
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+# Options of the stage functions (shared with work_queue.py)
+def add_stage_args(parser):
+    parser.add_argument('--bit_ladder_csv', type=str, default="bitladder.csv", help='Path to bit ladder csv')
+    parser.add_argument('--save_clips', type=str, default="./HDR_Clips/", help='Path to save the clips')
+    parser.add_argument('--save_ladder', type=str, default="./HDR_Clips_BitLadder/", help='Path to save the compressed videos')
+    parser.add_argument('--save_frames', type=str, default="./HDR_Frames/", help='Path to save the frames')
+    parser.add_argument('--num_frames', type=int, default=1, help='Number of frames to extract from each rung')
+    parser.add_argument('--layout', type=str, default="rgb", choices=LAYOUTS, help='Storage layout of the saved frames (see frame_store.py)')
+    parser.add_argument('--frame_threads', type=int, default=2, help='ffmpeg decode threads for frame extraction')
+    parser.add_argument('--compute_cll', action='store_true', help='Measure MaxCLL/MaxFALL of each clip and signal them in the clip and ladder encodes')
+    parser.add_argument('--stream_copy', action='store_true', help='Cut clips of sources that meet the reference spec on keyframes instead of encoding them')
+    parser.add_argument('--fused', action='store_true', help='Encode each clip and its ladder from one decode of the source (skips the ladder stage)')
+    staging.add_staging_args(parser)
+    return parser
+
+def check_stage_args(parser, args):
+    # fused mode decodes every window for the rungs, so there is nothing to stream-copy
+    if args.fused and args.stream_copy:
+        parser.error("--fused cannot be combined with --stream_copy")
+    return args
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--video_root', type=str, required=True, help='Path to folder of source videos')
+    add_stage_args(parser)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Total concurrent tasks')
+    parser.add_argument('--limit_classify', type=int, default=None, help='Max concurrent classify tasks')
+    parser.add_argument('--limit_catalog', type=int, default=None, help='Max concurrent catalog tasks')
+    parser.add_argument('--limit_clips', type=int, default=None, help='Max concurrent clip encodes')
+    parser.add_argument('--limit_ladder', type=int, default=None, help='Max concurrent ladder encodes')
+    parser.add_argument('--limit_frames', type=int, default=None, help='Max concurrent frame extractions')
+    args = check_stage_args(parser, parser.parse_args())
+
+    main(args)
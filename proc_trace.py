@@ -0,0 +1,276 @@
+"""
+    Resource tracing for the ffmpeg/ffprobe child processes of every stage.
+
+    All call sites use proc_trace.run / proc_trace.Popen instead of subprocess.run / subprocess.Popen (same arguments,
+    plus stage= and file=). When tracing is on, each invocation appends one JSON line with:
+        stage, file, command, start time, wall time, child user/sys CPU and peak RSS (from wait4's rusage),
+        bytes read from its pipes, exit code, host and pid.
+    NOTE: Linux counts the forked copy of the parent in the child's peak RSS, so small probes show the RSS of the
+          Python worker; ffmpeg encodes/decodes are well above it.
+
+    Tracing is off unless HIDRO_TRACE points to a JSONL file (or set_trace_file() is called). Lines are appended with
+    O_APPEND, so all workers of a run (processes, threads, launcher ranks) can share one file.
+
+    pipeline.py tags every task with its stage (tag()), which overrides the stage given at the call site, so a probe
+    done while encoding the ladder is counted as 'ladder'.
+
+    The ffmpeg/ffprobe binaries are resolved once here (FFMPEG, FFPROBE): HIDRO_FFMPEG / HIDRO_FFPROBE if set, else the
+    old locations next to the scripts (./ffmpeg, ../HDR_Clips/ffmpeg), else the PATH (and imageio-ffmpeg's ffmpeg).
+
+    Reports:
+        python proc_trace.py --trace trace.jsonl --chrome trace.json --top 20
+    writes a Chrome/Perfetto trace (open in chrome://tracing or ui.perfetto.dev) and prints the top time sinks.
+"""
+
+import os
+import json
+import time
+import shutil
+import socket
+import argparse
+import threading
+import subprocess
+from contextlib import contextmanager
+import pandas as pd
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+def find_tool(name):
+    """
+    Path of the ffmpeg/ffprobe binary to use (see the module docstring for the search order).
+    """
+    override = os.environ.get(f"HIDRO_{name.upper()}")
+    if override:
+        return override
+    for candidate in [os.path.join('.', name), os.path.join('..', 'HDR_Clips', name)]:
+        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            return candidate
+    found = shutil.which(name)
+    if found:
+        return found
+    if name == 'ffmpeg':
+        try:
+            import imageio_ffmpeg
+            return imageio_ffmpeg.get_ffmpeg_exe()
+        except ImportError:
+            pass
+    return name
+
+FFMPEG = find_tool('ffmpeg')
+FFPROBE = find_tool('ffprobe')
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+_trace_file = os.environ.get("HIDRO_TRACE")
+_context = threading.local()
+
+def set_trace_file(path):
+    """
+    Enable tracing to path (None disables it). Also exported to child Python processes through HIDRO_TRACE.
+    """
+    global _trace_file
+    _trace_file = path
+    if path:
+        os.environ["HIDRO_TRACE"] = path
+    else:
+        os.environ.pop("HIDRO_TRACE", None)
+
+@contextmanager
+def tag(stage=None, file=None):
+    """
+    Attribute all invocations in this thread to stage/file while the block runs.
+    """
+    previous = getattr(_context, 'tags', {})
+    _context.tags = dict(previous, **{k: v for k, v in [('stage', stage), ('file', file)] if v is not None})
+    try:
+        yield
+    finally:
+        _context.tags = previous
+
+def _write(record):
+    line = (json.dumps(record) + "\n").encode()
+    fd = os.open(_trace_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+class _CountingReader:
+    # wraps a pipe's file object to count the bytes the caller reads from it
+    def __init__(self, stream):
+        self._stream = stream
+        self.bytes = 0
+
+    def read(self, *args):
+        data = self._stream.read(*args)
+        self.bytes += len(data)
+        return data
+
+    def readinto(self, buffer):
+        n = self._stream.readinto(buffer)
+        self.bytes += n or 0
+        return n
+
+    def readline(self, *args):
+        data = self._stream.readline(*args)
+        self.bytes += len(data)
+        return data
+
+    def __iter__(self):
+        for line in self._stream:
+            self.bytes += len(line)
+            yield line
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+class Popen(subprocess.Popen):
+    """
+    subprocess.Popen that records its resource usage when it is waited for (wait(), communicate(), with-block).
+    """
+    def __init__(self, args, *popen_args, stage='unknown', file=None, **kwargs):
+        tags = getattr(_context, 'tags', {})
+        self.trace = {'stage': tags.get('stage', stage), 'file': tags.get('file', file),
+                      'command': os.path.basename(str(args[0])), 'args': [str(a) for a in args[1:]]}
+        self._rusage = None
+        self._traced = False
+        self._auto_trace = True
+        self._start = time.time()
+        self._clock = time.perf_counter()
+        super().__init__(args, *popen_args, **kwargs)
+        if self.stdout is not None:
+            self.stdout = _CountingReader(self.stdout)
+
+    def _try_wait(self, wait_flags):
+        # same as subprocess.Popen._try_wait, but with wait4 to get this child's own rusage
+        try:
+            (pid, sts, rusage) = os.wait4(self.pid, wait_flags)
+        except ChildProcessError:
+            return (self.pid, 0)
+        if pid == self.pid:
+            self._rusage = rusage
+        return (pid, sts)
+
+    def poll(self):
+        # poll() reaps an exited child with a plain waitpid, and kill()/send_signal() poll first: reap it here with
+        # wait4 instead, so a child killed after EOF still has its rusage
+        if self.returncode is None:
+            try:
+                (pid, sts, rusage) = os.wait4(self.pid, os.WNOHANG)
+            except ChildProcessError:
+                pid = 0
+            if pid == self.pid:
+                self._rusage = rusage
+                self.returncode = os.waitstatus_to_exitcode(sts)
+        return super().poll()
+
+    def wait(self, timeout=None):
+        returncode = super().wait(timeout)
+        if self._auto_trace:
+            self.record()
+        return returncode
+
+    def record(self, bytes_piped=None):
+        """
+        Write the trace line (once). bytes_piped overrides the count of bytes read through stdout.
+        """
+        if self._traced or not _trace_file:
+            return
+        self._traced = True
+        wall = time.perf_counter() - self._clock
+        record = dict(self.trace)
+        record.update({
+            'start': self._start,
+            'wall': wall,
+            'user': self._rusage.ru_utime if self._rusage else None,
+            'sys': self._rusage.ru_stime if self._rusage else None,
+            'maxrss_kb': self._rusage.ru_maxrss if self._rusage else None,
+            'bytes_piped': bytes_piped if bytes_piped is not None else (self.stdout.bytes if isinstance(self.stdout, _CountingReader) else 0),
+            'returncode': self.returncode,
+            'host': socket.gethostname(),
+            'pid': os.getpid(),
+            'child_pid': self.pid,
+        })
+        _write(record)
+
+"""
+    Traced equivalent of subprocess.run.
+"""
+def run(args, *popen_args, stage='unknown', file=None, input=None, timeout=None, check=False, capture_output=False, **kwargs):
+    if capture_output:
+        kwargs['stdout'] = subprocess.PIPE
+        kwargs['stderr'] = subprocess.PIPE
+    with Popen(args, *popen_args, stage=stage, file=file, **kwargs) as process:
+        process._auto_trace = False
+        try:
+            stdout, stderr = process.communicate(input, timeout=timeout)
+        except:
+            process.kill()
+            process.wait()
+            process.record()
+            raise
+        returncode = process.poll()
+        process.record(len(stdout or b'') + len(stderr or b''))
+    if check and returncode:
+        raise subprocess.CalledProcessError(returncode, process.args, output=stdout, stderr=stderr)
+    return subprocess.CompletedProcess(process.args, returncode, stdout, stderr)
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+def load_trace(paths):
+    records = []
+    for path in paths:
+        with open(path) as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    return pd.DataFrame(records)
+
+"""
+    Chrome trace-event JSON: one complete ('X') event per invocation, one process per worker and one lane per stage.
+"""
+def export_chrome(df, out_path):
+    stages = sorted(df['stage'].fillna('unknown').unique())
+    lanes = {s: i for i, s in enumerate(stages)}
+    origin = df['start'].min()
+    events = []
+    # pids can repeat across hosts: number the (host, pid) workers and name them
+    workers = {}
+    for (host, pid), group in df.groupby(['host', 'pid']):
+        workers[(host, pid)] = len(workers)
+        events.append({'ph': 'M', 'name': 'process_name', 'pid': workers[(host, pid)], 'args': {'name': f"{host}:{pid}"}})
+        for stage in group['stage'].fillna('unknown').unique():
+            events.append({'ph': 'M', 'name': 'thread_name', 'pid': workers[(host, pid)], 'tid': lanes[stage], 'args': {'name': stage}})
+    for r in df.to_dict('records'):
+        stage = r['stage'] or 'unknown'
+        events.append({
+            'ph': 'X', 'name': f"{r['command']} {os.path.basename(str(r['file'] or ''))}".strip(), 'cat': stage,
+            'pid': workers[(r['host'], r['pid'])], 'tid': lanes[stage],
+            'ts': (r['start'] - origin) * 1e6, 'dur': r['wall'] * 1e6,
+            'args': {k: r[k] for k in ['file', 'user', 'sys', 'maxrss_kb', 'bytes_piped', 'returncode', 'child_pid'] if k in r},
+        })
+    with open(out_path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+"""
+    Time sinks per stage and command, sorted by total wall time.
+"""
+def summary(df, top=20):
+    df = df.assign(cpu=df['user'].fillna(0) + df['sys'].fillna(0), failed=df['returncode'].fillna(0) != 0)
+    table = df.groupby(['stage', 'command']).agg(
+        calls=('wall', 'size'), wall_total=('wall', 'sum'), wall_mean=('wall', 'mean'), cpu_total=('cpu', 'sum'),
+        peak_rss_mb=('maxrss_kb', lambda x: x.max() / 1024), mb_piped=('bytes_piped', lambda x: x.sum() / 2**20),
+        failed=('failed', 'sum'))
+    table['cpu_per_wall'] = table['cpu_total'] / table['wall_total']
+    table['share'] = table['wall_total'] / table['wall_total'].sum()
+    return table.sort_values('wall_total', ascending=False).head(top)
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--trace', type=str, nargs='+', required=True, help='JSONL trace file(s) written with HIDRO_TRACE')
+    parser.add_argument('--chrome', type=str, default=None, help='Write a Chrome/Perfetto trace to this path')
+    parser.add_argument('--top', type=int, default=20, help='Rows in the summary table')
+    args = parser.parse_args()
+
+    df = load_trace(args.trace)
+    if args.chrome:
+        export_chrome(df, args.chrome)
+    with pd.option_context('display.width', 200, 'display.max_columns', 20):
+        print(summary(df, args.top))
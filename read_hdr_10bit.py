@@ -27,10 +27,11 @@ Or alternatively, we can use opecv to read the video:
 
 """
 import os
-import imageio_ffmpeg as ffmpeg
 import numpy as np 
 import subprocess
 import json
+import re
+import proc_trace
 
 #-------------------------------------------------**********-------------------------------------------------# 
 def check_video_range(video_path):
@@ -46,13 +47,13 @@ def check_video_range(video_path):
     try:
         # Run ffprobe to get video stream information in JSON format
         cmd = [
-            'ffprobe', 
+            proc_trace.FFPROBE,
             '-v', 'quiet', 
             '-print_format', 'json', 
             '-show_streams', 
             video_path
         ]
-        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        result = proc_trace.run(cmd, stage='read', file=video_path, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         
         # Parse the JSON output from ffprobe
         ffprobe_output = json.loads(result.stdout)
@@ -82,18 +83,22 @@ def verify_frames(frames):
     Returns:
     - bool, True if the frames correctly represent an HDR 10-bit video, False otherwise
     """
-    if not frames:
+    # Single pass over the frames, so a generator works as well as a list (for whole clips see hdr_stats.verify_video)
+    min_value, max_value, count = np.inf, -np.inf, 0
+    for frame in frames:
+        # Check the data type of the frames
+        if frame.dtype != np.float32:
+            print("Incorrect data type.")
+            return False
+        min_value = min(min_value, frame.min())
+        max_value = max(max_value, frame.max())
+        count += 1
+
+    if count == 0:
         print("No frames to verify.")
         return False
 
-    # Check the data type of the frames
-    if frames[0].dtype != np.float32:
-        print("Incorrect data type.")
-        return False
-
     # Check the range of pixel values
-    min_value = np.min([np.min(frame) for frame in frames])
-    max_value = np.max([np.max(frame) for frame in frames])
     
     if min_value < 0 or max_value > 1:
         print(f"Incorrect pixel value range: min={min_value}, max={max_value}")
@@ -109,11 +114,49 @@ def verify_frames(frames):
     return True
 
 #-------------------------------------------------**********-------------------------------------------------#
+def reduced_read_args(width, height, luma_only=False, downscale=1, stride=1, roi=None):
+    """
+    ffmpeg output options of the reduced read modes, so frames are dropped, cropped and downscaled before the pipe.
+
+    Parameters:
+    - width, height: int, size of the decoded video
+    - luma_only: bool, keep the Y plane only (extractplanes, so the code values are not range-converted to gray)
+    - downscale: float, divide the width and height by this factor (area averaging)
+    - stride: int, keep every stride-th frame
+    - roi: (x, y, w, h) region of the full frame in pixels, cropped before the downscale (rounded to even values)
+
+    Returns:
+    - list of ffmpeg arguments (empty for a full read), output width, output height
+    """
+    filters = []
+    if stride > 1:
+        filters.append(f"select=not(mod(n\\,{int(stride)}))")
+    if luma_only:
+        filters.append("extractplanes=y")
+    if roi is not None:
+        x, y, w, h = (int(v) // 2 * 2 for v in roi)
+        w, h = min(w, (width - x) // 2 * 2), min(h, (height - y) // 2 * 2)
+        if x < 0 or y < 0 or w <= 0 or h <= 0:
+            raise ValueError(f"Region of interest {roi} is outside the {width}x{height} frame.")
+        filters.append(f"crop={w}:{h}:{x}:{y}")
+        width, height = w, h
+    if downscale != 1:
+        width, height = max(2, int(width / downscale) // 2 * 2), max(2, int(height / downscale) // 2 * 2)
+        filters.append(f"scale={width}:{height}:flags=area")
+    args = ['-vf', ",".join(filters)] if filters else []
+    if stride > 1:
+        # keep the selected frames only, instead of duplicating them back to the input rate
+        args += ['-fps_mode', 'passthrough']
+    return args, width, height
+
 #-------------------------------------------------**********-------------------------------------------------#
-def read_mp4_10bit(video_path, range='tv'):
+# Reduced reads for analyses that need less than full frames (range checks, luminance stats, scene cuts):
+# luma_only has ffmpeg send the Y plane only (frames are (h, w, 1)), downscale/stride/roi see reduced_read_args.
+# All of it happens inside ffmpeg, so the pipe and the NumPy work shrink with it; the defaults read full frames.
+def read_mp4_10bit(video_path, range='tv', luma_only=False, downscale=1, stride=1, roi=None):
     # Get video metadata
     command_probe = [
-        "ffprobe",
+        proc_trace.FFPROBE,
         "-v", "error",
         "-select_streams", "v:0",
         "-show_entries", "stream=width,height,pix_fmt",
@@ -121,7 +164,7 @@ def read_mp4_10bit(video_path, range='tv'):
         video_path
     ]
     
-    result = subprocess.run(command_probe, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    result = proc_trace.run(command_probe, stage='read', file=video_path, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
     video_info = json.loads(result.stdout)
     video_stream = video_info['streams'][0]
     width = int(video_stream['width'])
@@ -151,19 +194,27 @@ def read_mp4_10bit(video_path, range='tv'):
         bytes_per_pixel = 6
         bit_depth = 16
 
+    filter_args, width, height = reduced_read_args(width, height, luma_only, downscale, stride, roi)
+    if luma_only:
+        if bit_depth == 16:
+            raise ValueError(f"Luma-only reads need a YUV video, got {pix_fmt}.")
+        pix_fmt = 'gray' if bit_depth == 8 else 'gray10le'
+        bytes_per_pixel = bytes_per_pixel / 1.5
+
     cmd = [
-        ffmpeg.get_ffmpeg_exe(),
+        proc_trace.FFMPEG,
         '-i', video_path,
+        *filter_args,
         '-f', 'image2pipe',
         '-pix_fmt', pix_fmt,
         '-vcodec', 'rawvideo', '-'
     ]
-    pipe = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    pipe = proc_trace.Popen(cmd, stage='read', file=video_path, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
     frames = []
     count = 0
     while True:
         # Read raw frame data
-        raw_frame = pipe.stdout.read(width * height * bytes_per_pixel)
+        raw_frame = pipe.stdout.read(int(width * height * bytes_per_pixel))
         if not raw_frame:
             break
         
@@ -171,13 +222,16 @@ def read_mp4_10bit(video_path, range='tv'):
         dtype = np.uint8 if bit_depth == 8 else np.uint16
         image = np.frombuffer(raw_frame, dtype=dtype)
 
-        # Reshape the NumPy array to separate the Y, U, and V planes
-        y_plane = image[:width*height].reshape((height, width))
-        u_plane = image[width*height:width*height + (width//2)*(height//2)].reshape((height//2, width//2)).repeat(2,axis=0).repeat(2,axis=1)
-        v_plane = image[width*height + (width//2)*(height//2):].reshape((height//2, width//2)).repeat(2,axis=0).repeat(2,axis=1)
+        if luma_only:
+            image = image.reshape((height, width, 1))
+        else:
+            # Reshape the NumPy array to separate the Y, U, and V planes
+            y_plane = image[:width*height].reshape((height, width))
+            u_plane = image[width*height:width*height + (width//2)*(height//2)].reshape((height//2, width//2)).repeat(2,axis=0).repeat(2,axis=1)
+            v_plane = image[width*height + (width//2)*(height//2):].reshape((height//2, width//2)).repeat(2,axis=0).repeat(2,axis=1)
 
-        # Stack the Y, U, and V planes to create a 3D array (you might need to upsample the U and V planes)
-        image = np.stack((y_plane, u_plane, v_plane), axis=-1)
+            # Stack the Y, U, and V planes to create a 3D array (you might need to upsample the U and V planes)
+            image = np.stack((y_plane, u_plane, v_plane), axis=-1)
 
         # Normalize the pixel values based on the determined range
         image = image.astype(np.float32)
@@ -188,23 +242,26 @@ def read_mp4_10bit(video_path, range='tv'):
         
         count +=1
         print("Frames Processed : ", count)
-    
+
+    pipe.wait()
     return frames    
 
 
 #-------------------------------------------------**********-------------------------------------------------#
-def read_webm_10bit(video_path):
+def read_webm_10bit(video_path, luma_only=False, downscale=1, stride=1, roi=None):
     """Read a 10-bit HDR video file and return a list of NumPy arrays representing each frame.
 
     Args:
     video_path (str): The path to the HDR video file.
+    luma_only (bool): Read only the Y plane (gray10le), frames are (h, w, 1).
+    downscale, stride, roi: Reduced reads inside ffmpeg, see reduced_read_args.
 
     Returns:
     list of np.ndarray: A list of NumPy arrays representing each frame in the video.
     """
     # Get video properties using FFprobe
     command_probe = [
-        "ffprobe",
+        proc_trace.FFPROBE,
         "-v", "error",
         "-select_streams", "v:0",
         "-show_entries", "stream=width,height,pix_fmt",
@@ -212,14 +269,18 @@ def read_webm_10bit(video_path):
         video_path
     ]
     
-    result = subprocess.run(command_probe, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    result = proc_trace.run(command_probe, stage='read', file=video_path, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
     width, height, pix_fmt = result.stdout.strip().split(',')
     width, height = int(width), int(height)
     print(f"Video resolution: {width}x{height}", "pix fmt: ",pix_fmt)
+    filter_args, width, height = reduced_read_args(width, height, luma_only, downscale, stride, roi)
+    if luma_only:
+        pix_fmt = 'gray10le'
     # Define FFmpeg command to extract raw video frames
     command = [
-        "ffmpeg",
+        proc_trace.FFMPEG,
         '-i', video_path,
+        *filter_args,
         '-f', 'image2pipe',
         '-pix_fmt', pix_fmt,  # maintain the original pixel format
         '-vcodec', 'rawvideo',
@@ -227,12 +288,12 @@ def read_webm_10bit(video_path):
     ]
 
     # Run FFmpeg command and capture output
-    pipe = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    pipe = proc_trace.Popen(command, stage='read', file=video_path, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
 
     frames = []
 
     # Calculate the number of bytes per frame
-    bytes_per_frame = width * height * 3#1.5  # Adjust this based on the pixel format
+    bytes_per_frame = width * height * (2 if luma_only else 3)#1.5  # Adjust this based on the pixel format
 
     count = 0
     # Read each frame from the FFmpeg pipe
@@ -245,13 +306,16 @@ def read_webm_10bit(video_path):
         # Convert raw data to NumPy array
         image = np.frombuffer(raw_image, dtype='uint16')  # Adjust dtype based on the bit depth
 
-        # Reshape the NumPy array to separate the Y, U, and V planes
-        y_plane = image[:width*height].reshape((height, width))
-        u_plane = image[width*height:width*height + (width//2)*(height//2)].reshape((height//2, width//2)).repeat(2,axis=0).repeat(2,axis=1)
-        v_plane = image[width*height + (width//2)*(height//2):].reshape((height//2, width//2)).repeat(2,axis=0).repeat(2,axis=1)
+        if luma_only:
+            image = image.reshape((height, width, 1))
+        else:
+            # Reshape the NumPy array to separate the Y, U, and V planes
+            y_plane = image[:width*height].reshape((height, width))
+            u_plane = image[width*height:width*height + (width//2)*(height//2)].reshape((height//2, width//2)).repeat(2,axis=0).repeat(2,axis=1)
+            v_plane = image[width*height + (width//2)*(height//2):].reshape((height//2, width//2)).repeat(2,axis=0).repeat(2,axis=1)
 
-        # Stack the Y, U, and V planes to create a 3D array (you might need to upsample the U and V planes)
-        image = np.stack((y_plane, u_plane, v_plane), axis=-1)
+            # Stack the Y, U, and V planes to create a 3D array (you might need to upsample the U and V planes)
+            image = np.stack((y_plane, u_plane, v_plane), axis=-1)
 
         #frames.append(image) #causes memory issue. use yield instead  
         #check the max and min range of the frame
@@ -259,10 +323,172 @@ def read_webm_10bit(video_path):
         count +=1
         print("Frames Processed : ", count)
 
+    pipe.wait()
     return frames
 
 #-------------------------------------------------**********-------------------------------------------------#
-def read_yuv_video(filename, width, height):
+def iter_yuv_batches(video_path, batch_size=8, start=None, duration=None, threads=None):
+    """
+    Decode a video and yield raw 10-bit (y, u, v) batches of shape (frames, h, w) / (frames, h/2, w/2).
+
+    Frames are decoded as yuv420p10le into one preallocated buffer, so memory use is fixed by batch_size whatever the
+    clip length. The yielded planes are views of that buffer and are overwritten by the next batch.
+
+    Parameters:
+    - video_path: str, path to the video file
+    - batch_size: int, frames per batch
+    - start, duration: float, optional window in seconds
+    - threads: int, optional ffmpeg decode threads
+    """
+    command_probe = [
+        proc_trace.FFPROBE,
+        "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "stream=width,height",
+        "-of", "json",
+        video_path
+    ]
+    result = proc_trace.run(command_probe, stage='read', file=video_path, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    video_stream = json.loads(result.stdout)['streams'][0]
+    width, height = int(video_stream['width']), int(video_stream['height'])
+    luma, chroma = width * height, (width // 2) * (height // 2)
+
+    cmd = [
+        proc_trace.FFMPEG,
+        '-v', 'error',
+        *(['-threads', str(threads)] if threads else []),
+        *(['-ss', str(start)] if start is not None else []),
+        '-i', video_path,
+        *(['-t', str(duration)] if duration is not None else []),
+        '-f', 'rawvideo',
+        '-pix_fmt', 'yuv420p10le',
+        '-'
+    ]
+    pipe = proc_trace.Popen(cmd, stage='read', file=video_path, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    buffer = np.empty((batch_size, luma + 2 * chroma), dtype='<u2')
+    try:
+        while True:
+            count = 0
+            while count < batch_size:
+                n = pipe.stdout.readinto(memoryview(buffer[count]).cast('B'))
+                if n < buffer[count].nbytes:
+                    break
+                count += 1
+            if count == 0:
+                break
+            rows = buffer[:count]
+            yield (rows[:, :luma].reshape(count, height, width),
+                   rows[:, luma:luma + chroma].reshape(count, height // 2, width // 2),
+                   rows[:, luma + chroma:].reshape(count, height // 2, width // 2))
+            if count < batch_size:
+                break
+    finally:
+        pipe.kill()
+        pipe.wait()
+
+#-------------------------------------------------**********-------------------------------------------------#
+class YUVReader:
+    """
+    Random-access reader for raw planar .yuv files, backed by np.memmap.
+
+    Opening the file only maps it; nothing is read until planes are touched, so a 50 GB sequence opens instantly and
+    memory use stays flat. Frame count comes from the file size (a trailing partial frame is ignored).
+
+    Parameters:
+    - filename: path to the YUV file.
+    - width, height: frame size.
+    - pix_fmt: ffmpeg-style planar format, yuv420p/yuv422p/yuv444p (8-bit) or with a 10/12/16 bit suffix and
+               le/be endianness, e.g. yuv420p10le (default), yuv444p16be. gray/gray10le/... for luma-only files.
+
+    Indexing:
+    - reader[i]     -> (y, u, v) planes of frame i, each a view into the file (u, v are None for gray)
+    - reader[a:b:s] -> (y, u, v) stacked planes of shape (frames, h, w), also views
+    Samples keep the file's byte order; use .astype(np.uint16) for native ints (this copies).
+    """
+    CHROMA = {'420': (2, 2), '422': (1, 2), '444': (1, 1)}
+
+    def __init__(self, filename, width, height, pix_fmt='yuv420p10le'):
+        self.filename = filename
+        self.width = width
+        self.height = height
+        self.pix_fmt = pix_fmt
+
+        match = re.fullmatch(r'(?:yuv(420|422|444)p|(gray))(\d+)?(le|be)?', pix_fmt)
+        if match is None:
+            raise ValueError(f"Unsupported pixel format: {pix_fmt}")
+        chroma, gray, bits, endian = match.groups()
+        self.bit_depth = int(bits) if bits else 8
+        if self.bit_depth == 8:
+            self.dtype = np.dtype(np.uint8)
+        else:
+            self.dtype = np.dtype(('>' if endian == 'be' else '<') + 'u2')
+
+        # plane sizes in samples
+        self.luma_shape = (height, width)
+        if gray:
+            self.chroma_shape = None
+            chroma_size = 0
+        else:
+            sub_y, sub_x = self.CHROMA[chroma]
+            self.chroma_shape = (height // sub_y, width // sub_x)
+            chroma_size = self.chroma_shape[0] * self.chroma_shape[1]
+        self.luma_size = height * width
+        self.chroma_size = chroma_size
+        self.frame_size = self.luma_size + 2 * chroma_size
+
+        self.num_frames = os.path.getsize(filename) // (self.frame_size * self.dtype.itemsize)
+        if self.num_frames == 0:
+            raise ValueError(f"{filename} is smaller than one {width}x{height} {pix_fmt} frame.")
+        self.data = np.memmap(filename, dtype=self.dtype, mode='r', shape=(self.num_frames, self.frame_size))
+
+    def __len__(self):
+        return self.num_frames
+
+    def _planes(self, rows):
+        # rows is a (frames, frame_size) view; slicing columns and splitting the last axis keeps everything a view
+        frames = rows.shape[0]
+        y = rows[:, :self.luma_size].reshape((frames,) + self.luma_shape)
+        if self.chroma_shape is None:
+            return y, None, None
+        u = rows[:, self.luma_size:self.luma_size + self.chroma_size].reshape((frames,) + self.chroma_shape)
+        v = rows[:, self.luma_size + self.chroma_size:].reshape((frames,) + self.chroma_shape)
+        return y, u, v
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._planes(self.data[index])
+        index = int(index)
+        if index < 0:
+            index += self.num_frames
+        if not 0 <= index < self.num_frames:
+            raise IndexError(f"Frame {index} out of range for {self.num_frames} frames.")
+        y, u, v = self._planes(self.data[index:index + 1])
+        return y[0], None if u is None else u[0], None if v is None else v[0]
+
+    def __iter__(self):
+        for i in range(self.num_frames):
+            yield self[i]
+
+    def batches(self, batch_size=16):
+        """
+        Iterate over (y, u, v) batches of up to batch_size frames.
+        """
+        for start in range(0, self.num_frames, batch_size):
+            yield self[start:start + batch_size]
+
+    def close(self):
+        # Drop the mapping (the file is unmapped once no plane views are left)
+        self.data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+#-------------------------------------------------**********-------------------------------------------------#
+def read_yuv_video(filename, width, height, pix_fmt='yuv420p10le'):
     """
     Read a 10-bit YUV HDR video file.
     
@@ -270,34 +496,12 @@ def read_yuv_video(filename, width, height):
     - filename: path to the YUV file.
     - width: width of the YUV frames.
     - height: height of the YUV frames.
+    - pix_fmt: pixel layout of the file (see YUVReader).
     
     Returns:
-    - y, u, v: Y, U, and V components as 3D numpy arrays.
+    - y, u, v: Y, U, and V components as 3D numpy arrays (frames, h, w), memory-mapped views of the file.
     """
-    
-    # Calculate frame size for 10-bit
-    frame_size = width * height * 2 + (width // 2 * height // 2) * 2 * 2
-    
-    # Calculate the number of frames based on file size
-    num_frames = os.path.getsize(filename) // frame_size
-    
-    frames = []
-    with open(filename, 'rb') as f:
-        for i in range(num_frames):
-            # Read Y component
-            y_video = np.frombuffer(f.read(width * height * 2), dtype=np.uint16).reshape((height, width))
-            
-            # Read U component
-            u_video = np.frombuffer(f.read(width // 2 * height // 2 * 2), dtype=np.uint16).reshape((height // 2, width // 2))
-            
-            # Read V component
-            v_video = np.frombuffer(f.read(width // 2 * height // 2 * 2), dtype=np.uint16).reshape((height // 2, width // 2))
-
-            # Stack the Y, U, and V components and append frame in frames list
-            frames.append(np.stack((y_video, u_video, v_video), axis=-1))
-            
-        
-    return frames
+    return YUVReader(filename, width, height, pix_fmt)[:]
 
 
 #-------------------------------------------------**********-------------------------------------------------#
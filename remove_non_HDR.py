@@ -13,6 +13,7 @@ import numpy as np
 import pandas as pd
 from tqdm import tqdm 
 import argparse
+import proc_trace
 
 #--------------------------------------------------------------*****--------------------------------------------------------------#
 
@@ -32,7 +33,7 @@ def is_video_hdr(video_path):
     - bool: True if the video is HDR, False otherwise.
     """
     cmd = [
-    "ffprobe", 
+    proc_trace.FFPROBE,
     "-v", "error", 
     "-show_streams",
     "-select_streams", "v:0",
@@ -40,7 +41,7 @@ def is_video_hdr(video_path):
     video_path
     ]
     
-    result = subprocess.run(cmd, capture_output=True, text=True)
+    result = proc_trace.run(cmd, stage='classify', file=str(video_path), capture_output=True, text=True)
     #import pdb; pdb.set_trace()
     
     video_info = json.loads(result.stdout)
@@ -0,0 +1,210 @@
+"""
+    Shared-memory hand-off of decoded 10-bit batches from decoder processes to a pool of worker processes.
+
+    read_hdr_10bit.iter_yuv_batches decodes and processes in the same Python process, so a 4K clip only ever keeps one
+    core busy with NumPy. Here:
+        * one multiprocessing.shared_memory block holds --slots slots of batch_size frames (sized for the largest video)
+        * decoder processes run ffmpeg and read its yuv420p10le output straight into a free slot (readinto, no copy)
+        * worker processes map the same block, process the slot in place and give it back
+        * only (slot, video, frames) tuples go through the queues, never arrays, and memory is fixed by the slot count
+    Frames/sec scale with the workers until the decoders are the limit (add decoders, or ffmpeg threads, then).
+
+    The processing is an accumulator per video, like hdr_stats.HDRStats: make_state(*state_args[video]) creates it,
+    state.update(y, u, v) takes a batch and state.merge(other) combines the partial states of the workers. Batches of
+    one video go to several workers in any order, so the accumulator must not depend on frame order.
+
+    Usage:
+        states = run_shared(videos, HDRStats, [(10, 'tv', 'smpte2084')] * len(videos), decoders=2, workers=8)
+        python shm_batches.py --video_folder ./path/to/clips/ --decoders 2 --workers 1 2 4 8   # frames/sec scaling
+"""
+
+import os
+import json
+import time
+import queue
+import argparse
+import subprocess
+import numpy as np
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from glob import glob
+import proc_trace
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+def probe_size(video_path):
+    cmd = [proc_trace.FFPROBE, "-v", "error", "-select_streams", "v:0", "-show_entries", "stream=width,height",
+           "-of", "json", video_path]
+    result = proc_trace.run(cmd, stage='read', file=video_path, capture_output=True, text=True)
+    stream = json.loads(result.stdout)['streams'][0]
+    return int(stream['width']), int(stream['height'])
+
+def frame_words(width, height):
+    # uint16 values of one yuv420p10le frame
+    return width * height + 2 * (width // 2) * (height // 2)
+
+def _decoder(shm_name, slot_shape, videos, sizes, tasks, free, work, threads):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    buffer = np.ndarray(slot_shape, dtype='<u2', buffer=shm.buf)
+    try:
+        while True:
+            index = tasks.get()
+            if index is None:
+                break
+            width, height = sizes[index]
+            words = frame_words(width, height)
+            cmd = [proc_trace.FFMPEG, '-v', 'error', *(['-threads', str(threads)] if threads else []),
+                   '-i', videos[index], '-f', 'rawvideo', '-pix_fmt', 'yuv420p10le', '-']
+            pipe = proc_trace.Popen(cmd, stage='read', file=videos[index], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            try:
+                done = False
+                while not done:
+                    slot = free.get()
+                    count = 0
+                    while count < slot_shape[1]:
+                        frame = buffer[slot, count, :words]
+                        if pipe.stdout.readinto(memoryview(frame).cast('B')) < frame.nbytes:
+                            done = True
+                            break
+                        count += 1
+                    if count:
+                        work.put((slot, index, count))
+                    else:
+                        free.put(slot)
+                # EOF: a truncated or failed decode must not pass as a short video
+                if pipe.wait():
+                    raise RuntimeError(f"ffmpeg exited with code {pipe.returncode} while decoding {videos[index]}")
+            finally:
+                if pipe.poll() is None:
+                    pipe.kill()
+                    pipe.wait()
+    finally:
+        del buffer
+        shm.close()
+
+def _worker(shm_name, slot_shape, sizes, make_state, state_args, free, work, results):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    buffer = np.ndarray(slot_shape, dtype='<u2', buffer=shm.buf)
+    states = {}
+    try:
+        while True:
+            task = work.get()
+            if task is None:
+                break
+            slot, index, count = task
+            try:
+                width, height = sizes[index]
+                luma, chroma = width * height, (width // 2) * (height // 2)
+                rows = buffer[slot, :count]
+                if index not in states:
+                    states[index] = make_state(*state_args[index])
+                states[index].update(rows[:, :luma].reshape(count, height, width),
+                                     rows[:, luma:luma + chroma].reshape(count, height // 2, width // 2),
+                                     rows[:, luma + chroma:luma + 2 * chroma].reshape(count, height // 2, width // 2))
+            finally:
+                # give the slot back even on errors, so the decoders are not left waiting for it
+                free.put(slot)
+    except BaseException:
+        # partial states would pass as complete ones: report the failure and exit non-zero
+        results.put(None)
+        raise
+    else:
+        results.put(states)
+    finally:
+        del buffer
+        shm.close()
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+"""
+    Decode the videos in decoder processes and feed their batches to worker processes through shared memory.
+    Returns {video_path: merged state} (videos without frames are missing). Raises a RuntimeError if a decoder (or its
+    ffmpeg) or a worker failed, rather than returning incomplete states.
+
+    - make_state, state_args: accumulator factory and its arguments per video (picklable)
+    - decoders, workers: process counts
+    - slots: shared batches (default workers + decoders, enough to keep everyone busy)
+    - batch_size: frames per slot
+    - threads: ffmpeg decode threads per decoder
+"""
+def run_shared(video_paths, make_state, state_args, decoders=1, workers=4, slots=None, batch_size=4, threads=None):
+    video_paths = list(video_paths)
+    if not video_paths:
+        return {}
+    sizes = [probe_size(v) for v in video_paths]
+    slots = slots or workers + decoders
+    slot_shape = (slots, batch_size, max(frame_words(w, h) for w, h in sizes))
+    shm = shared_memory.SharedMemory(create=True, size=int(np.prod(slot_shape)) * 2)
+
+    ctx = mp.get_context()
+    tasks, free, work, results = ctx.Queue(), ctx.Queue(), ctx.Queue(), ctx.Queue()
+    for slot in range(slots):
+        free.put(slot)
+    for index in range(len(video_paths)):
+        tasks.put(index)
+    for _ in range(decoders):
+        tasks.put(None)
+
+    procs = [ctx.Process(target=_decoder, args=(shm.name, slot_shape, video_paths, sizes, tasks, free, work, threads))
+             for _ in range(decoders)]
+    pool = [ctx.Process(target=_worker, args=(shm.name, slot_shape, sizes, make_state, state_args, free, work, results))
+            for _ in range(workers)]
+    try:
+        for p in procs + pool:
+            p.start()
+        for p in procs:
+            # a decoder waits for free slots forever if every worker is gone
+            while p.is_alive():
+                p.join(timeout=0.5)
+                if not any(w.is_alive() for w in pool):
+                    raise RuntimeError("All worker processes exited before the decoders finished")
+        for _ in range(workers):
+            work.put(None)
+        merged, received = {}, 0
+        while received < workers:
+            try:
+                states = results.get(timeout=1.0)
+            except queue.Empty:
+                if not any(w.is_alive() for w in pool):
+                    break  # a worker was killed before reporting, see the exit codes below
+                continue
+            received += 1
+            for index, state in (states or {}).items():
+                if index in merged:
+                    merged[index].merge(state)
+                else:
+                    merged[index] = state
+        for p in pool:
+            p.join()
+        failed = [p.exitcode for p in procs + pool if p.exitcode != 0]
+        if failed:
+            raise RuntimeError(f"{len(failed)} of {len(procs + pool)} decoder/worker processes failed "
+                               f"(exit codes {failed}), the results would be incomplete")
+    finally:
+        for p in procs + pool:
+            if p.is_alive():
+                p.terminate()
+        shm.close()
+        shm.unlink()
+    return {video_paths[index]: state for index, state in merged.items()}
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+if __name__ == "__main__":
+    from hdr_stats import HDRStats, probe_transfer
+    from read_hdr_10bit import check_video_range
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--video_folder', type=str, required=True, help='Path to folder of clips')
+    parser.add_argument('--decoders', type=int, default=1, help='Decoder processes')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='Worker process counts to time')
+    parser.add_argument('--slots', type=int, default=None, help='Shared batches (default: workers + decoders)')
+    parser.add_argument('--batch_size', type=int, default=4, help='Frames per batch')
+    parser.add_argument('--threads', type=int, default=None, help='ffmpeg decode threads per decoder')
+    args = parser.parse_args()
+
+    vids = sorted(glob(os.path.join(args.video_folder, "*.mp4")))
+    state_args = [(10, 'pc' if check_video_range(v) in ['pc', 'jpeg'] else 'tv', probe_transfer(v)) for v in vids]
+    for workers in args.workers:
+        start = time.time()
+        states = run_shared(vids, HDRStats, state_args, args.decoders, workers, args.slots, args.batch_size, args.threads)
+        seconds = time.time() - start
+        frames = sum(s.frames for s in states.values())
+        print(f"{workers} workers, {args.decoders} decoders: {frames} frames in {seconds:.1f}s ({frames / seconds:.1f} frames/s)")
@@ -0,0 +1,197 @@
+"""
+    Read-ahead cache of the input videos on node-local disk.
+
+    The scripts know their work list up front; the cache copies the next --prefetch sources of that list into a local
+    folder (--cache_dir, e.g. the node's NVMe) while the current one is being encoded, so ffmpeg decodes from local
+    disk instead of stalling on the shared filesystem.
+        * use(path) hands out the local copy if it is complete, else the remote path (never waits for a copy)
+        * the cache is bounded in bytes (--cache_gb); least recently used copies are evicted, except the ones in use
+          and the ones prefetched for the next sources
+        * copies keep the file name (in a folder per source directory), so names parsed by the scripts are unchanged
+        * hits, misses and bytes are counted and printed by close()
+
+    One cache per process (folder hidro_cache_<pid>, removed on close); with several processes per node give each
+    its share of the local disk.
+
+    Usage:
+        cache = from_args(args)      # None without --cache_dir
+        cache.schedule(videos)
+        for video in videos:
+            with using(cache, video) as path:
+                ... ffmpeg -i path ...
+        cache.close()
+"""
+
+import os
+import time
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+class SourceCache:
+    """
+    Byte-bounded LRU cache with prefetching of the upcoming inputs.
+
+    Parameters:
+    - cache_dir: str, local folder
+    - max_bytes: int, cache size
+    - prefetch: int, number of upcoming sources to copy ahead
+    - copy_workers: int, concurrent copies
+    """
+    def __init__(self, cache_dir, max_bytes=100 << 30, prefetch=2, copy_workers=1):
+        self.root = os.path.join(cache_dir, f"hidro_cache_{os.getpid()}")
+        os.makedirs(self.root, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.prefetch = prefetch
+        self.executor = ThreadPoolExecutor(max_workers=copy_workers)
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # remote path -> {'local', 'size', 'ready', 'pins'}, least recently used first
+        self.used = 0
+        self.work = []
+        self.position = {}
+        self.stats = {'hits': 0, 'misses': 0, 'bytes_prefetched': 0, 'bytes_local': 0, 'bytes_remote': 0,
+                      'evicted': 0, 'skipped': 0, 'copy_time': 0.0}
+
+    def local_path(self, remote):
+        # one folder per source directory, so equal file names from different folders don't collide
+        folder = hashlib.md5(os.path.dirname(os.path.abspath(remote)).encode()).hexdigest()[:12]
+        return os.path.join(self.root, folder, os.path.basename(remote))
+
+    def schedule(self, paths):
+        """
+        Set the work list (in processing order) and start prefetching its head.
+        """
+        with self.lock:
+            self.work = list(paths)
+            self.position = {p: i for i, p in enumerate(self.work)}
+        self._prefetch_from(0)
+
+    def _upcoming(self, start):
+        return self.work[start:start + self.prefetch]
+
+    def _prefetch_from(self, start):
+        with self.lock:
+            for path in self._upcoming(start):
+                if path in self.entries:
+                    continue
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    continue
+                if not self._make_room(size, protect=set(self._upcoming(start))):
+                    self.stats['skipped'] += 1
+                    continue
+                self.entries[path] = {'local': self.local_path(path), 'size': size, 'ready': False, 'pins': 0}
+                self.used += size
+                self.executor.submit(self._copy, path)
+
+    def _make_room(self, size, protect):
+        # called with the lock held: evict least recently used copies that are complete, unused and not upcoming
+        if size > self.max_bytes:
+            return False
+        for path in list(self.entries):
+            if self.used + size <= self.max_bytes:
+                break
+            entry = self.entries[path]
+            if entry['ready'] and entry['pins'] == 0 and path not in protect:
+                self._evict(path)
+        return self.used + size <= self.max_bytes
+
+    def _evict(self, path):
+        entry = self.entries.pop(path)
+        self.used -= entry['size']
+        self.stats['evicted'] += 1
+        if os.path.exists(entry['local']):
+            os.remove(entry['local'])
+
+    def _copy(self, path):
+        entry = self.entries[path]
+        partial = entry['local'] + ".partial"
+        start = time.time()
+        try:
+            os.makedirs(os.path.dirname(entry['local']), exist_ok=True)
+            shutil.copyfile(path, partial)
+            if os.path.getsize(partial) != entry['size']:
+                raise IOError("size mismatch after copy")
+            os.replace(partial, entry['local'])
+        except Exception as e:
+            print(f"Prefetch of {path} failed ({e}), reading it remotely")
+            if os.path.exists(partial):
+                os.remove(partial)
+            with self.lock:
+                self.entries.pop(path, None)
+                self.used -= entry['size']
+            return
+        with self.lock:
+            entry['ready'] = True
+            self.stats['bytes_prefetched'] += entry['size']
+            self.stats['copy_time'] += time.time() - start
+
+    @contextmanager
+    def use(self, path):
+        """
+        Yield the path ffmpeg should read: the local copy if complete (kept while in use), else the remote path.
+        Also moves the prefetch window past this source.
+        """
+        with self.lock:
+            entry = self.entries.get(path)
+            hit = entry is not None and entry['ready']
+            if hit:
+                entry['pins'] += 1
+                self.entries.move_to_end(path)
+            self.stats['hits' if hit else 'misses'] += 1
+            size = entry['size'] if entry is not None else (os.path.getsize(path) if os.path.exists(path) else 0)
+            self.stats['bytes_local' if hit else 'bytes_remote'] += size
+            index = self.position.get(path)
+        if index is not None:
+            self._prefetch_from(index + 1)
+        try:
+            yield entry['local'] if hit else path
+        finally:
+            if hit:
+                with self.lock:
+                    entry['pins'] -= 1
+
+    def report(self):
+        s = self.stats
+        requests = s['hits'] + s['misses']
+        rate = s['bytes_prefetched'] / s['copy_time'] / 2**20 if s['copy_time'] else 0.0
+        return (f"Source cache: {s['hits']}/{requests} hits ({s['hits'] / max(requests, 1):.0%}), "
+                f"{s['bytes_local'] / 2**30:.2f} GB read locally, {s['bytes_remote'] / 2**30:.2f} GB remotely, "
+                f"{s['bytes_prefetched'] / 2**30:.2f} GB prefetched at {rate:.0f} MB/s, "
+                f"{s['evicted']} evicted, {s['skipped']} prefetches deferred (cache full)")
+
+    def close(self):
+        """
+        Stop prefetching, print the counters and remove the cached copies.
+        """
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        print(self.report())
+        shutil.rmtree(self.root, ignore_errors=True)
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+@contextmanager
+def using(cache, path):
+    """
+    cache.use(path) when there is a cache, otherwise path itself.
+    """
+    if cache is None:
+        yield path
+    else:
+        with cache.use(path) as local:
+            yield local
+
+def from_args(args):
+    if not getattr(args, 'cache_dir', None):
+        return None
+    return SourceCache(args.cache_dir, int(args.cache_gb * 2**30), args.prefetch)
+
+def add_cache_args(parser):
+    parser.add_argument('--cache_dir', type=str, default=None, help='Local folder to prefetch the input videos into (default: read in place)')
+    parser.add_argument('--cache_gb', type=float, default=100, help='Size of the local input cache')
+    parser.add_argument('--prefetch', type=int, default=2, help='Number of upcoming inputs to copy ahead')
+    return parser
@@ -0,0 +1,225 @@
+"""
+    Output staging on node-local scratch.
+
+    Encoders write their outputs into a scratch folder on the node (--scratch, e.g. $TMPDIR or /tmp); once the encode
+    is done and the files are non-empty, a background copier moves them to the final folder on the shared filesystem:
+        * at most --copy_workers transfers at a time per process, each one a large sequential write
+        * copied to a hidden .<name>.partial next to the target, verified (size, and a checksum read back from the
+          shared copy unless verify='size'), then renamed: outputs only become visible when complete, so the
+          "already done" checks of the scripts never see a half-written file
+        * scratch usage is bounded (--scratch_gb): a new encode waits while the scratch folder (all processes of the
+          node sharing it) plus the space reserved for running encodes would exceed the limit, unless its process has
+          nothing else in flight (so an output larger than the budget can't wait forever)
+    A failed copy keeps its scratch file (the path is printed) and is reported by wait()/close().
+
+    Use through staged(), which is a no-op without a stager:
+        with staged(stager, final_paths, reserve=estimated_bytes) as targets:
+            ... write targets (and sidecar files next to them) ...
+"""
+
+import os
+import time
+import shutil
+import socket
+import hashlib
+import threading
+import itertools
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+CHUNK = 8 << 20
+
+def _copy_checksum(src, dst):
+    # copy and hash in one pass over the source
+    digest = hashlib.blake2b()
+    with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+        while True:
+            chunk = fin.read(CHUNK)
+            if not chunk:
+                break
+            digest.update(chunk)
+            fout.write(chunk)
+        fout.flush()
+        os.fsync(fout.fileno())
+    return digest.hexdigest()
+
+def _checksum(path):
+    digest = hashlib.blake2b()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _folder_bytes(folder):
+    total = 0
+    for root, _, files in os.walk(folder):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass  # moved away by another process
+    return total
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+class OutputStager:
+    """
+    Scratch staging with a bounded background copier.
+
+    Parameters:
+    - scratch: str, node-local folder (a 'hidro_staging' subfolder is used, shared by the processes of the node)
+    - max_bytes: int, scratch budget
+    - copy_workers: int, concurrent copies of this process
+    - verify: 'checksum' (read the shared copy back) or 'size'
+    - poll: float, seconds between scratch checks while waiting for space
+    """
+    def __init__(self, scratch, max_bytes=50 << 30, copy_workers=2, verify='checksum', poll=2.0):
+        self.root = os.path.join(scratch, 'hidro_staging')
+        os.makedirs(self.root, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.verify = verify
+        self.poll = poll
+        self.prefix = f"{socket.gethostname()}_{os.getpid()}"
+        self.jobs = itertools.count()
+        self.executor = ThreadPoolExecutor(max_workers=copy_workers)
+        self.lock = threading.Lock()
+        self.space = threading.Condition(self.lock)
+        self.reserved = 0
+        self.futures = {}
+        self.stats = {'files': 0, 'bytes': 0, 'failed': 0, 'waited': 0.0, 'peak': 0}
+
+    def _reserve(self, nbytes):
+        # block while the scratch folder plus the encodes already running would go over the budget
+        start = time.time()
+        with self.space:
+            while True:
+                used = _folder_bytes(self.root) + self.reserved
+                busy = self.reserved > 0 or any(not f.done() for f in self.futures.values())
+                if used + nbytes <= self.max_bytes or not busy:
+                    break
+                self.space.wait(self.poll)
+            self.reserved += nbytes
+            self.stats['peak'] = max(self.stats['peak'], used + nbytes)
+            self.stats['waited'] += time.time() - start
+
+    def _release(self, nbytes):
+        with self.space:
+            self.reserved -= nbytes
+            self.space.notify_all()
+
+    @contextmanager
+    def stage(self, final_paths, reserve=0):
+        """
+        Yield scratch paths for final_paths; on a clean exit queue the copies of everything written in the job folder.
+        """
+        job = os.path.join(self.root, f"{self.prefix}_{next(self.jobs)}")
+        os.makedirs(job)
+        scratch = [os.path.join(job, os.path.basename(p)) for p in final_paths]
+        self._reserve(reserve)
+        try:
+            yield scratch
+        except BaseException:
+            shutil.rmtree(job, ignore_errors=True)
+            raise
+        finally:
+            self._release(reserve)
+
+        # verify the encode before anything goes to the shared filesystem
+        missing = [p for p, s in zip(final_paths, scratch) if not os.path.exists(s) or os.path.getsize(s) == 0]
+        if missing:
+            shutil.rmtree(job, ignore_errors=True)
+            raise RuntimeError(f"Encode produced missing or empty outputs: {missing}")
+
+        # sidecars etc. go to the folder of the output with the same name, else next to the first output
+        targets = {os.path.basename(p): p for p in final_paths}
+        folder = os.path.dirname(final_paths[0])
+        with self.lock:
+            for name in sorted(os.listdir(job)):
+                final = targets.get(name, os.path.join(folder, name))
+                self.futures[final] = self.executor.submit(self._copy, os.path.join(job, name), final, job)
+
+    def _copy(self, src, final, job):
+        partial = os.path.join(os.path.dirname(final), "." + os.path.basename(final) + ".partial")
+        size = os.path.getsize(src)
+        try:
+            digest = _copy_checksum(src, partial)
+            if os.path.getsize(partial) != size:
+                raise IOError(f"size mismatch after copy ({os.path.getsize(partial)} != {size})")
+            if self.verify == 'checksum' and _checksum(partial) != digest:
+                raise IOError("checksum mismatch after copy")
+            os.replace(partial, final)
+        except Exception as e:
+            if os.path.exists(partial):
+                os.remove(partial)
+            with self.lock:
+                self.stats['failed'] += 1
+            print(f"Copy of {final} failed ({e}), scratch copy kept at {src}")
+            raise
+        os.remove(src)
+        try:
+            os.rmdir(job)  # last file of the job
+        except OSError:
+            pass
+        with self.space:
+            self.stats['files'] += 1
+            self.stats['bytes'] += size
+            self.space.notify_all()
+        return final
+
+    def wait(self, final_paths):
+        """
+        Block until the given outputs are visible at their final location. Raises if one of their copies failed.
+        """
+        for path in final_paths:
+            future = self.futures.get(path)
+            if future is not None:
+                future.result()
+
+    def drain(self):
+        """
+        Wait for all queued copies (the stager stays usable). Returns the number of failed copies.
+        """
+        with self.lock:
+            futures = list(self.futures.items())
+        failed = sum(1 for _, f in futures if f.exception() is not None)
+        with self.lock:
+            for path, f in futures:
+                if self.futures.get(path) is f:
+                    del self.futures[path]
+        return failed
+
+    def close(self):
+        """
+        Drain all copies and print a summary. Returns the number of failed copies.
+        """
+        self.executor.shutdown(wait=True)
+        s = self.stats
+        print(f"Staging: {s['files']} files ({s['bytes'] / 2**30:.2f} GB) copied, {s['failed']} failed, "
+              f"peak scratch {s['peak'] / 2**30:.2f} GB, {s['waited']:.0f}s waiting for scratch space")
+        return s['failed']
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+@contextmanager
+def staged(stager, final_paths, reserve=0):
+    """
+    stager.stage(...) when staging is on, otherwise the final paths themselves.
+    """
+    if stager is None or not final_paths:
+        yield list(final_paths)
+    else:
+        with stager.stage(final_paths, reserve) as targets:
+            yield targets
+
+def from_args(args):
+    """
+    OutputStager from the --scratch options (None when --scratch is not given).
+    """
+    if not getattr(args, 'scratch', None):
+        return None
+    return OutputStager(args.scratch, int(args.scratch_gb * 2**30), args.copy_workers)
+
+def add_staging_args(parser):
+    parser.add_argument('--scratch', type=str, default=None, help='Node-local folder to encode into before copying out (default: write in place)')
+    parser.add_argument('--scratch_gb', type=float, default=50, help='Scratch budget shared by the processes of a node')
+    parser.add_argument('--copy_workers', type=int, default=2, help='Concurrent copies to the shared filesystem per process')
+    return parser
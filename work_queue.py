@@ -0,0 +1,282 @@
+"""
+    Shared work queue for multi-node runs, backed by a single SQLite file (no external service).
+
+    Tasks are (stage, item) pairs with the same stages as pipeline.py (classify, catalog, clips, ladder, frames).
+    Workers lease a task, keep the lease alive with heartbeats while ffmpeg runs, and on success enqueue the downstream
+    tasks the stage produced. If a worker dies its lease expires and the task goes back to the queue; a task that keeps
+    failing (poison file) is marked 'dead' after --max_attempts and left alone.
+
+    Seeding is idempotent (a task is unique per stage and item), so re-submitting a job resumes where it stopped, and
+    nodes can join a running job by starting more workers on the same database.
+
+    NOTE: put the database on the shared filesystem for multi-node runs. SQLite's rollback journal is used (WAL does
+          not work across nodes); all writes are short transactions, so contention is low even with hundreds of workers.
+
+    Workers append every classify/catalog result to their own JSONL file in --catalog_parts before the task is marked
+    done; the catalog command writes the same catalog files as pipeline.py from all of them.
+
+    Usage:
+        python work_queue.py --db queue.sqlite seed --catalog HDR_meta_data_filtered_bfpHDRLIVE_4K_50fps.csv
+        ibrun -n 100 python work_queue.py --db queue.sqlite work --stages clips ladder frames
+        python work_queue.py --db queue.sqlite progress
+        python work_queue.py --db queue.sqlite catalog      # after a run with classify/catalog tasks
+"""
+
+import os
+import json
+import time
+import socket
+import sqlite3
+import argparse
+import threading
+import traceback
+import pandas as pd
+import proc_trace
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+STAGES = ['classify', 'catalog', 'clips', 'ladder', 'frames']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    stage       TEXT NOT NULL,
+    item        TEXT NOT NULL,
+    status      TEXT NOT NULL DEFAULT 'queued',
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    worker      TEXT,
+    lease_until REAL,
+    last_error  TEXT,
+    updated     REAL,
+    UNIQUE (stage, item)
+);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, stage);
+"""
+
+class WorkQueue:
+    """
+    Lease-based task queue on a SQLite file.
+
+    Parameters:
+    - path: str, database file (created if missing)
+    - lease_seconds: float, how long a lease lasts without a heartbeat
+    - max_attempts: int, leases after which a failing task is marked 'dead'
+    """
+    def __init__(self, path, lease_seconds=600, max_attempts=3):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        db = sqlite3.connect(self.path, timeout=120)
+        db.executescript(SCHEMA)
+        db.close()
+
+    def _connect(self):
+        # one short-lived connection per operation: safe across fork and threads
+        db = sqlite3.connect(self.path, timeout=120, isolation_level=None)
+        return _Transaction(db)
+
+    def put(self, stage, items):
+        """
+        Enqueue items for a stage (already known items are ignored). Returns the number of new tasks.
+        """
+        rows = [(stage, json.dumps(item, sort_keys=True), time.time()) for item in items]
+        with self._connect() as db:
+            before = db.total_changes
+            db.executemany("INSERT OR IGNORE INTO tasks (stage, item, updated) VALUES (?, ?, ?)", rows)
+            return db.total_changes - before
+
+    def _expire(self, db, now):
+        # leases that ran out belong to dead (or hung) workers: retry, unless the task already used all its attempts
+        db.execute("UPDATE tasks SET status = 'dead', last_error = 'lease expired', updated = ? "
+                   "WHERE status = 'leased' AND lease_until < ? AND attempts >= ?", (now, now, self.max_attempts))
+        db.execute("UPDATE tasks SET status = 'queued', worker = NULL, updated = ? "
+                   "WHERE status = 'leased' AND lease_until < ?", (now, now))
+
+    def lease(self, worker, stages=None):
+        """
+        Lease the next queued task (most downstream stage first). Returns (task_id, stage, item) or None.
+        """
+        stages = stages or STAGES
+        order = " ".join(f"WHEN '{s}' THEN {i}" for i, s in enumerate(STAGES))
+        marks = ",".join("?" * len(stages))
+        now = time.time()
+        with self._connect() as db:
+            self._expire(db, now)
+            row = db.execute(f"SELECT id, stage, item FROM tasks WHERE status = 'queued' AND stage IN ({marks}) "
+                             f"ORDER BY CASE stage {order} END DESC, id LIMIT 1", stages).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE tasks SET status = 'leased', worker = ?, attempts = attempts + 1, lease_until = ?, "
+                       "updated = ? WHERE id = ?", (worker, now + self.lease_seconds, now, row[0]))
+        return row[0], row[1], json.loads(row[2])
+
+    def heartbeat(self, task_id, worker):
+        """
+        Extend the lease. Returns False if the lease was lost (expired and re-queued).
+        """
+        now = time.time()
+        with self._connect() as db:
+            cur = db.execute("UPDATE tasks SET lease_until = ?, updated = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+                             (now + self.lease_seconds, now, task_id, worker))
+            return cur.rowcount == 1
+
+    def complete(self, task_id, worker, outputs=()):
+        """
+        Mark a task done and enqueue its (next_stage, next_item) outputs in the same transaction.
+        """
+        now = time.time()
+        rows = [(stage, json.dumps(item, sort_keys=True), now) for stage, item in outputs]
+        with self._connect() as db:
+            db.executemany("INSERT OR IGNORE INTO tasks (stage, item, updated) VALUES (?, ?, ?)", rows)
+            cur = db.execute("UPDATE tasks SET status = 'done', lease_until = NULL, updated = ? WHERE id = ? AND worker = ?",
+                             (now, task_id, worker))
+            return cur.rowcount == 1
+
+    def fail(self, task_id, worker, error=''):
+        """
+        Give a task back after an error; it is retried until max_attempts, then marked 'dead'.
+        """
+        now = time.time()
+        with self._connect() as db:
+            db.execute("UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'dead' ELSE 'queued' END, "
+                       "worker = NULL, lease_until = NULL, last_error = ?, updated = ? WHERE id = ? AND worker = ?",
+                       (self.max_attempts, error[-2000:], now, task_id, worker))
+
+    def progress(self):
+        """
+        Task counts per stage and status, as a DataFrame.
+        """
+        with self._connect() as db:
+            self._expire(db, time.time())
+            rows = db.execute("SELECT stage, status, COUNT(*) FROM tasks GROUP BY stage, status").fetchall()
+        df = pd.DataFrame(rows, columns=['stage', 'status', 'count'])
+        df = df.pivot(index='stage', columns='status', values='count').fillna(0).astype(int)
+        return df.reindex([s for s in STAGES if s in df.index])
+
+    def active(self, stages=None):
+        """
+        True while tasks of the given stages are queued, or any task is leased (it may still produce work).
+        """
+        stages = stages or STAGES
+        marks = ",".join("?" * len(stages))
+        with self._connect() as db:
+            self._expire(db, time.time())
+            queued = db.execute(f"SELECT COUNT(*) FROM tasks WHERE status = 'queued' AND stage IN ({marks})", stages).fetchone()[0]
+            leased = db.execute("SELECT COUNT(*) FROM tasks WHERE status = 'leased'").fetchone()[0]
+        return queued + leased > 0
+
+class _Transaction:
+    # BEGIN IMMEDIATE takes the write lock up front, so concurrent leases can't hand out the same task
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute("BEGIN IMMEDIATE")
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.db.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.db.close()
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+"""
+    Worker loop: lease, run the stage function with a heartbeat running, complete or fail. Returns when there is no
+    work left for this worker's stages and no task is leased anywhere.
+"""
+def run_worker(queue, handlers, stages=None, worker=None, poll=10):
+    worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+    stages = stages or list(handlers)
+    done = 0
+    while True:
+        task = queue.lease(worker, stages)
+        if task is None:
+            if not queue.active(stages):
+                break
+            time.sleep(poll)
+            continue
+
+        task_id, stage, item = task
+        stop = threading.Event()
+        beat = threading.Thread(target=_heartbeat, args=(queue, task_id, worker, stop), daemon=True)
+        beat.start()
+        try:
+            with proc_trace.tag(stage=stage):
+                outputs = list(handlers[stage](item) or [])
+        except Exception:
+            print(f"[{worker}] {stage} failed on {item}")
+            queue.fail(task_id, worker, traceback.format_exc())
+        else:
+            queue.complete(task_id, worker, outputs)
+            done += 1
+        finally:
+            stop.set()
+            beat.join()
+    print(f"[{worker}] no work left, {done} tasks done")
+    return done
+
+def _heartbeat(queue, task_id, worker, stop):
+    while not stop.wait(queue.lease_seconds / 3):
+        if not queue.heartbeat(task_id, worker):
+            print(f"[{worker}] lost the lease on task {task_id}")
+            return
+
+#--------------------------------------------------------------*****--------------------------------------------------------------#
+if __name__ == "__main__":
+    from pipeline import DataPipeline, add_stage_args, check_stage_args, merge_catalog_parts
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db', type=str, required=True, help='SQLite queue file (on the shared filesystem)')
+    parser.add_argument('--lease_seconds', type=float, default=600, help='Lease length without heartbeat')
+    parser.add_argument('--max_attempts', type=int, default=3, help='Attempts before a task is marked dead')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    seed = commands.add_parser('seed', help='Add tasks')
+    seed.add_argument('--video_root', type=str, default=None, help='Seed classify tasks for every video in the folder')
+    seed.add_argument('--catalog', type=str, default=None, help='Seed clips tasks from a filtered metadata csv')
+    seed.add_argument('--clips_path', type=str, default=None, help='Seed ladder tasks for every clip in the folder')
+
+    work = commands.add_parser('work', help='Pull and run tasks until the queue is drained')
+    work.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES, help='Stages this worker runs')
+    work.add_argument('--poll', type=float, default=10, help='Seconds between polls when only leased tasks are left')
+    work.add_argument('--catalog_parts', type=str, default="./catalog_parts/", help='Folder for the catalog share of each worker')
+    add_stage_args(work)
+
+    commands.add_parser('progress', help='Show task counts per stage and status')
+    catalog = commands.add_parser('catalog', help='Write the catalog files from the shares of all workers')
+    catalog.add_argument('--catalog_parts', type=str, default="./catalog_parts/", help='Folder of the catalog shares')
+    args = parser.parse_args()
+
+    queue = WorkQueue(args.db, args.lease_seconds, args.max_attempts)
+
+    if args.command == 'seed':
+        added = 0
+        if args.video_root:
+            videos = [os.path.join(args.video_root, v) for v in sorted(os.listdir(args.video_root))
+                      if v.split('.')[-1] in ['mp4', 'mkv', 'mov', 'webm']]
+            added += queue.put('classify', videos)
+        if args.catalog:
+            df = pd.read_csv(args.catalog)
+            added += queue.put('clips', [{'video_path': r['video_path'], 'color_transfer': r['color_transfer']} for _, r in df.iterrows()])
+        if args.clips_path:
+            added += queue.put('ladder', [os.path.join(args.clips_path, c) for c in sorted(os.listdir(args.clips_path)) if c.endswith('.mp4')])
+        print(f"{added} new tasks")
+
+    elif args.command == 'work':
+        check_stage_args(work, args)
+        for folder in [args.save_clips, args.save_ladder, args.save_frames]:
+            os.makedirs(folder, exist_ok=True)
+        worker = f"{socket.gethostname()}:{os.getpid()}"
+        os.makedirs(args.catalog_parts, exist_ok=True)
+        # the catalog results only live in this process otherwise; the catalog command merges all workers' files
+        data = DataPipeline(args, os.path.join(args.catalog_parts, f"{worker.replace(':', '_')}_{int(time.time())}.jsonl"))
+        handlers = {'classify': data.classify, 'catalog': data.catalog_video, 'clips': data.clips,
+                    'ladder': data.ladder_encode, 'frames': data.frames}
+        run_worker(queue, handlers, args.stages, worker, poll=args.poll)
+        data.close()
+
+    elif args.command == 'catalog':
+        hdr, non_hdr = merge_catalog_parts(args.catalog_parts)
+        print(f"Catalog written: {hdr} HDR and {non_hdr} non-HDR videos")
+
+    print(queue.progress())